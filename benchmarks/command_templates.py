@@ -0,0 +1,101 @@
+'''
+CPU time to encode a command: sendMessage path vs. a pre-encoded CommandTemplate
+
+The sendMessage path parses the command string, sets the qid and the fields
+and encodes it again (Serial._prepare_message + JsonCodec.encode), measured
+with every installed JSON backend. The template path fills the qid and the
+fields into the bytes encoded once with a single formatting call, it does not
+depend on the backend. The dict path is what sendTemplate does in addition
+with a coalescing key or a non-JSON codec (CommandTemplate.as_dict).
+
+usage: python benchmarks/command_templates.py [--repeat 20000]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+from commandtemplate import CommandTemplate  # noqa: E402
+from payloadcodec import JSON_BACKENDS, JsonCodec  # noqa: E402
+
+MOTOR_ACT = {"task": "/motor_act", "motor": {"steppers": [
+    {"stepperid": 1, "position": 1000, "speed": 5000, "isabs": 0, "isaccel": 0}]}}
+LEDARR_ACT = {"task": "/ledarr_act", "led": {"LEDArrMode": 1, "led_array": [{"id": 0, "r": 0, "g": 0, "b": 0}]}}
+
+
+def installed_backends():
+    backends = []
+    for name, backend in JSON_BACKENDS.items():
+        try:
+            backend()
+        except ImportError:
+            continue
+        backends.append(name)
+    return backends
+
+
+def per_call(function, repeat):
+    cTime = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    return (time.perf_counter() - cTime) / repeat
+
+
+def measure(command, fields, repeat):
+    commandString = json.dumps(command)
+    paths = dict(fields)
+    results = {}
+
+    for backendName in installed_backends():
+        codec = JsonCodec(backendName)
+        loads = codec.backend.loads
+
+        def send_message_path(i):
+            # what sendMessage does with the usual string commands
+            data = loads(commandString)
+            data["qid"] = i
+            for path in paths.values():
+                document = data
+                for key in path[:-1]:
+                    document = document[key]
+                document[path[-1]] = i
+            return codec.encode(data)
+
+        results[f"message_{backendName}_us"] = round(per_call(send_message_path, repeat) * 1e6, 2)
+
+    template = CommandTemplate(command, paths)
+    values = {name: 0 for name in paths}
+
+    def template_path(i):
+        for name in values:
+            values[name] = i
+        return template.render(qid=i, **values)
+
+    def dict_path(i):
+        for name in values:
+            values[name] = i
+        return template.as_dict(qid=i, **values)
+
+    results["template_us"] = round(per_call(template_path, repeat) * 1e6, 2)
+    results["template_dict_us"] = round(per_call(dict_path, repeat) * 1e6, 2)
+    results["bytes"] = len(template_path(0))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+    results = {
+        "motor_act": measure(MOTOR_ACT, {"position": ("motor", "steppers", 0, "position")}, args.repeat),
+        "ledarr_act": measure(LEDARR_ACT, {"id": ("led", "led_array", 0, "id"), "r": ("led", "led_array", 0, "r"),
+                                           "g": ("led", "led_array", 0, "g"), "b": ("led", "led_array", 0, "b")},
+                              args.repeat),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+'''
+Thread count and round trip latency of a DeviceManager serving 1, 4 and 16 devices
+
+The devices are the pseudo terminals of the emulator in shared_runtime.py,
+served by a child process. All of them are attached to one DeviceManager and
+commands are sent round robin through the sendMessage of each device.
+
+usage: python benchmarks/device_manager.py [--devices 1 4 16] [--commands 200]
+'''
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+from devicemanager import DeviceManager  # noqa: E402
+from shared_runtime import serve_devices  # noqa: E402
+
+
+def measure(ports, nCommands):
+    threadsBefore = threading.active_count()
+    manager = DeviceManager(deviceCachePath=None)
+    manager.logger.setLevel(logging.WARNING)
+    for port in ports:
+        manager.add_device(port=port)
+    devices = list(manager)
+    threadsOpen = threading.active_count()
+
+    latencies = []
+    for i in range(nCommands):
+        ser = devices[i % len(devices)]
+        cTime = time.perf_counter()
+        result = ser.sendMessage({"task": "/state_get"}, mTimeout=2)
+        latencies.append(time.perf_counter() - cTime)
+        if not isinstance(result, list):
+            raise RuntimeError(f"No response from {ser.serial_device.port}")
+    latencies.sort()
+
+    attached = sum(device["attached"] for device in manager.health().values())
+    manager.close()
+    return {"devices": len(ports),
+            "attached": attached,
+            "threads_before": threadsBefore,
+            "threads_open": threadsOpen,
+            "threads_after_close": threading.active_count(),
+            "rtt_p50_ms": round(statistics.median(latencies) * 1e3, 3),
+            "rtt_p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))] * 1e3, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--commands", type=int, default=200)
+    args = parser.parse_args()
+    results = []
+    for nDevices in args.devices:
+        parentConnection, childConnection = multiprocessing.Pipe()
+        emulator = multiprocessing.Process(target=serve_devices, args=(nDevices, childConnection), daemon=True)
+        emulator.start()
+        ports = parentConnection.recv()
+        try:
+            results.append(measure(ports, args.commands))
+        finally:
+            emulator.terminate()
+            emulator.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+'''
+End-to-end latency, throughput and CPU time of the four clients on a pty loopback
+
+A child process serves one pseudo terminal per client with the firmware
+emulator (uc2emulator), so the clients find, open and talk to it like to a
+UC2 board. Every client runs the scenarios of scenarios.py; the CPU time is
+the one of the benchmark process (client threads included, emulator excluded).
+--save-baseline writes the results, --baseline compares a run against them and
+exits with 1 if a metric got worse by more than --tolerance.
+
+usage: python benchmarks/e2e [--clients mSerial ...] [--commands 100] [--baudrate 0] [--latency 0]
+                             [--save-baseline FILE] [--baseline FILE] [--tolerance 0.25]
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sermon"))
+import uc2emulator  # noqa: E402
+from clients import CLIENTS  # noqa: E402
+from scenarios import SCENARIOS  # noqa: E402
+
+# metric -> True if a higher value is better, compared against the baseline
+COMPARED_METRICS = {"p50_ms": False, "p99_ms": False, "throughput_per_s": True, "cpu_ms_per_command": False}
+
+
+def serve_emulators(nDevices, baudrate, latency, connection):
+    '''
+    Child process: one emulated board per client, all answered from one selector loop
+    '''
+    devices = [uc2emulator.PtyDevice(baudrate=baudrate or None, latency=latency) for _ in range(nDevices)]
+    connection.send([device.port for device in devices])
+    uc2emulator.serve(devices)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(client, scenario, nCommands, qids, rng):
+    commands = scenario.commands(nCommands, qids, rng)
+    if scenario.burstSize:
+        groups = [commands[i:i + scenario.burstSize] for i in range(0, len(commands), scenario.burstSize)]
+        send = client.burst
+    else:
+        groups = commands
+        send = client.request
+    latencies = []
+    nFailed = 0
+    cpuTime = time.process_time()
+    startTime = time.perf_counter()
+    for group in groups:
+        cTime = time.perf_counter()
+        result = send(group)
+        latencies.append(time.perf_counter() - cTime)
+        if scenario.burstSize:
+            nFailed += sum(1 for response in result if response is None)
+        elif result is None:
+            nFailed += 1
+    duration = time.perf_counter() - startTime
+    cpuTime = time.process_time() - cpuTime
+    latencies.sort()
+    return {"commands": len(commands),
+            "failed": nFailed,
+            "p50_ms": round(percentile(latencies, .5) * 1e3, 3),
+            "p99_ms": round(percentile(latencies, .99) * 1e3, 3),
+            "throughput_per_s": round(len(commands) / duration, 1),
+            "cpu_ms_per_command": round(cpuTime / len(commands) * 1e3, 4)}
+
+
+def run_client(clientClass, port, args):
+    cTime = time.perf_counter()
+    client = clientClass(port, args.timeout)
+    results = {"open_s": round(time.perf_counter() - cTime, 3)}
+    qids = iter(range(1, 1 << 30))
+    rng = random.Random(args.seed)
+    try:
+        for scenario in SCENARIOS:
+            results[scenario.name] = run_scenario(client, scenario, args.commands, qids, rng)
+    finally:
+        client.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Relative change of every metric against the baseline, regressions are
+    the changes for the worse beyond tolerance
+    '''
+    comparison = {}
+    regressions = []
+    for clientName, scenarios in results.items():
+        for scenarioName, metrics in scenarios.items():
+            reference = baseline.get(clientName, {}).get(scenarioName)
+            if not isinstance(metrics, dict) or not isinstance(reference, dict):
+                continue
+            changes = {}
+            for metric, isHigherBetter in COMPARED_METRICS.items():
+                if not reference.get(metric):
+                    continue
+                change = metrics[metric] / reference[metric] - 1
+                changes[metric] = round(change, 3)
+                if (-change if isHigherBetter else change) > tolerance:
+                    regressions.append(f"{clientName}/{scenarioName}/{metric}")
+            comparison.setdefault(clientName, {})[scenarioName] = changes
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", nargs="+", choices=list(CLIENTS), default=list(CLIENTS))
+    parser.add_argument("--commands", type=int, default=100, help="commands per scenario")
+    parser.add_argument("--baudrate", type=int, default=0, help="emulated wire speed, 0 for none")
+    parser.add_argument("--latency", type=float, default=0., help="seconds the emulator waits before answering")
+    parser.add_argument("--timeout", type=float, default=5., help="seconds to wait for a response")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--baseline", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=.25, help="relative change that counts as regression")
+    args = parser.parse_args()
+
+    parentConnection, childConnection = multiprocessing.Pipe()
+    emulator = multiprocessing.Process(target=serve_emulators, daemon=True,
+                                       args=(len(args.clients), args.baudrate, args.latency, childConnection))
+    emulator.start()
+    ports = parentConnection.recv()
+    results = {}
+    try:
+        for clientName, port in zip(args.clients, ports):
+            results[clientName] = run_client(CLIENTS[clientName], port, args)
+    finally:
+        emulator.terminate()
+        emulator.join()
+
+    report = {"config": {"commands": args.commands, "baudrate": args.baudrate, "latency": args.latency,
+                         "python": sys.version.split()[0]},
+              "results": results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        report["comparison"], regressions = compare(results, baseline["results"], args.tolerance)
+        report["regressions"] = regressions
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+'''
+One adapter per client with the same three calls: request(command) sends a
+command and waits for its response, burst(commands) hands all commands to the
+client at once and waits for all responses, close() closes the port.
+Both return None for a command that was not answered.
+'''
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import mSerial
+import serialAsyncIO
+import serialAsyncSyncIO
+from miniTermSimple import SimpleSerialComm
+
+
+class MSerialClient:
+    name = "mSerial"
+
+    def __init__(self, port, timeout):
+        self.timeout = timeout
+        # the constructor finds and opens the device
+        self.serial = mSerial.Serial(port, deviceCachePath=None)
+        self.serial._logger.setLevel(logging.WARNING)
+        if not self.serial.is_connected:
+            raise RuntimeError(f"mSerial did not connect to {port}")
+
+    def request(self, command):
+        return self.serial.sendMessage(command, mTimeout=self.timeout)
+
+    def burst(self, commands):
+        return self.serial.sendMessages(commands, mTimeout=self.timeout)
+
+    def close(self):
+        self.serial.close()
+
+
+class AsyncSyncClient:
+    name = "serialAsyncSyncIO"
+
+    def __init__(self, port, timeout):
+        self.timeout = timeout
+        self.serial = serialAsyncSyncIO.Serial(port)
+        self.serial._logger.setLevel(logging.WARNING)
+        self.serial.open_sync(port)
+        if not self.serial.is_connected:
+            raise RuntimeError(f"serialAsyncSyncIO did not connect to {port}")
+
+    def request(self, command):
+        return self.serial.send_message_sync(command, mTimeout=self.timeout)
+
+    def burst(self, commands):
+        async def gather():
+            return await asyncio.gather(*(self.serial.sendMessage(command, mTimeout=self.timeout)
+                                          for command in commands))
+        return self.serial.runtime.run(gather())
+
+    def close(self):
+        self.serial.close()
+
+
+class AsyncClient:
+    name = "serialAsyncIO"
+
+    def __init__(self, port, timeout):
+        self.timeout = timeout
+        # the client lives on a loop of its own that only runs while a call is waiting
+        self.loop = asyncio.new_event_loop()
+        self.serial = serialAsyncIO.Serial(port)
+        self.serial._logger.setLevel(logging.WARNING)
+        self.loop.run_until_complete(self.serial.open(port))
+        if not self.serial.is_connected:
+            raise RuntimeError(f"serialAsyncIO did not connect to {port}")
+
+    def request(self, command):
+        return self.loop.run_until_complete(self.serial.sendMessage(command, mTimeout=self.timeout))
+
+    def burst(self, commands):
+        async def gather():
+            return await asyncio.gather(*(self.serial.sendMessage(command, mTimeout=self.timeout)
+                                          for command in commands))
+        return self.loop.run_until_complete(gather())
+
+    def close(self):
+        self.serial.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+
+class SimpleClient:
+    '''
+    SimpleSerialComm prints every line it sends and receives, stdout is muted while it is open
+    '''
+    name = "SimpleSerialComm"
+
+    def __init__(self, port, timeout):
+        self.timeout = timeout
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            self.serial = SimpleSerialComm(port, baudrate=115200)
+            self.serial.start_reading()
+        except Exception:
+            self._restore_stdout()
+            raise
+
+    def _answered(self, qid):
+        return qid in self.serial.queueFinalizedQueryIDs
+
+    def request(self, command):
+        self.serial.send_message(json.dumps(command), mTimeout=self.timeout)
+        return True if self._answered(command["qid"]) else None
+
+    def burst(self, commands):
+        for command in commands:
+            self.serial.send_message(json.dumps(command), blocking=False)
+        deadline = time.monotonic() + self.timeout
+        while not all(self._answered(command["qid"]) for command in commands) and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return [True if self._answered(command["qid"]) else None for command in commands]
+
+    def close(self):
+        try:
+            self.serial.stop_reading()
+        finally:
+            self._restore_stdout()
+
+    def _restore_stdout(self):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+CLIENTS = {client.name: client for client in (MSerialClient, AsyncSyncClient, AsyncClient, SimpleClient)}
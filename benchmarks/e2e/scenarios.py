@@ -0,0 +1,51 @@
+'''
+The command sequences of the benchmark, modeled on the __main__ demos of the clients
+'''
+
+
+def motor_act(qid, position=1000):
+    return {"task": "/motor_act",
+            "motor": {"steppers": [{"stepperid": 1, "position": position, "speed": 5000, "isabs": 0, "isaccel": 0},
+                                   {"stepperid": 2, "position": position, "speed": 5000, "isabs": 0, "isaccel": 0}]},
+            "qid": qid}
+
+
+def ledarr_act(qid, ids, rng):
+    return {"task": "/ledarr_act",
+            "led": {"LEDArrMode": 0,
+                    "led_array": [{"id": i, "r": rng.randrange(55), "g": rng.randrange(55), "b": rng.randrange(55)}
+                                  for i in ids]},
+            "qid": qid}
+
+
+def state_get(qid):
+    return {"task": "/state_get", "qid": qid}
+
+
+class Scenario:
+    '''
+    nCommands commands, sent one after the other (every command waits for its
+    response) or, with burstSize, in bursts of burstSize commands handed to the
+    client at once; the latency of a burst is the time until its last response
+    '''
+    def __init__(self, name, build, burstSize=None):
+        self.name = name
+        self.build = build      # build(qid, rng) returns the command with that qid
+        self.burstSize = burstSize
+
+    def commands(self, nCommands, qids, rng):
+        return [self.build(next(qids), rng) for _ in range(nCommands)]
+
+
+def _split_ledarr(qid, rng):
+    # the two halves of the long LED array command of the demos, alternating
+    return ledarr_act(qid, range(0, 20) if qid % 2 else range(28, 64), rng)
+
+
+SCENARIOS = (
+    Scenario("motor_act", lambda qid, rng: motor_act(qid, rng.randrange(-1000, 1000))),
+    Scenario("ledarr_split", _split_ledarr),
+    Scenario("state_get_storm", lambda qid, rng: state_get(qid)),
+    Scenario("pipelined_burst", lambda qid, rng: motor_act(qid, rng.randrange(-1000, 1000)), burstSize=16),
+)
+
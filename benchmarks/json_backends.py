@@ -0,0 +1,101 @@
+'''
+Parse and serialize throughput of the JSON backends on UC2 frames
+
+Parsing is measured on response frames as the firmware prints them
+(pretty printed between "++" and "--") and goes through FrameParser and
+decode_frame like in the clients; serializing is measured on the commands
+of the mSerial.py demo, encoded to the bytes that are written to the port.
+
+usage: python benchmarks/json_backends.py [--repeat 2000]
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+import payloadcodec  # noqa: E402
+from framing import FrameParser, decode_frame  # noqa: E402
+
+
+def led_array(ids):
+    rng = random.Random(ids[0])
+    return [{"id": i, "r": rng.randint(0, 54), "g": rng.randint(0, 54), "b": rng.randint(0, 54)} for i in ids]
+
+
+RESPONSES = {
+    "ack": {"qid": 17, "success": 1},
+    "state_get": {"identifier_name": "UC2_Feather", "identifier_id": "V2.0", "identifier_date": "Mar 10 2024 13:43:21",
+                  "identifier_author": "BD", "IDENTIFIER_NAME": "uc2-esp", "configIsSet": 0, "pindef": "UC2_3",
+                  "qid": 5},
+    "motor_get": {"motor": {"steppers": [
+        {"stepperid": i, "position": 1000 * i, "isActivated": 1, "isDone": 1, "isEnabled": 1, "dirpin": 16 + i,
+         "steppin": 26 + i, "enablepin": 12, "maxPos": 100000, "minPos": -100000, "triggerPeriod": -1,
+         "isStop": 0, "speed": 5000} for i in range(4)]}, "qid": 8},
+    "ledarr_get": {"led": {"ledArrPin": 4, "ledArrNum": 64, "led_array": led_array(list(range(64)))}, "qid": 9},
+}
+
+COMMANDS = {
+    "motor_act": {"task": "/motor_act", "motor": {"steppers": [
+        {"stepperid": 1, "position": 1000, "speed": 5000, "isabs": 0, "isaccel": 0},
+        {"stepperid": 2, "position": 1000, "speed": 5000, "isabs": 0, "isaccel": 0}]}, "qid": 1},
+    "ledarr_act_64": {"task": "/ledarr_act", "led": {"LEDArrMode": 0, "led_array": led_array(list(range(64)))},
+                      "qid": 4},
+    "state_get": {"task": "/state_get", "qid": 5},
+}
+
+
+def text_frame(document):
+    return b"++\n" + json.dumps(document, indent="\t").encode("utf-8") + b"\n--\n"
+
+
+def best_of(function, repeat, rounds=5):
+    timings = []
+    for _ in range(rounds):
+        cTime = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        timings.append((time.perf_counter() - cTime) / repeat)
+    return min(timings)
+
+
+def measure_parse(frame, repeat):
+    framer = FrameParser()
+
+    def parse():
+        for payload in framer.feed(frame):
+            decode_frame(payload)
+    duration = best_of(parse, repeat)
+    return {"frame_bytes": len(frame), "us_per_frame": round(duration * 1e6, 2),
+            "frames_per_s": round(1 / duration), "MB_per_s": round(len(frame) / duration / 1e6, 1)}
+
+
+def measure_serialize(command, repeat):
+    size = len(payloadcodec.json_dumps(command))
+    duration = best_of(lambda: payloadcodec.json_dumps(command), repeat)
+    return {"command_bytes": size, "us_per_command": round(duration * 1e6, 2),
+            "MB_per_s": round(size / duration / 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    results = {}
+    for name in payloadcodec.JSON_BACKENDS:
+        try:
+            payloadcodec.set_json_backend(name)
+        except ImportError:
+            continue
+        results[name] = {
+            "parse": {key: measure_parse(text_frame(document), args.repeat) for key, document in RESPONSES.items()},
+            "serialize": {key: measure_serialize(command, args.repeat) for key, command in COMMANDS.items()},
+        }
+    payloadcodec.set_json_backend()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
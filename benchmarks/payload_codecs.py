@@ -0,0 +1,73 @@
+'''
+Bytes on the wire and encode/decode time of the payload codecs
+
+Uses the command shapes of the mSerial.py demo (/motor_act, the two halves of
+the /ledarr_act split test, /state_get) plus the full 64 LED array. For each
+available codec the size of the command as sent by the host and of the same
+document framed the way the device sends it back is reported.
+
+usage: python benchmarks/payload_codecs.py [--repeat 2000]
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+from framing import encode_binary_frame  # noqa: E402
+from payloadcodec import available_codecs, get_codec  # noqa: E402
+
+
+def led_array_command(ids, qid):
+    rng = random.Random(ids[0])
+    return {"task": "/ledarr_act", "led": {"LEDArrMode": 0, "led_array": [
+        {"id": i, "r": rng.randint(0, 54), "g": rng.randint(0, 54), "b": rng.randint(0, 54)} for i in ids]},
+        "qid": qid}
+
+
+PAYLOADS = {
+    "motor_act": {"task": "/motor_act", "motor": {"steppers": [
+        {"stepperid": 1, "position": 1000, "speed": 5000, "isabs": 0, "isaccel": 0},
+        {"stepperid": 2, "position": 1000, "speed": 5000, "isabs": 0, "isaccel": 0}]}, "qid": 1},
+    "ledarr_act_0-19": led_array_command(list(range(0, 20)), 2),
+    "ledarr_act_28-63": led_array_command(list(range(28, 64)), 3),
+    "ledarr_act_64": led_array_command(list(range(0, 64)), 4),
+    "state_get": {"task": "/state_get", "qid": 5},
+}
+
+
+def text_frame(document):
+    # the firmware pretty prints its answers between "++" and "--"
+    return b"++\n" + json.dumps(document, indent="\t").encode("utf-8") + b"\n--\n"
+
+
+def measure(codecName, document, repeat):
+    codec = get_codec(codecName)
+    payload = codec.encode(document)
+    if codec.isBinary:
+        hostBytes = deviceBytes = len(encode_binary_frame(payload))
+    else:
+        hostBytes = len(payload)
+        deviceBytes = len(text_frame(document))
+    encodeTime = timeit.timeit(lambda: codec.encode(document), number=repeat) / repeat
+    decodeTime = timeit.timeit(lambda: codec.decode(payload), number=repeat) / repeat
+    return {"codec": codecName,
+            "bytes_host_to_device": hostBytes,
+            "bytes_device_to_host": deviceBytes,
+            "encode_us": round(encodeTime * 1e6, 2),
+            "decode_us": round(decodeTime * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    results = {name: [measure(codecName, document, args.repeat) for codecName in available_codecs()]
+               for name, document in PAYLOADS.items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
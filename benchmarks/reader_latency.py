@@ -0,0 +1,108 @@
+'''
+Compare the receive latency of the "select" and the "poll" reader of mSerial.Serial
+
+A pseudo terminal pair stands in for the ESP32: the master side announces
+itself like the UC2 firmware during the handshake and then sends unsolicited
+frames at random intervals. The time between writing a frame on the master
+and its callback firing on the host is recorded, as well as the CPU time the
+process burns while the link is idle.
+
+usage: python benchmarks/reader_latency.py [--frames 200] [--idle 2]
+'''
+import argparse
+import json
+import logging
+import os
+import pty
+import random
+import statistics
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+import mSerial  # noqa: E402
+
+
+class PtyDevice:
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._announcing = False
+
+    def start_announcing(self):
+        # repeat the boot banner until the host has finished its handshake
+        self._announcing = True
+
+        def announce():
+            while self._announcing:
+                os.write(self.master, b"on port 80\n")
+                time.sleep(0.2)
+        threading.Thread(target=announce, daemon=True).start()
+
+    def stop_announcing(self):
+        self._announcing = False
+
+    def send_frame(self, payload):
+        os.write(self.master, b"++\n" + json.dumps(payload, indent=1).encode("utf-8") + b"\n--\n")
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def measure(readMode, nFrames, idleTime):
+    device = PtyDevice()
+    device.start_announcing()
+    ser = mSerial.Serial(device.port, readMode=readMode)
+    ser._logger.setLevel(logging.WARNING)
+    device.stop_announcing()
+    time.sleep(0.3)
+
+    received = {}
+    allReceived = threading.Event()
+
+    def on_frame(dictionary):
+        received[dictionary["ts"]] = time.perf_counter()
+        if len(received) == nFrames:
+            allReceived.set()
+    ser.register_callback(on_frame, "ts")
+
+    sent = {}
+    for i in range(nFrames):
+        sent[i] = time.perf_counter()
+        device.send_frame({"qid": 0, "ts": i})
+        time.sleep(random.uniform(0.001, 0.02))
+    allReceived.wait(5)
+
+    cpuStart = time.process_time()
+    time.sleep(idleTime)
+    idleCpu = time.process_time() - cpuStart
+
+    ser.close()
+    device.close()
+
+    latencies = sorted((received[i] - sent[i]) * 1e3 for i in received)
+    return {
+        "readMode": readMode,
+        "frames": len(latencies),
+        "latency_ms_p50": round(statistics.median(latencies), 3),
+        "latency_ms_p99": round(latencies[int(0.99 * (len(latencies) - 1))], 3),
+        "latency_ms_max": round(latencies[-1], 3),
+        "idle_cpu_s_per_s": round(idleCpu / idleTime, 5),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=2.)
+    args = parser.parse_args()
+    results = [measure(readMode, args.frames, args.idle) for readMode in ("poll", "select")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+'''
+Thread count and round trip latency of serialAsyncSyncIO for 1, 4 and 16 devices
+
+The devices are pseudo terminals served by a child process (so that its
+threads do not show up in the count): each one repeats the boot banner
+until the host talks to it and then acknowledges every command with a frame
+carrying its qid. The host opens one serialAsyncSyncIO.Serial per device and
+sends commands round robin through send_message_sync.
+
+usage: python benchmarks/shared_runtime.py [--devices 1 4 16] [--commands 200]
+'''
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import pty
+import re
+import selectors
+import statistics
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sermon"))
+import serialAsyncSyncIO  # noqa: E402
+
+_QID = re.compile(rb'"qid"\s*:\s*(\d+)')
+
+
+def serve_devices(nDevices, connection):
+    '''
+    Child process: create nDevices pty pairs and answer on all of them from one selector loop
+    '''
+    selector = selectors.DefaultSelector()
+    devices = []
+    for _ in range(nDevices):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        devices.append({"master": master, "slave": slave, "buffer": b"", "isAnnouncing": True})
+        selector.register(master, selectors.EVENT_READ, devices[-1])
+    connection.send([os.ttyname(device["slave"]) for device in devices])
+    lastBanner = 0.
+    while True:
+        now = time.monotonic()
+        if now - lastBanner > 0.2:
+            lastBanner = now
+            for device in devices:
+                if device["isAnnouncing"]:
+                    os.write(device["master"], b"on port 80\n{'setup':'done'}\n")
+        for key, _ in selector.select(0.05):
+            device = key.data
+            try:
+                data = os.read(device["master"], 4096)
+            except OSError:
+                continue
+            device["isAnnouncing"] = False
+            device["buffer"] += data
+            while b"}" in device["buffer"]:
+                message, _, device["buffer"] = device["buffer"].partition(b"}")
+                match = _QID.search(message)
+                if match:
+                    frame = b'++\n{\n\t"qid": %s,\n\t"success": 1\n}\n--\n' % match.group(1)
+                    os.write(device["master"], frame)
+
+
+def measure(ports, nCommands):
+    threadsBefore = threading.active_count()
+    devices = []
+    for port in ports:
+        ser = serialAsyncSyncIO.Serial(port)
+        ser._logger.setLevel(logging.WARNING)
+        ser.open_sync(port)
+        devices.append(ser)
+    threadsOpen = threading.active_count()
+
+    latencies = []
+    for i in range(nCommands):
+        ser = devices[i % len(devices)]
+        cTime = time.perf_counter()
+        result = ser.send_message_sync({"task": "/state_get", "qid": i + 1}, mTimeout=2)
+        latencies.append(time.perf_counter() - cTime)
+        if result is None:
+            raise RuntimeError(f"No response for qid {i + 1}")
+    latencies.sort()
+
+    for ser in devices:
+        ser.close()
+    return {"devices": len(ports),
+            "threads_before": threadsBefore,
+            "threads_open": threadsOpen,
+            "threads_after_close": threading.active_count(),
+            "rtt_p50_ms": round(statistics.median(latencies) * 1e3, 3),
+            "rtt_p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))] * 1e3, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--commands", type=int, default=200)
+    args = parser.parse_args()
+    results = []
+    for nDevices in args.devices:
+        parentConnection, childConnection = multiprocessing.Pipe()
+        emulator = multiprocessing.Process(target=serve_devices, args=(nDevices, childConnection), daemon=True)
+        emulator.start()
+        ports = parentConnection.recv()
+        try:
+            results.append(measure(ports, args.commands))
+        finally:
+            emulator.terminate()
+            emulator.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,56 @@
+import heapq
 import random
-from threading import Thread
+import threading
 import time
 
+from uc2emulator import BOOT_BANNER, REBOOT_NOTICE, T_BOOT, T_PRINT, FirmwareEmulator
+
+
 class MockSerial:
-    def __init__(self, port, baudrate, timeout=1):
+    '''
+    In-process stand-in for serial.Serial that speaks the UC2 protocol
+
+    Written commands are answered by a uc2emulator.FirmwareEmulator: "++"/"--"
+    framed JSON echoing the qid, -qid for unknown tasks, "reboot" and the boot
+    banner on reboot(). The answers arrive after latency seconds plus the wire
+    time of their bytes at baudrate (10 bits per byte, throttle=False delivers
+    them at once); chunkSize > 0 fragments them into chunks of 1 to chunkSize
+    bytes, every in_waiting/read sees at most one more chunk. Nothing runs in
+    the background, the bytes become readable once their time has come.
+    '''
+    def __init__(self, port, baudrate, timeout=1, latency=0., throttle=True, chunkSize=0,
+                 announce=True, emulator=None, seed=None):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
-        self.is_open = False
-        self.data_buffer = []
-        self.thread = Thread(target=self._simulate_data)
-        self.thread.daemon = True
-        self.thread.start()
-        self.is_open = True
+        self.latency = latency
+        self.throttle = throttle
+        self.chunkSize = chunkSize
+        self.emulator = emulator if emulator is not None else FirmwareEmulator()
         self.manufacturer = "UC2Mock"
         self.BAUDRATES = -1
-        self.in_waiting = 0
+        self.nBytesWritten = 0
+        self.nBytesRead = 0
+        self._random = random.Random(seed)
+        self._condition = threading.Condition()
+        self._buffer = bytearray()  # bytes that arrived and were not read yet
+        self._incoming = []         # heap of (arrival time, sequence, bytes) still on their way
+        self._sequence = 0
+        self._wireFree = 0.         # time the last scheduled byte arrives
+        self._bootTime = None       # time a reboot is finished, the device ignores commands until then
+        self.is_open = True
+        if announce:
+            self._schedule(BOOT_BANNER)
+
+    @property
+    def bytesPerSecond(self):
+        return self.baudrate / 10 if self.throttle and self.baudrate and self.baudrate > 0 else None
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            self._arrive(time.monotonic())
+            return len(self._buffer)
 
     def flush(self):
         pass
@@ -27,37 +62,118 @@ class MockSerial:
         self.is_open = True
 
     def close(self):
-        self.is_open = False
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
 
-    def readline(self, timeout=1):
-        if not self.is_open:
-            raise Exception("Device not connected")
-        if len(self.data_buffer) == 0:
-            return b''
-        data = self.data_buffer
-        self.data_buffer = self.data_buffer
-        time.sleep(.05)
-        return bytes(data)
-
-    def read(self, num_bytes):
-        if not self.is_open:
-            raise Exception("Device not connected")
-        if len(self.data_buffer) == 0:
-            return b''
-        data = self.data_buffer[:num_bytes]
-        self.data_buffer = self.data_buffer[num_bytes:]
-        return bytes(data)
+    def reset_input_buffer(self):
+        with self._condition:
+            self._arrive(time.monotonic())
+            self._buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def reboot(self, bootTime=T_BOOT):
+        '''
+        Print "reboot", drop what is still on its way and print the boot banner after bootTime seconds
+        '''
+        with self._condition:
+            self._incoming.clear()
+            self._wireFree = 0.
+            self.emulator.reset()
+            self._bootTime = time.monotonic() + bootTime
+            self._schedule(REBOOT_NOTICE)
+            self._schedule(BOOT_BANNER, bootTime)
+            self._condition.notify_all()
 
     def write(self, data):
         if not self.is_open:
             raise Exception("Device not connected")
-        pass  # Do nothing, as it's a mock
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._condition:
+            # the writer thread and the callers may write at the same time
+            self.nBytesWritten += len(data)
+            if self._bootTime is not None:
+                if time.monotonic() < self._bootTime:
+                    return len(data)    # still booting, the bytes are lost
+                self._bootTime = None
+            for response in self.emulator.receive(bytes(data)):
+                for i, printed in enumerate(response):
+                    self._schedule(printed, self.latency + i * T_PRINT)
+            self._condition.notify_all()
+        if self.emulator.isRebootRequested:
+            self.reboot()
+        return len(data)
+
+    def read(self, size=1):
+        '''
+        Read up to size bytes, waiting up to timeout seconds for all of them (None: forever)
+        '''
+        return self._read(lambda buffer: size if len(buffer) >= size else None)
+
+    def readline(self, size=-1):
+        '''
+        Read up to and including the next newline (or size bytes), waiting up to timeout seconds
+        '''
+        def lineEnd(buffer):
+            end = buffer.find(b"\n") + 1
+            if end == 0:
+                end = len(buffer) + 1
+            if 0 <= size < end:
+                return size
+            return end if end <= len(buffer) else None
+        return self._read(lineEnd)
+
+    def _read(self, complete):
+        '''
+        Wait until complete(buffer) returns the number of bytes to take or the timeout
+        passed, then consume and return them (everything that arrived on timeout)
+        '''
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                if not self.is_open:
+                    raise Exception("Device not connected")
+                now = time.monotonic()
+                self._arrive(now)
+                nBytes = complete(self._buffer)
+                if nBytes is None and deadline is not None and now >= deadline:
+                    nBytes = len(self._buffer)
+                if nBytes is not None:
+                    data = bytes(self._buffer[:nBytes])
+                    del self._buffer[:nBytes]
+                    self.nBytesRead += len(data)
+                    return data
+                wait = None if deadline is None else deadline - now
+                if self._incoming:
+                    wait = self._incoming[0][0] - now if wait is None else min(wait, self._incoming[0][0] - now)
+                self._condition.wait(wait)
+
+    def _arrive(self, now):
+        while self._incoming and self._incoming[0][0] <= now:
+            self._buffer += heapq.heappop(self._incoming)[2]
+            if self.chunkSize > 0:
+                break   # every look at the port sees at most one more fragment
 
-    def _simulate_data(self):
-        while self.is_open:
-            if random.random() < 0.2:  # Simulate occasional data availability
-                self.data_buffer.extend([random.randint(0, 255) for _ in range(10)])
-            time.sleep(0.1)
+    def _schedule(self, data, delay=0.):
+        '''
+        Put bytes on their way, they arrive after delay seconds plus their wire
+        time and never before the bytes scheduled earlier
+        '''
+        arrival = max(time.monotonic() + delay, self._wireFree)
+        bytesPerSecond = self.bytesPerSecond
+        offset = 0
+        while offset < len(data):
+            size = self._random.randint(1, self.chunkSize) if self.chunkSize > 0 else len(data)
+            chunk = data[offset:offset + size]
+            offset += len(chunk)
+            if bytesPerSecond is not None:
+                arrival += len(chunk) / bytesPerSecond
+            self._sequence += 1
+            heapq.heappush(self._incoming, (arrival, self._sequence, chunk))
+        self._wireFree = arrival
 
     def __enter__(self):
         self.open()
@@ -68,8 +184,11 @@ class MockSerial:
 
 
 if __name__ == '__main__':
-    with MockSerial("COM1", 9600) as ser:
-        while True:
-            data = ser.readline()
-            print(data)
-            time.sleep(1)
\ No newline at end of file
+    with MockSerial("COM1", 115200, timeout=.5, latency=.01, chunkSize=16) as ser:
+        print(ser.read(4096))
+        for qid, task in enumerate(("/state_get", "/motor_get", "/unknown_act"), 1):
+            ser.write(b'{"task": "%s", "qid": %d}' % (task.encode(), qid))
+            line = ser.readline()
+            while line:
+                print(line)
+                line = ser.readline()
@@ -0,0 +1,128 @@
+import copy
+
+from payloadcodec import json_dumps
+
+_PLACEHOLDER = "@@sermon-field-{}@@"
+
+
+class CommandTemplate:
+    '''
+    A JSON command encoded once, of which only a few numeric fields change per send
+
+    The command is encoded with a %d conversion in place of every variable
+    field, so render() is a single bytes formatting call and never
+    re-serializes the command. Fields that are not given keep the value of
+    the command the template was created from (0 where it has none).
+
+    fields maps a name to the path of the value inside the command, e.g.
+    {"position": ("motor", "steppers", 0, "position")}; a plain string is a
+    top-level key. The "qid" field is always added.
+    '''
+    def __init__(self, command, fields=None):
+        self.command = copy.deepcopy(command)
+        self.paths = {"qid": ("qid",)}
+        for name, path in (fields or {}).items():
+            self.paths[name] = (path,) if isinstance(path, (str, int)) else tuple(path)
+        self.values = {}        # field name -> value of the command itself
+        for name, path in self.paths.items():
+            value = _get_path(self.command, path)
+            self.values[name] = value if isinstance(value, (int, float)) else 0
+            _set_path(self.command, path, self.values[name])
+        self._isIntOnly = all(type(value) is int for value in self.values.values())
+        self._names, self._segments = self._encode()
+        # the constant parts with every "%" escaped, joined by the conversions of the fields
+        self._format = b"%d".join(segment.replace(b"%", b"%%") for segment in self._segments)
+
+    def _encode(self):
+        '''
+        Split the encoded command at the fields
+
+        returns the field names in the order they appear and the constant bytes around them
+        '''
+        marked = copy.deepcopy(self.command)
+        markers = {}
+        for i, (name, path) in enumerate(self.paths.items()):
+            placeholder = _PLACEHOLDER.format(i)
+            _set_path(marked, path, placeholder)
+            markers[name] = b'"' + placeholder.encode("utf-8") + b'"'
+        encoded = json_dumps(marked)
+
+        positions = sorted((encoded.index(marker), name, marker) for name, marker in markers.items())
+        names = []
+        segments = []
+        cursor = 0
+        for position, name, marker in positions:
+            segments.append(encoded[cursor:position])
+            names.append(name)
+            cursor = position + len(marker)
+        segments.append(encoded[cursor:])
+        return tuple(names), segments
+
+    @staticmethod
+    def _format_value(name, value):
+        if isinstance(value, bool):
+            return b"true" if value else b"false"
+        if isinstance(value, int):
+            return b"%d" % value
+        if isinstance(value, float):
+            return repr(value).encode("ascii")
+        raise TypeError(f"Template field {name} only takes numbers, got {type(value).__name__}")
+
+    def render(self, **values):
+        '''
+        Fill the values into the encoded command and return its bytes
+        '''
+        current = {**self.values, **values}
+        if len(current) != len(self.values):
+            raise KeyError(f"Template has no field {', '.join(name for name in values if name not in self.paths)}")
+        args = tuple(map(current.__getitem__, self._names))
+        if self._isIntOnly:
+            for value in values.values():
+                if type(value) is not int:
+                    break
+            else:
+                return self._format % args
+        # bools and floats cannot go through %d
+        parts = [self._segments[0]]
+        for name, value, segment in zip(self._names, args, self._segments[1:]):
+            parts.append(self._format_value(name, value))
+            parts.append(segment)
+        return b"".join(parts)
+
+    def as_dict(self, **values):
+        '''
+        The command with the values filled in, for codecs other than JSON and coalescing keys
+
+        Only the containers on the paths of the given fields are copied, the
+        rest is shared with the template and must not be modified.
+        '''
+        command = dict(self.command)
+        copied = {id(command)}
+        for name, value in values.items():
+            path = self.paths.get(name)
+            if path is None:
+                raise KeyError(f"Template has no field {name}")
+            document = command
+            for key in path[:-1]:
+                child = document[key]
+                if id(child) not in copied:
+                    child = document[key] = copy.copy(child)
+                    copied.add(id(child))
+                document = child
+            document[path[-1]] = value
+        return command
+
+
+def _get_path(document, path):
+    try:
+        for key in path:
+            document = document[key]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return document
+
+
+def _set_path(document, path, value):
+    for key in path[:-1]:
+        document = document[key]
+    document[path[-1]] = value
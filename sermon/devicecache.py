@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".sermon", "known_devices.json")
+
+
+def device_key(port):
+    '''
+    Identify a USB serial adapter by VID, PID and serial number
+
+    port is a ListPortInfo of serial.tools.list_ports
+    returns None for ports that are not USB devices
+    '''
+    if getattr(port, "vid", None) is None or getattr(port, "pid", None) is None:
+        return None
+    return f"{port.vid:04X}:{port.pid:04X}:{port.serial_number or ''}"
+
+
+class KnownDeviceCache:
+    '''
+    Small on-disk record of the UC2 devices we successfully talked to
+
+    For every USB VID/PID/serial number it keeps the port path, the baud rate
+    and the time of the last successful handshake, so that a reconnect can go
+    straight to the right port instead of probing all of them.
+    '''
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        '''
+        Write the cache atomically, returns False if that was not possible
+        '''
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmpPath, self.path)
+            return True
+        except OSError:
+            return False
+
+    def remember(self, port, baudrate):
+        key = device_key(port)
+        if key is None:
+            return False
+        self.entries[key] = {"port": port.device, "baudrate": baudrate,
+                             "lastHandshake": time.time()}
+        return self.save()
+
+    def forget(self, port):
+        key = device_key(port)
+        if key is not None and self.entries.pop(key, None) is not None:
+            self.save()
+
+    def candidates(self, available_ports, baudrate):
+        '''
+        Return the available ports that belong to known devices for this baud rate,
+        the most recently seen first
+        '''
+        known = []
+        for port in available_ports:
+            entry = self.entries.get(device_key(port))
+            if entry is not None and entry.get("baudrate") == baudrate:
+                known.append((entry.get("lastHandshake", 0), port))
+        known.sort(key=lambda item: item[0], reverse=True)
+        return [port for _, port in known]
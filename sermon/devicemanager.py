@@ -0,0 +1,399 @@
+import logging
+import os
+import selectors
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from MockSerial import MockSerial
+from mSerial import Serial
+
+MAX_WRITE_SIZE = 65536
+
+
+class _Channel:
+    '''
+    Per-device state of the selector loop: the file descriptor, the bytes
+    that the port did not take yet and the futures waiting for them
+    '''
+    def __init__(self, device):
+        self.device = device
+        self.fd = device.serial_device.fileno()
+        self.writeBuffer = bytearray()
+        self.writeFutures = deque()     # (offset of the last byte in the stream, future)
+        self.lock = threading.Lock()
+        self.nBytesWritten = 0          # bytes handed to the port since attaching
+        self.nBytesQueued = 0           # bytes passed to write() since attaching
+        self.nBytesRead = 0
+        self.nWrites = 0
+        self.nReads = 0
+        self.lastReceived = None
+        self.isWriting = False          # EVENT_WRITE is registered
+        self.isClosed = False
+
+    def readinto(self, buffer):
+        try:
+            return os.readv(self.fd, [buffer])
+        except (BlockingIOError, InterruptedError):
+            return None
+
+
+class DeviceManager:
+    '''
+    Several UC2 devices served by one selector thread
+
+    Every device is an mSerial.Serial with its own QID counter, pending
+    requests and response store; the manager reads all ports from a single
+    selector loop, parses the frames of every port on that thread and writes
+    the commands without blocking, so the number of threads stays the same
+    however many devices are attached. The callbacks of all devices share one
+    executor. Ports without a file descriptor (MockSerial, non-POSIX systems)
+    fall back to the reading threads of their Serial.
+
+    Parsing happens on the selector thread, a subscription with the "block"
+    policy therefore holds back the reading of all attached devices. A device
+    that reboots or goes away is reopened by its Serial (see autoReconnect) and
+    attached again once it is back.
+
+        manager = DeviceManager()
+        manager.add_device("stage", "/dev/ttyUSB0")
+        manager.discover()
+        manager["stage"].sendMessage({"task": "/state_get"})
+    '''
+    def __init__(self, baudrate=115200, callbackWorkers=2, logger=None, **serialOptions):
+        '''
+        serialOptions are passed on to every mSerial.Serial (e.g. timeout, DEBUG,
+        responseCapacity, deviceCachePath, framing); the coalescing send queue
+        is not available for managed devices.
+        '''
+        if serialOptions.get("coalesceKey") is not None:
+            raise ValueError("Managed devices write through the selector loop, coalesceKey is not supported")
+        self.baudrate = baudrate
+        self.serialOptions = serialOptions
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.devices = OrderedDict()    # name -> Serial
+        self.callbackExecutor = ThreadPoolExecutor(max_workers=callbackWorkers, thread_name_prefix="callback")
+        self._channels = {}             # Serial -> _Channel
+        self._calls = deque()           # functions to run on the selector thread
+        self._openLock = threading.Lock()   # one discovery at a time, so no port is opened twice
+        self._selector = selectors.DefaultSelector()
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        os.set_blocking(self._wakeupRead, False)
+        os.set_blocking(self._wakeupWrite, False)
+        self._selector.register(self._wakeupRead, selectors.EVENT_READ, None)
+        self.isRunning = True
+        self._thread = threading.Thread(target=self._run, name="sermon-devices", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_device(self, name=None, port=None, **serialOptions):
+        '''
+        Open a device and attach it to the selector loop
+
+        The port is looked up the same way as for a single Serial (the given
+        port, the known devices, then a scan); ports held by other devices of
+        the manager are skipped. name defaults to the port name.
+        returns the Serial
+        '''
+        options = dict(self.serialOptions, **serialOptions)
+        options.setdefault("baudrate", self.baudrate)
+        with self._openLock:
+            if name is not None and name in self.devices:
+                raise KeyError(f"There is already a device named {name}")
+            device = Serial(port, parent=self, manager=self, callbackExecutor=self.callbackExecutor,
+                            writeQueueSize=0, **options)
+            if name is None:
+                name = device.serial_device.port
+            self.devices[name] = device
+        return device
+
+    def remove_device(self, name):
+        '''
+        Detach a device and close its port
+        '''
+        device = self.devices.pop(name)
+        device.close()
+
+    def discover(self, maxDevices=None):
+        '''
+        Attach all UC2 devices that are connected and not managed yet
+
+        Scans the free ports until no further UC2 device answers (or maxDevices
+        were found), the devices are named after their ports.
+        returns the names of the new devices
+        '''
+        found = []
+        while maxDevices is None or len(found) < maxDevices:
+            with self._openLock:
+                device = Serial(None, parent=self, manager=self, callbackExecutor=self.callbackExecutor,
+                                writeQueueSize=0, **dict(self.serialOptions, baudrate=self.baudrate))
+                if isinstance(device.serial_device, MockSerial):
+                    device.close()
+                    break
+                name = device.serial_device.port
+                self.devices[name] = device
+            found.append(name)
+        return found
+
+    def owns_port(self, port):
+        '''
+        True if the port is held by one of the devices of the manager
+        '''
+        return any(device.serial_device is not None and device.serial_device.port == port
+                   and device.serial_device.is_open for device in list(self.devices.values()))
+
+    def attach(self, device):
+        '''
+        Let the selector loop read and write the port of device (called by Serial.start_reading)
+
+        returns False if the port has no file descriptor to watch
+        '''
+        if not self.isRunning or isinstance(device.serial_device, MockSerial) or not hasattr(device.serial_device, "fileno"):
+            return False
+        try:
+            channel = _Channel(device)
+        except Exception:
+            return False
+        os.set_blocking(channel.fd, False)
+        self._channels[device] = channel
+        self._call(lambda: self._selector.register(channel.fd, selectors.EVENT_READ, channel), wait=True)
+        return True
+
+    def detach(self, device):
+        '''
+        Stop watching the port of device, queued bytes that were not written are dropped
+        '''
+        channel = self._channels.get(device)
+        if channel is None:
+            return
+
+        def unregister():
+            self._close_channel(channel, ConnectionResetError("The device was detached"))
+        self._call(unregister, wait=True)
+
+    def write(self, device, data):
+        '''
+        Write data to the port of device without blocking
+
+        Whatever the port does not take right away is written by the selector
+        loop as soon as the port is ready again.
+        returns a Future resolved once the port took all of data
+        '''
+        channel = self._channels.get(device)
+        future = Future()
+        if channel is None or channel.isClosed:
+            future.set_exception(ConnectionResetError("The device is not attached"))
+            return future
+        future.set_running_or_notify_cancel()
+        with channel.lock:
+            channel.nBytesQueued += len(data)
+            if not channel.writeBuffer:
+                # try to get rid of it right away, buffer what the port does not take
+                try:
+                    nBytes = os.write(channel.fd, data)
+                except (BlockingIOError, InterruptedError):
+                    nBytes = 0
+                except OSError as e:
+                    future.set_exception(e)
+                    return future
+                channel.nBytesWritten += nBytes
+                channel.nWrites += 1
+                if nBytes == len(data):
+                    future.set_result(True)
+                    return future
+                data = memoryview(data)[nBytes:]
+            channel.writeBuffer += data
+            channel.writeFutures.append((channel.nBytesQueued, future))
+            startWriting = not channel.isWriting
+            channel.isWriting = True
+        if startWriting:
+            self._call(lambda: self._watch_writes(channel))
+        return future
+
+    def _call(self, function, wait=False):
+        '''
+        Run function on the selector thread, wait for it if requested
+        '''
+        if threading.current_thread() is self._thread:
+            function()
+            return
+        done = threading.Event()
+
+        def call():
+            try:
+                function()
+            finally:
+                done.set()
+        self._calls.append(call)
+        try:
+            os.write(self._wakeupWrite, b"\0")
+        except BlockingIOError:
+            pass    # the loop is woken up already
+        if wait and self._thread.is_alive():
+            done.wait()
+
+    def _watch_writes(self, channel):
+        if not channel.isClosed:
+            self._selector.modify(channel.fd, selectors.EVENT_READ | selectors.EVENT_WRITE, channel)
+
+    def _run(self):
+        while self.isRunning:
+            for key, events in self._selector.select():
+                channel = key.data
+                if channel is None:
+                    self._run_calls()
+                    continue
+                if events & selectors.EVENT_READ:
+                    self._read_ready(channel)
+                if events & selectors.EVENT_WRITE and not channel.isClosed:
+                    self._write_ready(channel)
+        self._run_calls()
+
+    def _run_calls(self):
+        try:
+            while os.read(self._wakeupRead, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self._calls:
+            self._calls.popleft()()
+
+    def _read_ready(self, channel):
+        device = channel.device
+        try:
+            nBytes = device.framer.fill(channel.readinto)
+            if nBytes == 0:
+                # readable but empty means the port was closed/unplugged
+                raise OSError("device reports readiness to read but returned no data")
+        except OSError as e:
+            self.logger.error("[DeviceManager]: "+str(e))
+            self._close_channel(channel, e)
+            device._connection_lost(e)     # fails or keeps the commands in flight and reconnects
+            return
+        if not nBytes:
+            return
+        channel.nBytesRead += nBytes
+        channel.nReads += 1
+        channel.lastReceived = time.monotonic()
+        device._process_received(nBytes)
+
+    def _write_ready(self, channel):
+        finished = []
+        with channel.lock:
+            try:
+                nBytes = os.write(channel.fd, channel.writeBuffer[:MAX_WRITE_SIZE])
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.logger.error("[DeviceManager]: "+str(e))
+                error, nBytes = e, None
+            if nBytes is not None:
+                del channel.writeBuffer[:nBytes]
+                channel.nBytesWritten += nBytes
+                channel.nWrites += 1
+                while channel.writeFutures and channel.writeFutures[0][0] <= channel.nBytesWritten:
+                    finished.append(channel.writeFutures.popleft()[1])
+                if not channel.writeBuffer:
+                    channel.isWriting = False
+                    self._selector.modify(channel.fd, selectors.EVENT_READ, channel)
+        if nBytes is None:
+            self._close_channel(channel, error)
+            channel.device._connection_lost(error)
+            return
+        for future in finished:
+            future.set_result(True)
+
+    def _close_channel(self, channel, exc):
+        if channel.isClosed:
+            return
+        with channel.lock:
+            channel.isClosed = True
+            futures = [future for _, future in channel.writeFutures]
+            channel.writeFutures.clear()
+            channel.writeBuffer.clear()
+        try:
+            self._selector.unregister(channel.fd)
+        except (KeyError, ValueError):
+            pass
+        self._channels.pop(channel.device, None)
+        for future in futures:
+            future.set_exception(exc)
+
+    def close(self):
+        '''
+        Close all devices and stop the selector thread
+        '''
+        for name in list(self.devices):
+            self.remove_device(name)
+        if not self.isRunning:
+            return
+
+        def stop():
+            self.isRunning = False
+        self._call(stop)
+        if threading.current_thread() is not self._thread:
+            self._thread.join(1.)
+        self._selector.close()
+        os.close(self._wakeupRead)
+        os.close(self._wakeupWrite)
+        self.callbackExecutor.shutdown(wait=False)
+
+    def health(self):
+        '''
+        Connection state of every device: port, whether it is a real UC2 device,
+        attached to the selector loop or being reopened, the number of outstanding
+        requests and the seconds since the last bytes arrived
+        '''
+        now = time.monotonic()
+        health = {}
+        for name, device in list(self.devices.items()):
+            channel = self._channels.get(device)
+            health[name] = {"port": device.serial_device.port if device.serial_device is not None else None,
+                            "connected": device.is_connected and not isinstance(device.serial_device, MockSerial),
+                            "attached": channel is not None,
+                            "reconnecting": device._isReconnecting,
+                            "pending": len(device.pendingRequests),
+                            "idle_s": (round(now - channel.lastReceived, 3)
+                                       if channel is not None and channel.lastReceived is not None else None)}
+        return health
+
+    def metrics(self):
+        '''
+        Per-device counters (bytes/reads/writes, framing, responses, reconnects and
+        the link metrics of devices opened with metrics=True)
+        plus the totals over all devices
+        '''
+        devices = {}
+        total = {"bytes_read": 0, "bytes_written": 0, "write_buffer": 0, "pending": 0}
+        for name, device in list(self.devices.items()):
+            channel = self._channels.get(device)
+            stats = {"framing": device.getFramingStats(),
+                     "responses": device.responses.stats(),
+                     "reconnect": device.getReconnectStats(),
+                     "link": device.getMetrics(),
+                     "pending": len(device.pendingRequests)}
+            if channel is not None:
+                stats.update({"bytes_read": channel.nBytesRead, "bytes_written": channel.nBytesWritten,
+                              "reads": channel.nReads, "writes": channel.nWrites,
+                              "write_buffer": len(channel.writeBuffer)})
+                for counter in ("bytes_read", "bytes_written", "write_buffer"):
+                    total[counter] += stats[counter]
+            total["pending"] += stats["pending"]
+            devices[name] = stats
+        return {"devices": devices, "total": total,
+                "threads": threading.active_count()}
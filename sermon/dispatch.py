@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+
+
+class InlineExecutor:
+    '''
+    Executor that runs the callbacks right away on the calling (parsing) thread
+    '''
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class CallbackEntry:
+    '''
+    A registered callback together with its timing statistics
+    '''
+    def __init__(self, callback, pattern):
+        self.callback = callback
+        self.pattern = pattern
+        self.nCalls = 0
+        self.nErrors = 0
+        self.totalTime = 0.
+        self.maxTime = 0.
+
+    @property
+    def name(self):
+        return getattr(self.callback, "__qualname__", repr(self.callback))
+
+    def stats(self):
+        return {"callback": self.name, "pattern": self.pattern,
+                "calls": self.nCalls, "errors": self.nErrors,
+                "total_s": self.totalTime,
+                "mean_ms": self.totalTime / self.nCalls * 1e3 if self.nCalls else 0.,
+                "max_ms": self.maxTime * 1e3}
+
+
+class _PatternLane:
+    '''
+    Queue of pending calls for one pattern, drained by at most one worker at a
+    time so that callbacks of a pattern see the frames in order
+    '''
+    def __init__(self):
+        self.calls = deque()
+        self.isScheduled = False
+        self.lock = threading.Lock()
+
+
+class CallbackDispatcher:
+    '''
+    Index of the registered callbacks keyed by the top-level JSON key they wait for
+
+    Only the callbacks whose pattern is a key of the received frame are
+    visited. The calls are handed to an executor so that a slow subscriber does
+    not stall the parsing thread; calls for the same pattern keep their order.
+    '''
+    def __init__(self, executor=None, logger=None):
+        self.executor = executor if executor is not None else InlineExecutor()
+        self._logger = logger
+        self._index = {}    # pattern -> tuple of CallbackEntry
+        self._lanes = {}    # pattern -> _PatternLane
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._index.values())
+
+    def register(self, callback, pattern):
+        entry = CallbackEntry(callback, pattern)
+        with self._lock:
+            # copy on write, dispatch() reads the index without taking the lock
+            self._index[pattern] = self._index.get(pattern, ()) + (entry,)
+            self._lanes.setdefault(pattern, _PatternLane())
+        return entry
+
+    def unregister(self, callback, pattern=None):
+        with self._lock:
+            for key in ([pattern] if pattern is not None else list(self._index)):
+                entries = tuple(entry for entry in self._index.get(key, ()) if entry.callback != callback)
+                if entries:
+                    self._index[key] = entries
+                else:
+                    self._index.pop(key, None)
+
+    def dispatch(self, dictionary):
+        '''
+        Hand a frame to all callbacks registered for one of its keys
+        '''
+        index = self._index
+        if not index:
+            return
+        for key in dictionary:
+            entries = index.get(key)
+            if entries is not None:
+                self._schedule(self._lanes[key], entries, dictionary)
+
+    def _schedule(self, lane, entries, dictionary):
+        with lane.lock:
+            lane.calls.append((entries, dictionary))
+            if lane.isScheduled:
+                return
+            lane.isScheduled = True
+        try:
+            self.executor.submit(self._drain, lane)
+        except Exception:
+            # e.g. the executor was shut down by close(), the next frame has to schedule the lane again
+            with lane.lock:
+                lane.isScheduled = False
+            raise
+
+    def _drain(self, lane):
+        while True:
+            with lane.lock:
+                if not lane.calls:
+                    lane.isScheduled = False
+                    return
+                entries, dictionary = lane.calls.popleft()
+            for entry in entries:
+                self._call(entry, dictionary)
+
+    def _call(self, entry, dictionary):
+        cTime = time.perf_counter()
+        try:
+            entry.callback(dictionary)
+        except Exception as e:
+            entry.nErrors += 1
+            if self._logger is not None:
+                self._logger.error("[ProcessCommands]: "+str(e))
+        duration = time.perf_counter() - cTime
+        entry.nCalls += 1
+        entry.totalTime += duration
+        if duration > entry.maxTime:
+            entry.maxTime = duration
+
+    def stats(self):
+        '''
+        Timing statistics of every registered callback, slowest (by total time) first
+        '''
+        entries = [entry for entries in self._index.values() for entry in entries]
+        return sorted((entry.stats() for entry in entries), key=lambda stat: stat["total_s"], reverse=True)
@@ -0,0 +1,275 @@
+import re
+import struct
+import zlib
+
+from payloadcodec import json_loads
+
+FRAME_START = b"++"
+FRAME_END = b"--"
+
+# binary frames: sync | payload length (uint16 LE) | payload | CRC32 of length and payload (uint32 LE)
+BINARY_SYNC = b"\xa5\x5a"
+BINARY_HEADER_SIZE = len(BINARY_SYNC) + 2
+BINARY_CRC_SIZE = 4
+BINARY_MAX_PAYLOAD = 0xffff
+BINARY_PLAUSIBLE_PAYLOAD = 16384    # longer length fields are taken as corrupted or as a stray sync word
+
+_QID_PATTERN = re.compile(rb'"qid"\s*:\s*(\d+)')
+
+
+def encode_binary_frame(payload):
+    '''
+    Wrap a payload into a length-prefixed binary frame protected by a CRC32
+    '''
+    if len(payload) > BINARY_MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes does not fit into a binary frame")
+    length = struct.pack("<H", len(payload))
+    crc = zlib.crc32(payload, zlib.crc32(length))
+    return b"".join((BINARY_SYNC, length, payload, struct.pack("<I", crc)))
+
+
+class FrameParser:
+    '''
+    Incremental framer for the "++{json}--" protocol of the UC2 firmware
+
+    Chunks are fed as they come from the serial port; every complete frame is
+    returned exactly once, also if a delimiter is split between two reads.
+    The scan position is kept between calls so each byte is only looked at
+    once and bytes outside of a frame (e.g. debug prints) are dropped right
+    away, so the buffer never holds more than the frame currently received.
+
+    The receive buffer is allocated once; fill() lets the port read straight
+    into it and the frames are handed out as memoryview slices of it, so no
+    bytes objects are created per chunk. A returned frame is only valid until
+    the next call to feed()/fill(), decode it (see decode_frame) right away.
+
+    With acceptBinary the parser also picks up length-prefixed binary frames
+    (see encode_binary_frame) from the same stream; frames failing the CRC
+    are counted in nCrcErrors and skipped. Only switch it on once the device
+    agreed to binary framing: text output may contain the sync bytes by
+    chance. A "++" inside an open text frame means its "--" was lost; the
+    partial frame is handed out as it is and a new frame starts there. A length field beyond maxBinaryPayload is not waited for, the
+    parser resynchronises on the next "++" instead.
+    '''
+    def __init__(self, maxFrameSize=65536, acceptBinary=False, bufferSize=None,
+                 maxBinaryPayload=BINARY_PLAUSIBLE_PAYLOAD):
+        self.maxFrameSize = maxFrameSize    # frames growing beyond that are dropped
+        self.maxBinaryPayload = maxBinaryPayload
+        self.acceptBinary = acceptBinary
+        self.nTextFrames = 0
+        self.nBinaryFrames = 0
+        self.nDroppedFrames = 0
+        self.nCrcErrors = 0
+        self.nBufferGrowths = 0
+        self._buffer = bytearray(bufferSize or 2 * (maxFrameSize + BINARY_HEADER_SIZE + BINARY_CRC_SIZE))
+        self._view = memoryview(self._buffer)
+        self._start = 0                     # first byte not consumed yet
+        self._end = 0                       # end of the received bytes
+        self._frameStart = -1               # offset of the text payload or binary sync, -1 while searching
+        self._isBinaryFrame = False
+        self._scanPosition = 0              # where to continue searching on the next chunk
+
+    def __len__(self):
+        return self._end - self._start
+
+    def reset(self):
+        self._start = self._end = 0
+        self._frameStart = -1
+        self._isBinaryFrame = False
+        self._scanPosition = 0
+
+    def stats(self):
+        return {"text_frames": self.nTextFrames, "binary_frames": self.nBinaryFrames,
+                "dropped_frames": self.nDroppedFrames, "crc_errors": self.nCrcErrors,
+                "buffer_size": len(self._buffer), "buffer_growths": self.nBufferGrowths}
+
+    def _reserve(self, size):
+        '''
+        Make room for size more bytes behind the received ones
+
+        The unconsumed bytes are moved to the front of the buffer; only if they
+        do not fit together with size a larger buffer is allocated.
+        '''
+        if len(self._buffer) - self._end >= size:
+            return
+        used = self._end - self._start
+        shift = self._start
+        if used + size > len(self._buffer):
+            buffer = bytearray(max(2 * len(self._buffer), used + size))
+            buffer[:used] = self._view[self._start:self._end]
+            # frames handed out earlier keep the old buffer alive, so it is not released here
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self.nBufferGrowths += 1
+        elif used:
+            self._view[:used] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = used
+        self._scanPosition -= shift
+        if self._frameStart >= 0:
+            self._frameStart -= shift
+
+    def append(self, data):
+        '''
+        Copy a chunk of received bytes into the buffer without parsing it
+        '''
+        size = len(data)
+        self._reserve(size)
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def get_buffer(self, minFree=4096):
+        '''
+        Writable memoryview on the free part of the buffer (at least minFree
+        bytes), announce what was written into it with buffer_updated()
+        '''
+        self._reserve(minFree)
+        return self._view[self._end:]
+
+    def buffer_updated(self, nBytes):
+        self._end += nBytes
+
+    def fill(self, readinto, minFree=4096):
+        '''
+        Let readinto (e.g. SelectReader.readinto) write into the free part of the buffer
+
+        returns the number of bytes read, 0/None if readinto got nothing
+        '''
+        nBytes = readinto(self.get_buffer(minFree))
+        if nBytes:
+            self._end += nBytes
+        return nBytes
+
+    def recent_contains(self, pattern, nBytes):
+        '''
+        Check the last nBytes received (plus a possible overlap) for pattern
+        '''
+        begin = max(self._start, self._end - nBytes - len(pattern) + 1)
+        return self._buffer.find(pattern, begin, self._end) >= 0
+
+    def feed(self, data):
+        '''
+        Add a chunk of received bytes
+
+        returns a list with the payload (bytes between "++" and "--" or the
+        payload of a binary frame) of every frame completed by this chunk
+        '''
+        self.append(data)
+        return self.parse()
+
+    def parse(self):
+        '''
+        Scan the bytes received since the last call
+
+        returns memoryviews on the payload of every completed frame
+        '''
+        buffer = self._buffer
+        view = self._view
+        bufferEnd = self._end
+        frames = []
+        while True:
+            if self._frameStart < 0:
+                start = buffer.find(FRAME_START, self._scanPosition, bufferEnd)
+                if self.acceptBinary:
+                    binaryStart = buffer.find(BINARY_SYNC, self._scanPosition, start if start >= 0 else bufferEnd)
+                    if binaryStart >= 0:
+                        self._frameStart = self._scanPosition = binaryStart
+                        self._isBinaryFrame = True
+                if self._frameStart < 0:
+                    if start < 0:
+                        # keep a trailing byte that may be the first half of a start marker
+                        lastByte = buffer[bufferEnd - 1] if bufferEnd > self._scanPosition else None
+                        isSplit = lastByte == FRAME_START[0] or (self.acceptBinary and lastByte == BINARY_SYNC[0])
+                        self._start = self._scanPosition = bufferEnd - 1 if isSplit else bufferEnd
+                        break
+                    self._frameStart = self._scanPosition = start + len(FRAME_START)
+                    self._isBinaryFrame = False
+
+            if self._isBinaryFrame:
+                if not self._take_binary_frame(frames):
+                    self._start = self._frameStart
+                    break
+                continue
+
+            end = buffer.find(FRAME_END, self._scanPosition, bufferEnd)
+            restart = buffer.find(FRAME_START, self._scanPosition, end if end >= 0 else bufferEnd)
+            if restart >= 0:
+                # the "--" of this frame got lost, hand out what we have (decode_frame
+                # may still rescue its QID) and start over at the next "++"
+                frames.append(view[self._frameStart:restart])
+                self.nTextFrames += 1
+                self._frameStart = self._scanPosition = restart + len(FRAME_START)
+                continue
+            if end < 0:
+                if bufferEnd - self._frameStart > self.maxFrameSize:
+                    # no end marker in sight, resynchronise on the next "++"
+                    self.nDroppedFrames += 1
+                    self._frameStart = -1
+                    self._scanPosition = bufferEnd - 1
+                    continue
+                self._start = self._frameStart - len(FRAME_START)
+                # a trailing "-" may be the first half of "--"
+                self._scanPosition = max(self._frameStart, bufferEnd - 1)
+                break
+            frames.append(view[self._frameStart:end])
+            self.nTextFrames += 1
+            self._frameStart = -1
+            self._scanPosition = end + len(FRAME_END)
+
+        if self._start == self._end:
+            # everything consumed, start over at the front without moving bytes
+            self._start = self._end = self._scanPosition = 0
+        return frames
+
+    def _take_binary_frame(self, frames):
+        '''
+        Check the binary frame starting at _frameStart
+
+        returns False if more bytes are needed, True once the frame was taken
+        or rejected (then scanning continues right behind the sync bytes)
+        '''
+        buffer = self._buffer
+        start = self._frameStart
+        payloadStart = start + BINARY_HEADER_SIZE
+        if self._end < payloadStart:
+            return False
+        length = buffer[start + 2] | buffer[start + 3] << 8
+        if length > self.maxBinaryPayload:
+            # a corrupted length field or sync bytes in text output, do not wait for a frame that never comes
+            self.nCrcErrors += 1
+            self._frameStart = -1
+            self._scanPosition = start + 1
+            return True
+        end = payloadStart + length + BINARY_CRC_SIZE
+        if self._end < end:
+            return False
+        view = self._view
+        crc = int.from_bytes(view[end - BINARY_CRC_SIZE:end], "little")
+        if zlib.crc32(view[start + 2:end - BINARY_CRC_SIZE]) == crc:
+            frames.append(view[payloadStart:end - BINARY_CRC_SIZE])
+            self.nBinaryFrames += 1
+            self._scanPosition = end
+        else:
+            self.nCrcErrors += 1
+            self._scanPosition = start + 1
+        self._frameStart = -1
+        return True
+
+
+def decode_frame(payload):
+    '''
+    Parse the JSON payload of a frame
+
+    If the frame got corrupted on the way we try to rescue at least the QID so
+    that a waiting caller is released. The payload may be a memoryview of the
+    receive buffer; as frames are complete a multi-byte character can no
+    longer be split between two reads.
+    returns a dictionary or None if nothing could be recovered
+    '''
+    try:
+        return json_loads(payload)
+    except ValueError:
+        match = _QID_PATTERN.search(payload)
+        if match:
+            return {"qid": int(match.group(1))}
+    return None
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 4
+
+_lock = threading.Lock()
+_runtime = None
+
+
+class IORuntime:
+    '''
+    One event loop thread and one bounded executor for the whole process
+
+    Every serialAsyncSyncIO.Serial runs its coroutines on the loop of the
+    shared runtime and hands blocking calls (discovery, writes to ports without
+    a file descriptor) to its executor, so the number of threads does not grow
+    with the number of devices. Users take a reference with acquire_runtime()
+    and give it back with release(); the loop thread and the executor are shut
+    down when the last reference is released.
+    '''
+    def __init__(self, maxWorkers=DEFAULT_MAX_WORKERS):
+        self.maxWorkers = maxWorkers
+        self.nReferences = 0
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="sermon-io")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self._run, name="sermon-loop", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def is_running(self):
+        return not self.loop.is_closed() and self.thread.is_alive()
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self.thread
+
+    def run(self, coro, timeout=None):
+        '''
+        Run a coroutine on the loop from any other thread and return its result
+        '''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def release(self):
+        global _runtime
+        with _lock:
+            self.nReferences -= 1
+            if self.nReferences > 0:
+                return
+            if _runtime is self:
+                _runtime = None
+        self._shutdown()
+
+    def _shutdown(self):
+        async def cancel_remaining():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.in_loop_thread():
+            # released from a callback on the loop itself, let the loop wind down on its own
+            self.loop.call_soon(self.loop.stop)
+            self.executor.shutdown(wait=False)
+            return
+        if self.loop.is_running():
+            try:
+                self.run(cancel_remaining(), timeout=1.)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(1.)
+        if not self.loop.is_running():
+            self.loop.close()
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"references": self.nReferences, "max_workers": self.maxWorkers,
+                "running": self.is_running}
+
+
+def acquire_runtime(maxWorkers=DEFAULT_MAX_WORKERS):
+    '''
+    Get a reference on the process-wide runtime, starting it if necessary
+
+    maxWorkers only applies when the runtime is started by this call.
+    '''
+    global _runtime
+    with _lock:
+        if _runtime is None or not _runtime.is_running:
+            _runtime = IORuntime(maxWorkers)
+        _runtime.nReferences += 1
+        return _runtime
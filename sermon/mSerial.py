@@ -2,57 +2,126 @@ import threading
 import serial
 from serial.tools import list_ports
 import time
-import json
 import queue
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 from collections import deque
 from MockSerial import MockSerial
+from framing import FrameParser, decode_frame, encode_binary_frame
+from pendingrequests import PendingRequestTable
+from responsestore import ResponseStore
+from selectreader import SelectReader
+from dispatch import CallbackDispatcher
+from payloadcodec import JsonCodec, get_codec, json_dumps, json_loads
+from commandtemplate import CommandTemplate
+from sendqueue import SendQueue
+from subscription import Subscription, SubscriptionHub, DROP_OLDEST
+from devicecache import KnownDeviceCache, DEFAULT_CACHE_PATH
+from metrics import MetricsRegistry
 import logging
         
 T_SERIAL_WARMUP = .5
+T_PROBE_DEADLINE = 10   # global deadline for probing all candidate ports
+T_SERIAL_WARMUP_KNOWN = .1  # shortened handshake for devices from the known-device cache
+T_BUFFER_TIMEOUT_KNOWN = .3
+T_RECONNECT_INITIAL = .5    # first pause between two attempts to reopen a lost port, doubled after every attempt
+T_RECONNECT_MAX = 8.        # longest pause between two attempts
+T_WAIT_SLICE = .05          # how often a writer waiting for the reconnect checks if it is stopped
 
 
-class RingBuffer(deque):
-    def __init__(self, size_max):
-        super().__init__(maxlen=size_max)
-
-    def append(self, datum):
-        super().append(datum)
-        return self
-
-    def get(self):
-        return list(self)
-    
-    
 class Serial:
     def __init__(self, port, baudrate=115200, timeout=5,
-                 identity="UC2_Feather", parent=None, DEBUG=False):
+                 identity="UC2_Feather", parent=None, DEBUG=False, readMode="select",
+                 responseCapacity=1000, responseTTL=300., pipelineWindow=4,
+                 deviceCachePath=DEFAULT_CACHE_PATH, callbackExecutor=None, framing="text",
+                 codec="json", coalesceKey=None, writeQueueSize=64, manager=None,
+                 autoReconnect=True, replayInFlight=False, reconnectTimeout=60., metrics=False):
 
         '''
         serial_device is the serial object that can read/write
         serial_port_name is the name of the port which is open or to be opened
+        readMode is either "select" (block on the port until data arrives, POSIX only)
+        or "poll" (check in_waiting every 50 ms); "select" falls back to "poll" if
+        the device has no file descriptor (e.g. MockSerial)
+        responseCapacity and responseTTL bound the number of QIDs kept in responses
+        and the seconds an untouched entry is kept
+        pipelineWindow is the number of commands submitMessage/sendMessages keep in flight
+        deviceCachePath is the file remembering known UC2 devices, None disables the cache
+        callbackExecutor runs the registered callbacks (default: two worker threads that
+        close() shuts down), pass dispatch.InlineExecutor() to run them on the parsing
+        thread; an executor passed in is left running by close()
+        framing is the wire format to negotiate on connect: "text" ("++{json}--") or
+        "binary" (length prefix + CRC32); older firmware stays on "text"
+        codec is the payload encoding to negotiate: "json", "msgpack" or "cbor",
+        the compact ones need binary framing
+        coalesceKey enables the coalescing send queue: a callable that returns a key
+        for a message dictionary (or None), a queued command that was not written yet
+        is replaced by a newer one with the same key, see sendqueue.command_key
+        writeQueueSize is the number of commands the writer thread buffers, the queued
+        commands are written in one go with a single flush; 0 writes every command
+        right away on the calling thread (not possible together with coalesceKey)
+        manager is a devicemanager.DeviceManager that reads and writes the port on its
+        shared selector thread instead of threads of our own, ports it already holds
+        are skipped when looking for the device
+        autoReconnect reopens the port (with exponential backoff) after the device
+        rebooted or was unplugged, giving up after reconnectTimeout seconds (None: never)
+        replayInFlight sends the commands that were not answered yet once more after the
+        reconnect instead of failing them right away (only for commands that were
+        written and got no response yet, the others may have been executed already
+        or are still written by the send queue)
+        metrics records round trip times per task, byte and frame rates, parse errors
+        and timeouts (see getMetrics); True or a metrics.MetricsRegistry to share
         '''
 
         self.baudrate = baudrate        # Baud rate for serial communication
         self.timeout = timeout          # Timeout for reading from serial port
         self.identity = identity        # Identity of the device (e.g. UC2_Feather)
         self.DEBUG = DEBUG              # Debug flag
+        self.readMode = readMode        # How the reading thread waits for data ("select" or "poll")
+        self.deviceCache = KnownDeviceCache(deviceCachePath) if deviceCachePath is not None else None # Known devices to try before a full scan
         self._parent = parent            # Parent object
         self.serial_port_name = port    # Serial port name
         self.serial_device = None       # Serial device object 
         self.is_connected = False       # Flag to indicate if the device is connected
         self.resetLastCommand = False   # Flag to reset wiating of the last command
         self.data_queue = queue.Queue() # Queue to store incoming data
-        self.maxQentries = 100          # Maximum number of entries in the queue
-        self.queueFinalizedQueryIDs = RingBuffer(self.maxQentries)
         self.identifier_counter = 0     # Counter for generating unique identifiers
-        self.responses = {}             # Dictionary to store responses from the esp per QID
+        self.responses = ResponseStore(responseCapacity, responseTTL) # Responses from the esp per QID
+        self.pendingRequests = PendingRequestTable() # QIDs that sendMessage is currently waiting for
+        self.pipelineWindow = pipelineWindow # Maximum number of pipelined commands awaiting their response
+        self._pipelineSlots = threading.BoundedSemaphore(pipelineWindow)
+        self.framer = FrameParser()     # Incremental parser for the text (and, once negotiated, binary) frames
+        self.requestedFraming = framing # Wire format we would like to use
+        self.framing = "text"           # Wire format used for sending, until negotiated otherwise
+        if codec != "json" and framing != "binary":
+            raise ValueError(f"The {codec} codec needs binary framing")
+        self.requestedCodec = get_codec(codec) # Payload encoding we would like to use
+        self.codec = JsonCodec()        # Payload encoding used for sending, until negotiated otherwise
         self.serial_write_lock = threading.Lock()  # Lock for writing to serial port
         self.isReadingLoopRunning = False          # Flag to indicate if the serial port is being read
         self.isWritingLoopRunning = False           # Flag to indicate if the serial port is being written to
+        self._selectReader = None                   # Blocking reader used by the reading thread in "select" mode
+        self.worker_thread = None                   # Parses what the reading thread queued in "poll" mode
+        self.coalesceKey = coalesceKey              # Key of superseding commands, None writes every command right away
+        self.sendQueue = None                       # Commands waiting for the writer thread, None writes directly
+        self.manager = manager                      # DeviceManager serving several ports from one thread
+        self._isManaged = False                     # Flag to indicate if the manager reads and writes the port
+        self.autoReconnect = autoReconnect          # Reopen the port after a reboot or disconnect
+        self.replayInFlight = replayInFlight        # Send unanswered commands again after reconnecting
+        self.reconnectTimeout = reconnectTimeout    # Seconds to keep trying to reopen the port
+        self._isReconnecting = False                # Flag to indicate if the port is being reopened
+        self._reconnectLock = threading.Lock()
+        self._reconnectThread = None
+        self._connectedEvent = threading.Event()    # Set while the port can be written to
+        self._closeEvent = threading.Event()        # Set by close(), aborts reconnecting
+        self.nReboots = 0                           # Reboots detected in the received data
+        self.nDisconnects = 0                       # Ports that went away (e.g. USB unplugged)
+        self.nReconnects = 0                        # Successful reconnects
+        self.nReplayed = 0                          # Commands sent again after a reconnect
+        self._replayRequests = []                   # Requests written but not answered when the connection was lost
+        self.nFailedInFlight = 0                    # Commands failed because the connection was lost
+        self.lastReconnectTime = None               # Seconds from losing the device until it was back
+        self.metrics = MetricsRegistry() if metrics is True else (metrics or None) # Link statistics, None when disabled
                 
-        # setup callback list for parent modules
-        self.callBackList = []
-        
         # get hold on the logger
         if self._parent is None:
             self._logger = logging.getLogger(__name__)
@@ -61,6 +130,19 @@ class Serial:
         else:
             self._logger = self._parent.logger
 
+        # setup callback index for parent modules
+        self._ownsCallbackExecutor = callbackExecutor is None   # close() only shuts down our own executor
+        if callbackExecutor is None:
+            callbackExecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="callback")
+        self.callbacks = CallbackDispatcher(callbackExecutor, self._logger)
+        self.subscriptions = SubscriptionHub()  # bounded per-subscriber queues of received frames
+
+        if coalesceKey is not None and writeQueueSize <= 0:
+            raise ValueError("Coalescing commands needs the send queue, writeQueueSize must be > 0")
+        if writeQueueSize > 0 and manager is None:
+            self.sendQueue = SendQueue(self._write_batch, maxsize=writeQueueSize, logger=self._logger,
+                                       wait_writable=self._wait_connected)
+
 
         # try to open the port
         self.open(port = self.serial_port_name, baudrate=self.baudrate)
@@ -82,15 +164,42 @@ class Serial:
         '''
         if baudrate is None:
             baudrate = self.baudrate
-        self.serial_device = self.openDevice(port=port, baudrate=baudrate)
+        if self._closeEvent.is_set() and self._ownsCallbackExecutor:
+            # close() shut the callback workers down
+            self.callbacks.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="callback")
+        self._closeEvent.clear()
+        self._start_session(self.openDevice(port=port, baudrate=baudrate))
+
+    def _start_session(self, serial_device):
+        '''
+        Start reading and writing a freshly opened port
+        '''
+        self.serial_device = serial_device
         self.is_connected = True
+        self.framing = "text"   # a freshly opened device always starts with text and JSON
+        self.codec = JsonCodec()
+        self.framer.acceptBinary = False
         self.start_reading()
+        if self.sendQueue is not None:
+            self.sendQueue.start()
+        self._connectedEvent.set()
+        if self.requestedFraming != "text" and not isinstance(self.serial_device, MockSerial):
+            self.negotiateFraming(self.requestedFraming, self.requestedCodec.name)
         
     def close(self):
         ''' 
         Stop threads adn close the serial port
         '''
+        self._closeEvent.set()
+        if self._reconnectThread is not None and self._reconnectThread is not threading.current_thread():
+            self._reconnectThread.join()
+        if self.sendQueue is not None:
+            self.sendQueue.stop()
+        self.subscriptions.close_all()
         self.stop_reading()
+        if self._ownsCallbackExecutor:
+            # the callbacks that are queued still run, a callback may call close() itself
+            self.callbacks.executor.shutdown(wait=False)
         self.closeDevice()
         
     def openDevice(self, port=None, baudrate=115200):
@@ -102,55 +211,121 @@ class Serial:
         
         The order is as follows:
         0. Try to close the serial port if it is open
-        1. Try to connect to the given port
-        2. If the firmware is correct, return the serial object
-        3. If the firmware is incorrect, try to connect to the correct port by scanning all available ports
-        4. If the firmware is correct, return the serial object
-        5. If the firmware is incorrect, return a MockSerial object
-        6. If no USB device is connected, return a MockSerial object        
+        1. Try to connect to the given port (with a short handshake if it belongs to a known device)
+        2. Try the other devices from the known-device cache with a short handshake
+        3. If the firmware is correct, return the serial object
+        4. If the firmware is incorrect, try to connect to the correct port by scanning all available ports
+        5. If the firmware is correct, return the serial object
+        6. If the firmware is incorrect, return a MockSerial object
+        7. If no USB device is connected, return a MockSerial object        
         '''
         
         # try to close an eventually open serial connection
         if hasattr(self, "serial_port_name") and self.serial_device is not None and str(type(self.serial_device)) != "<class 'uc2rest.mserial.MockSerial'>":
             self.closeDevice()
         
-        # first try to connect to a given port 
-        if port is not None:
-            isUC2, serial_device = self.tryToConnect(port=port)
-            if isUC2:
-                self.is_connected = True
+        knownPorts = self._known_ports() if self.deviceCache is not None else []
+        # first try to connect to a given port, it may be one of several boards
+        isUC2 = False
+        if port is not None and self._is_port_free(port):
+            if any(known.device == port for known in knownPorts):
+                isUC2, serial_device = self.tryToConnect(port, warmup=T_SERIAL_WARMUP_KNOWN,
+                                                         bufferTimeout=T_BUFFER_TIMEOUT_KNOWN)
+            else:
+                isUC2, serial_device = self.tryToConnect(port=port)
+        # then the devices we have talked to before, e.g. the board came back under a new name
+        if not isUC2 and knownPorts:
+            isUC2, serial_device = self.tryKnownDevices(knownPorts, skipPort=port)
+        if isUC2:
+            self.is_connected = True
         # if not successful scan for alternative ports
-        if port is None or not isUC2:
+        else:
             serial_device = self.findCorrectSerialDevice()
             if serial_device is None:
                 serial_device = MockSerial(port, baudrate, timeout=.1)
                 self.is_connected = False
+        if self.deviceCache is not None and not isinstance(serial_device, MockSerial):
+            self.rememberDevice(serial_device)
 
         # TODO: Need to be able to auto-connect
         # need to let device warm up and flush out any old data
         #self.freeSerialBuffer(serial_device)
         return serial_device
     
-    def findCorrectSerialDevice(self):
+    def _is_port_free(self, port):
+        '''
+        False if the port is held by another device of our manager
+        '''
+        return self.manager is None or not self.manager.owns_port(port)
+
+    def _known_ports(self):
+        '''
+        The connected ports that belong to devices from the known-device cache,
+        the most recently used first
+        '''
+        try:
+            _available_ports = list_ports.comports(include_links=False)
+        except Exception as e:
+            self._logger.debug("[KnownPorts]: "+str(e))
+            return []
+        return list(self.deviceCache.candidates(_available_ports, self.baudrate))
+
+    def tryKnownDevices(self, knownPorts=None, skipPort=None):
+        '''
+        Try the connected ports that belong to devices from the known-device cache,
+        the most recently used first, with a shortened handshake (skipPort was tried already)
+        returns isUC2, serial_device
+        '''
+        if knownPorts is None:
+            knownPorts = self._known_ports()
+        for port in knownPorts:
+            if port.device == skipPort or not self._is_port_free(port.device):
+                continue
+            isUC2, serial_device = self.tryToConnect(port.device, warmup=T_SERIAL_WARMUP_KNOWN,
+                                                     bufferTimeout=T_BUFFER_TIMEOUT_KNOWN)
+            if isUC2:
+                self._logger.debug(f"Reconnected to known device on port {port.device}")
+                self.manufacturer = port.manufacturer
+                return True, serial_device
+        return False, None
+
+    def rememberDevice(self, serial_device):
+        '''
+        Store the USB identity of the connected port in the known-device cache
+        '''
+        try:
+            for port in list_ports.comports(include_links=False):
+                if port.device == serial_device.port:
+                    self.deviceCache.remember(port, self.baudrate)
+                    return
+        except Exception as e:
+            self._logger.debug("[RememberDevice]: "+str(e))
+
+    def findCorrectSerialDevice(self, probeDeadline=T_PROBE_DEADLINE):
         '''
         This function tries to find the correct serial device from the list of available ports
         It also checks if the firmware is correct by sending a command and checking for the correct response
         It may be that - depending on the OS - the response may be corrupted
         If this is the case try to hard-code the COM port into the config JSON file
         
+        All candidate ports are probed at the same time, the first one that turns out to
+        be a UC2 device wins and the remaining probes are cancelled.
+        
         returns serial_device
         '''
         _available_ports = list_ports.comports(include_links=False)
         ports_to_check = ["COM", "/dev/tt", "/dev/a", "/dev/cu.SLA", "/dev/cu.wchusb"]
         descriptions_to_check = ["CH340", "CP2102"]
 
-        for port in _available_ports:
-            if any(port.device.startswith(allowed_port) for allowed_port in ports_to_check) or \
-               any(port.description.startswith(allowed_description) for allowed_description in descriptions_to_check):
-                isUC2, serial_device = self.tryToConnect(port.device)
-                if isUC2:
-                    self.manufacturer = port.manufacturer
-                    return serial_device
+        candidates = [port for port in _available_ports
+                      if any(port.device.startswith(allowed_port) for allowed_port in ports_to_check) or
+                      any(port.description.startswith(allowed_description) for allowed_description in descriptions_to_check)]
+        candidates = [port for port in candidates if self._is_port_free(port.device)]
+        if candidates:
+            serial_device, port = self.probePorts(candidates, probeDeadline)
+            if serial_device is not None:
+                self.manufacturer = port.manufacturer
+                return serial_device
 
         self.is_connected = False
         self.serialport = "NotConnected"
@@ -158,30 +333,80 @@ class Serial:
         self.manufacturer = "UC2Mock"
         return None
     
-    def tryToConnect(self, port):
+    def probePorts(self, candidates, probeDeadline=T_PROBE_DEADLINE):
+        '''
+        Run tryToConnect on all candidate ports concurrently
+        
+        The first confirmed UC2 device wins, all other probes are cancelled and the
+        ports they opened are closed as soon as they return.
+        returns serial_device, port or None, None if no device answered within probeDeadline
+        '''
+        cancelEvent = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="probe")
+        futures = {executor.submit(self.tryToConnect, port.device, cancelEvent): port for port in candidates}
+        winner = None
+        try:
+            for future in as_completed(futures, timeout=probeDeadline):
+                isUC2, serial_device = future.result()
+                if isUC2:
+                    winner = future
+                    self._logger.debug(f"Found UC2 device on port {futures[future].device}")
+                    return serial_device, futures[future]
+        except FutureTimeoutError:
+            self._logger.debug(f"Probing the serial ports took longer than {probeDeadline} seconds.")
+        finally:
+            cancelEvent.set()
+            for future in futures:
+                if future is not winner:
+                    future.add_done_callback(self._close_probe)
+            executor.shutdown(wait=False)
+        return None, None
+
+    def _close_probe(self, future):
+        '''
+        Close the port of a probe that lost the race
+        '''
+        try:
+            isUC2, serial_device = future.result()
+            if serial_device is not None:
+                serial_device.close()
+        except Exception as e:
+            self._logger.debug("[ProbePorts]: "+str(e))
+
+    def tryToConnect(self, port, cancelEvent=None, warmup=T_SERIAL_WARMUP, bufferTimeout=4):
         '''
         Try to connect to the serial port and check if the firmware is correct
+        cancelEvent (threading.Event) aborts the check early, e.g. when another port won
+        warmup and bufferTimeout can be shortened for devices known to be UC2 boards
         returns isUC2, serial_device
         '''
+        serial_device = None
         try:
             serial_device = serial.Serial(port=port, baudrate=self.baudrate, timeout=0)
-            time.sleep(T_SERIAL_WARMUP)
-            mBufferCode = self.freeSerialBuffer(serial_device)
+            if cancelEvent is None:
+                time.sleep(warmup)
+            elif cancelEvent.wait(warmup):
+                serial_device.close()
+                return False, None
+            mBufferCode = self.freeSerialBuffer(serial_device, timeout=bufferTimeout, cancelEvent=cancelEvent)
             # in case we have a correct firmware we can return early
             if mBufferCode == 1:
                 return True, serial_device
-            if self.checkFirmware(serial_device):
+            if self.checkFirmware(serial_device, cancelEvent=cancelEvent, bufferTimeout=bufferTimeout):
                 self.NumberRetryReconnect = 0
                 return True, serial_device
-            else:
-                False, None
 
         except Exception as e:
             self._logger.debug(f"Trying out port {port} failed: "+str(e))
 
+        if serial_device is not None:
+            try:
+                serial_device.close()
+            except Exception:
+                pass
         return False, None
 
-    def freeSerialBuffer(self, serial_device, timeout=4, nLinesWait=1000, nEmptyLinesUntilBreak = 10):
+    def freeSerialBuffer(self, serial_device, timeout=4, nLinesWait=1000, nEmptyLinesUntilBreak = 10, cancelEvent=None):
         # read for 1000 lines to empty the buffer (e.g. debug messages from ESP32)
         '''
         it returns:
@@ -205,31 +430,56 @@ class Serial:
                 
             if time.time()-cTime > timeout:
                 return 0
+            if cancelEvent is not None and cancelEvent.is_set():
+                return 0
             time.sleep(0.02)
             
-    def checkFirmware(self, ser, nMaxLineRead=500):
+    def checkFirmware(self, ser, nMaxLineRead=500, cancelEvent=None, bufferTimeout=4):
         """Check if the firmware is correct
         We do not do that inside the queue processor yet
         """
         path = "/state_get"
         payload = {"task": path}
         if self.DEBUG: self._logger.debug("[checkFirmware]: "+str(payload))
-        ser.write(json.dumps(payload).encode('utf-8'))
+        ser.write(json_dumps(payload))
         ser.write(b'\n')
         ser.flush() # Ensure data is sent immediately
             
         # iterate a few times in case the debug mode on the ESP32 is turned on and it sends additional lines
         for i in range(nMaxLineRead):
+            if cancelEvent is not None and cancelEvent.is_set():
+                return False
             # if we just want to send but not even wait for a response
             if ser.in_waiting:
                 mLine = ser.read(ser.in_waiting)
                 #mReadline = ser.readline()
                 if self.DEBUG and mLine != "": self._logger.debug("[checkFirmware]: "+str(mLine))
                 if mLine.decode('utf-8').strip() == "++":
-                    self.freeSerialBuffer(ser)
+                    self.freeSerialBuffer(ser, timeout=bufferTimeout, cancelEvent=cancelEvent)
                     return True
+            else:
+                time.sleep(0.002) # give the device some time to answer
         return False
 
+    def _prepare_message(self, data):
+        '''
+        Turn a message into a dictionary and get its query ID,
+        a new one is generated if the message does not carry one
+        (the qid is added to a copy, the caller's dictionary is left as it is)
+        
+        returns data, qid
+        '''
+        # if the data is a string, convert it to a dictionary
+        if type(data) == str:
+            data = json_loads(data)
+        try:
+            cqid = data["qid"]
+            self.identifier_counter = cqid
+        except: 
+            cqid = self._generate_identifier()
+            data = dict(data, qid=cqid)
+        return data, cqid
+
     def _generate_identifier(self):
         '''
         Generate a unique identifier for the communication for any command to send
@@ -239,151 +489,388 @@ class Serial:
 
     def breakCurrentCommunication(self):
         self.resetLastCommand = True
+        self.pendingRequests.cancel_all()
         
     def start_reading(self):
         """
         Start reading serial port in a separate thread.
         
-        The read_thread will continously poll the serial port for incoming data and
+        The read_thread will wait for incoming data on the serial port and
         the worker_thread will process the incoming data e.g. parse JSON objects.
+        In "select" mode the read_thread reads straight into the receive buffer
+        of the framer and processes the frames itself, no worker_thread is needed.
         """
         if self.is_connected:
+            if self.manager is not None and not self._isManaged:
+                # the selector thread of the manager does the reading
+                self._isManaged = self.manager.attach(self)
+                if self._isManaged:
+                    return
             if not self.isReadingLoopRunning:
+                if self.readMode == "select" and SelectReader.is_supported(self.serial_device):
+                    self._selectReader = SelectReader(self.serial_device)
                 self.read_thread = threading.Thread(target=self._read_loop)
                 self.read_thread.start()
-            if not self.isWritingLoopRunning:
+            if not self.isWritingLoopRunning and self._selectReader is None:
                 self.worker_thread = threading.Thread(target=self._process_data)
                 self.worker_thread.start()
         
 
     def stop_reading(self):
         """Stop reading loop and close serial port."""
-        if self.is_connected:
+        if self._isManaged:
+            self.is_connected = False
+            self._isManaged = False
+            self.manager.detach(self)
+        elif self.is_connected:
             self.is_connected = False
+            if self._selectReader is not None:
+                self._selectReader.wakeup()
+            if self.worker_thread is not None and self.worker_thread.is_alive():
+                self.data_queue.put(None)   # release the worker_thread, "select" mode has none
             self.read_thread.join()
         if self.serial_device.is_open:
             self.serial_device.close()
 
 
-    def extract_json_objects(self, s):
-        """
-        Extract JSON objects from a string that starts with '++' and ends with '--',
-        and return the remaining string after the last successful JSON extraction.
-        
-        Parameters:
-        - s (str): The input string containing JSON objects.
-        
-        Returns:
-        - List[dict]: A list of dictionaries parsed from the JSON objects in the string.
-        - str: The remaining part of the string after the last successful JSON object extraction.
-        """
-        parts = s.split('++')
-        dictionaries = []
-        last_position = 0  # Track the position in the original string
-        remainder = ""  # Track the remaining string after the last successful JSON extraction
-        for part in parts:
-            # Attempt to extract the JSON string
-            json_str = part.split('--')[0].strip()
-            if json_str:
-                try:
-                    # Update the position tracker to the end of the current part
-                    last_position += len(part) + 2  # +2 accounts for the '++' delimiter
-                    json_dict = json.loads(json_str)
-                    dictionaries.append(json_dict)
-                except json.JSONDecodeError as e:
-                    try:
-                        #trying to repair the string
-                        import re
-                        match = re.search(r'"qid":(\d+)', json_str)
-                        if match:
-                            qid = int(match.group(1)) 
-                            json_dict = {"qid": qid}
-                            dictionaries.append(json.loads(json.dumps(json_dict)))
-                    except Exception as e:
-                        self._logger.debug(f"Failed to decode JSON: {json_str}. Error: {e}")
-                        last_position = last_position -( len(part) + 2)
-                        #break  # Stop processing further on error
-        
-                        # Extract the remaining string from the last successful position to the end
-                        remainder += s[last_position:]
-    
-        return dictionaries, remainder
-
-
     def _read_loop(self):
         """Read data from serial port and add it to the queue."""
         self.isReadingLoopRunning = True
-        while self.is_connected:
-            if self.serial_device.in_waiting:
-                #with self.serial_io_lock:
-                data = self.serial_device.read(self.serial_device.in_waiting)
-                self.data_queue.put(data)
-            time.sleep(0.05)  # Short delay to prevent CPU overuse
+        error = None
+        if self._selectReader is not None:
+            # block until the device sends something, read it into the receive buffer and parse it right away
+            try:
+                while self.is_connected:
+                    nBytes = self.framer.fill(self._selectReader.readinto)
+                    if nBytes:
+                        self._process_received(nBytes)
+            except OSError as e:
+                self._logger.error("[ReadLoop]: "+str(e))
+                error = e
+            finally:
+                self._selectReader.close()
+                self._selectReader = None
+        else:
+            try:
+                while self.is_connected:
+                    if self.serial_device.in_waiting:
+                        #with self.serial_io_lock:
+                        data = self.serial_device.read(self.serial_device.in_waiting)
+                        self.data_queue.put(data)
+                    time.sleep(0.05)  # Short delay to prevent CPU overuse
+            except OSError as e:    # serial.SerialException is an OSError as well
+                self._logger.error("[ReadLoop]: "+str(e))
+                error = e
         self.isReadingLoopRunning = False
+        if error is not None and self.is_connected:
+            self._connection_lost(error)
         
     def _process_data(self):
         """Process data in a separate thread."""
-        accumulatedRemainder = ""
         self.isWritingLoopRunning = True
         while self.is_connected:
             data = self.data_queue.get()
-            try:
-                #self._logger.debug(data.decode('utf-8'), end='', flush=True)
-                data = data.decode('utf-8')
-                data = data.replace('\t', '').replace('\n', '').replace('\r', '') # Remove whitespace characters - better formatting should do better?
-                
-                # detect a reboot of the device and return the current QIDs
-                if data.find("reboot") >= 0:
-                    self._logger.warning("Device rebooted")
-                    self.resetLastCommand = True
+            if data is None:
+                continue
+            self.framer.append(data)
+            self._process_received(len(data))
+        self.isWritingLoopRunning = False
+
+    def _process_received(self, nBytes):
+        """Parse the nBytes that were just added to the receive buffer of the framer."""
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.received(nBytes)
+        try:
+            # detect a reboot of the device and return the current QIDs
+            if self.framer.recent_contains(b"reboot", nBytes):
+                self._logger.warning("Device rebooted")
+                self.resetLastCommand = True
+                self.framer.reset()
+                self._connection_lost()
+                return
+            
+            for frame in self.framer.parse():
+                dictionary = self.decodePayload(frame)
+                if dictionary is None:
+                    self._logger.debug(f"Failed to decode JSON: {bytes(frame)}")
+                    if metrics is not None:
+                        metrics.parse_error()
                     continue
-                
-                dictionaries, remainder = self.extract_json_objects(accumulatedRemainder + data)
-                accumulatedRemainder += remainder
-                self._logger.debug(accumulatedRemainder)
-                #self._logger.debug(dictionaries)
-                for dictionary in dictionaries:
+                if metrics is not None:
+                    metrics.frame_received()
                     if "qid" in dictionary:
-                        self.queueFinalizedQueryIDs.append(dictionary["qid"])
-                        
-                        # add the response to the dictionary
-                        if dictionary["qid"] in self.responses:
-                            self.responses[dictionary["qid"]].append(dictionary)
-                        else:
-                            self.responses[dictionary["qid"]] = [dictionary]
-                            
-                        if self.DEBUG: self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
+                        metrics.response_received(dictionary["qid"], self)
+                if "qid" in dictionary:
+                    # add the response to the store
+                    self.responses.add(dictionary["qid"], dictionary)
                         
-                        if len(self.callBackList) > 0:
-                            for callback in self.callBackList:
-                                # check if json has key
-                                try:
-                                    if callback["pattern"] in dictionary:
-                                        callback["callbackfct"](dictionary)
-                                except Exception as e:
-                                    self._logger.error("[ProcessCommands]: "+str(e))
-
-                    else:
-                        self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+                    if self.DEBUG: self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
+                    
+                    # wake up the caller waiting for this QID
+                    self.pendingRequests.resolve(dictionary["qid"], dictionary)
+                    
+                    # hand the frame to the callbacks registered for one of its keys
+                    self.callbacks.dispatch(dictionary)
 
-            except Exception as e:
-                self._logger.debug(f"Failed to decode data: {data}. Error: {e}")
-            time.sleep(0.05)  # Short delay to prevent CPU overuse
-        self.isWritingLoopRunning = False
+                else:
+                    self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+
+                # queue the frame for the subscribers
+                self.subscriptions.publish(dictionary)
+
+        except Exception as e:
+            self._logger.debug(f"Failed to decode data: {e}")
                 
+    def _connection_lost(self, exc=None):
+        '''
+        The device rebooted (exc is None) or its port went away
+        
+        The commands in flight are failed right away (unless they are replayed after
+        the reconnect) and the port is reopened in the background if autoReconnect is set.
+        '''
+        with self._reconnectLock:
+            if self._isReconnecting or self._closeEvent.is_set():
+                return
+            if exc is None:
+                self.nReboots += 1
+            else:
+                self.nDisconnects += 1
+            willReconnect = self.autoReconnect and not isinstance(self.serial_device, MockSerial)
+            self._isReconnecting = willReconnect
+        if not (willReconnect and self.replayInFlight):
+            self.nFailedInFlight += self.pendingRequests.cancel_all()
+        else:
+            # commands still waiting in the send queue are written after the reconnect anyway
+            self._replayRequests = [request for request in self.pendingRequests.pending() if request.isWritten]
+        if not willReconnect:
+            if exc is not None:
+                self.is_connected = False
+            return
+        self._connectedEvent.clear()
+        self._reconnectThread = threading.Thread(target=self._reconnect, args=(time.monotonic(),),
+                                                 name="serial-reconnect", daemon=True)
+        self._reconnectThread.start()
+
+    def _reconnect(self, lostTime):
+        '''
+        Reopen the last port, waiting T_RECONNECT_INITIAL seconds after the first failed
+        attempt and twice as long after every further one (at most T_RECONNECT_MAX)
+        '''
+        port = getattr(self.serial_device, "port", None) or self.serial_port_name
+        self.stop_reading()
+        delay = T_RECONNECT_INITIAL
+        serial_device = None
+        while not self._closeEvent.is_set():
+            isUC2, serial_device = self.tryToConnect(port, cancelEvent=self._closeEvent, warmup=T_SERIAL_WARMUP_KNOWN,
+                                                     bufferTimeout=T_BUFFER_TIMEOUT_KNOWN)
+            if isUC2:
+                break
+            serial_device = None
+            if self.reconnectTimeout is not None and time.monotonic() + delay - lostTime > self.reconnectTimeout:
+                self._logger.error(f"[Reconnect]: Gave up reopening {port} after {self.reconnectTimeout} seconds")
+                break
+            self._logger.debug(f"[Reconnect]: {port} is not back yet, next attempt in {delay} seconds")
+            if self._closeEvent.wait(delay):
+                break
+            delay = min(2 * delay, T_RECONNECT_MAX)
+        if serial_device is None or self._closeEvent.is_set():
+            if serial_device is not None:
+                serial_device.close()
+            with self._reconnectLock:
+                self._isReconnecting = False
+            self._replayRequests = []
+            self.nFailedInFlight += self.pendingRequests.cancel_all()
+            return
+        self._start_session(serial_device)
+        with self._reconnectLock:
+            self._isReconnecting = False
+        self.nReconnects += 1
+        self.lastReconnectTime = time.monotonic() - lostTime
+        self._logger.warning(f"Reconnected to {port} after {self.lastReconnectTime:.2f} seconds")
+        if self.replayInFlight:
+            self._replay_in_flight()
+
+    def _replay_in_flight(self):
+        '''
+        Send the commands that were written before the connection was lost and are
+        still waiting for their first response once more
+        '''
+        requests, self._replayRequests = self._replayRequests, []
+        for request in requests:
+            if request.done:
+                continue
+            if request.responses or request.payload is None:
+                # it was (partly) answered, sending it again could execute it twice
+                request.cancel()
+                self.nFailedInFlight += 1
+                continue
+            try:
+                self._send(request.payload, request=request)
+                self.nReplayed += 1
+            except Exception as e:
+                self._logger.error("[Replay]: "+str(e))
+                request.cancel()
+                self.nFailedInFlight += 1
+
+    def getReconnectStats(self):
+        '''
+        Detected reboots and disconnects, successful reconnects with the duration
+        of the last one, replayed and failed commands
+        '''
+        return {"reboots": self.nReboots, "disconnects": self.nDisconnects,
+                "reconnects": self.nReconnects, "reconnecting": self._isReconnecting,
+                "last_reconnect_s": self.lastReconnectTime,
+                "replayed": self.nReplayed, "failed_in_flight": self.nFailedInFlight}
+
     def register_callback(self, callback, pattern):
         '''
         we need to add a callback function to a list of callbacks that will be read during the serial communication
         loop
+        
+        callback(dictionary) is called for every frame that has pattern as a top-level key,
+        the calls for one pattern are made in the order the frames arrived
         '''
-        self.callBackList.append({"callbackfct":callback, "pattern":pattern})
+        self.callbacks.register(callback, pattern)
+
+    def unregister_callback(self, callback, pattern=None):
+        self.callbacks.unregister(callback, pattern)
 
-    def write_data(self, data: str):
-        """Send data to the serial port."""
+    def subscribe(self, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        '''
+        Iterate over the received frames that have pattern as a top-level key
+        (all frames for None), also the ones without a QID
+        
+        Every subscriber gets its own queue of up to maxsize frames, overflow is
+        "drop-oldest", "drop-newest" or "block" (stalls the parsing thread until
+        the subscriber catches up). Close the subscription (or use it as a context
+        manager) when done, iterating ends when the port is closed.
+        '''
+        return self.subscriptions.add(Subscription(self.subscriptions, pattern, maxsize, overflow))
+
+    def getCallbackStats(self):
+        '''
+        Number of calls, errors and time spent per registered callback
+        '''
+        return self.callbacks.stats()
+
+    def write_data(self, data):
+        """Send data (str or already encoded bytes) to the serial port right away."""
+        self._write_batch([data.encode('utf-8') if isinstance(data, str) else data])
+
+    def _wait_connected(self, stopEvent):
+        '''
+        Block while the device is reconnecting (at most timeout seconds or until stopEvent is set)
+        
+        returns False if the device did not come back
+        '''
+        deadline = time.monotonic() + self.timeout
+        while self._isReconnecting and not stopEvent.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._connectedEvent.wait(min(remaining, T_WAIT_SLICE)):
+                return True
+        return not self._isReconnecting
+
+    def _write_batch(self, payloads):
+        """Write several payloads with a single write and flush."""
+        if self._isReconnecting and not self._connectedEvent.wait(self.timeout):
+            raise ConnectionError("The device did not come back within the timeout")
+        data = self._encode_batch(payloads)
+        if self.metrics is not None:
+            self.metrics.sent(len(data), len(payloads))
+        if self._isManaged:
+            self.manager.write(self, data).result(self.timeout)
+            return
         with self.serial_write_lock:
             if self.DEBUG: self._logger.debug(f"Writing data: {data}")
-            self.serial_device.write(data.encode('utf-8'))
+            self.serial_device.write(data)
             self.serial_device.flush() # Ensure data is sent immediately
+
+    def _encode_batch(self, payloads):
+        if self.framing == "binary":
+            payloads = [encode_binary_frame(payload) for payload in payloads]
+        return payloads[0] if len(payloads) == 1 else b"".join(payloads)
+
+    def negotiateFraming(self, framing="binary", codec="json", mTimeout=1.):
+        '''
+        Ask the device to switch the wire format and payload encoding
+        
+        The request goes out in the current format as
+        {"task": "/framing_set", "framing": ..., "codec": ...}; only what the device confirms
+        with the same "framing"/"codec" values is switched on our side as well. Older firmware
+        answers with -QID or not at all and we stay with text and JSON. Binary frames are
+        only parsed from the request on (the device may switch before its answer arrives)
+        and, unless it agreed, not any longer afterwards; in text output the sync bytes
+        may show up by chance.
+        returns True if the device switched the framing
+        '''
+        message = {"task": "/framing_set", "framing": framing}
+        if codec != "json":
+            message["codec"] = codec
+        wasAcceptingBinary = self.framer.acceptBinary
+        self.framer.acceptBinary = True
+        response = self.sendMessage(message, mTimeout=mTimeout)
+        if not isinstance(response, list) or not any(r.get("framing") == framing for r in response):
+            self.framer.acceptBinary = wasAcceptingBinary
+            self._logger.debug(f"Device does not support {framing} framing, staying with {self.framing}")
+            return False
+        self.framer.acceptBinary = framing == "binary"
+        self.framing = framing
+        self._logger.debug(f"Switched to {framing} framing")
+        if codec != "json":
+            if any(r.get("codec") == codec for r in response):
+                self.codec = get_codec(codec)
+                self._logger.debug(f"Switched to {codec} payloads")
+            else:
+                self._logger.debug(f"Device does not support {codec} payloads, staying with {self.codec.name}")
+        return True
+
+    def decodePayload(self, payload):
+        '''
+        Turn a received frame payload into a dictionary
+        
+        JSON payloads start with "{" (or whitespace), anything else was encoded
+        with the negotiated binary codec.
+        returns None if the payload could not be decoded
+        '''
+        if self.codec.isBinary and payload[:1] not in (b"{", b"\n", b"\r", b"\t", b" "):
+            try:
+                return self.codec.decode(payload)
+            except Exception as e:
+                self._logger.debug(f"Failed to decode {self.codec.name} payload: {e}")
+                return None
+        return decode_frame(payload)
+
+    def getSendQueueStats(self):
+        '''
+        Number of queued, sent, coalesced (replaced before being written) and skipped
+        (given up before being written) commands and of write batches, None if the
+        commands are written directly
+        '''
+        if self.sendQueue is None:
+            return None
+        return self.sendQueue.stats()
+
+    def getMetrics(self):
+        '''
+        Snapshot of the link statistics as a dictionary: round trip histograms per
+        task (ms), bytes/frames sent and received with their rates per second,
+        parse errors, timeouts and the current queue depths; None if disabled
+        '''
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(data_queue=self.data_queue.qsize(),
+                                     send_queue=len(self.sendQueue) if self.sendQueue is not None else 0,
+                                     pending_requests=len(self.pendingRequests),
+                                     framing=self.framer.stats())
+
+    def getFramingStats(self):
+        '''
+        Counters of received text/binary frames and detected corruption
+        '''
+        return self.framer.stats()
             
     def sendMessage(self, data:str, nResponses: int=1, mTimeout:float=20., blocking:bool=True):
         '''
@@ -394,46 +881,198 @@ class Serial:
         If nResponses is 1, then the command is sent and the response is returned.
         If nResponses is >1, then the command is sent and a list of responses is returned.
         '''
-        # if no qid can be assigned to the return message, do not block
-        # if the data is a string, convert it to a dictionary
-        if type(data) == str:
-            data = json.loads(data)
-        try:
-            cqid = data["qid"]
-            self.identifier_counter = cqid
-        except: 
-            cqid = self._generate_identifier()
+        data, cqid = self._prepare_message(data)
         if self.DEBUG: self._logger.debug(f"Sending message: {cqid}, blocking: {blocking}, message length: {len(data)}")
-        self.write_data(json.dumps(data))
-        # wait for the response
-        cTime = time.time()
+        return self._send_payload(self.codec.encode(data), cqid, nResponses, mTimeout, blocking,
+                                  self._coalesce_key(data), data.get("task"))
+
+    def _coalesce_key(self, data):
+        if self.coalesceKey is None:
+            return None
+        try:
+            return self.coalesceKey(data)
+        except Exception as e:
+            self._logger.debug(f"Failed to get the coalescing key: {e}")
+            return None
+
+    def _send(self, payload, key=None, request=None, timeout=None):
+        '''
+        Hand a payload to the writer thread or write it right away
+        
+        returns a Future that is resolved once the payload was flushed
+        '''
+        if self.sendQueue is not None:
+            future = self.sendQueue.put(payload, key, request, timeout)
+        elif self._isManaged:
+            # the selector thread writes what the port does not take right away
+            data = self._encode_batch([payload])
+            if self.metrics is not None:
+                self.metrics.sent(len(data))
+            future = self.manager.write(self, data)
+        else:
+            future = Future()
+            self.write_data(payload)
+            future.set_result(True)
+        if request is not None:
+            future.add_done_callback(lambda future: self._write_done(request, future))
+        return future
+
+    def _write_done(self, request, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            request.cancel()
+        else:
+            request.isWritten = True
+
+    def postMessage(self, data, mTimeout:float=None):
+        '''
+        Queue a message without waiting for it to be written or answered
         
+        returns the Future of the write (resolved once the message was flushed,
+        cancelled if a newer command with the same coalescing key replaced it)
+        '''
+        data, cqid = self._prepare_message(data)
+        return self._send(self.codec.encode(data), self._coalesce_key(data), timeout=mTimeout)
+
+    def _send_payload(self, payload, cqid, nResponses, mTimeout, blocking, key=None, task=None):
         if nResponses == 0 or mTimeout <= 0 or blocking == False:
-            blocking = False
-            time.sleep(0.1) # short delay to prevent CPU overuse
+            self._send(payload, key, timeout=mTimeout if mTimeout > 0 else None)
+            if self.sendQueue is None and not self._isManaged:
+                time.sleep(0.1) # short delay to prevent CPU overuse
             return cqid
         
-        while blocking:
-            try:
-                if time.time() - cTime > mTimeout:
-                    self._logger.debug(f"Timeout of {mTimeout} seconds reached.")
-                    break
-                # compare with any received responses
-                qids = self.queueFinalizedQueryIDs.get()
-                if cqid in qids and qids.count(cqid) >= nResponses:
-                    return self.responses[cqid]
-                if -cqid in qids:
-                    self._logger.debug("You have sent the wrong command!")
-                    return "Wrong Command"
-            except queue.Empty:
-                #self._logger.debug("Waiting for response...")
-                pass
-            time.sleep(0.05) # short delay to prevent CPU overuse
+        # register the QID before writing so that a fast response cannot be missed
+        request = self.pendingRequests.register(cqid, nResponses, payload=payload)
+        if self.metrics is not None:
+            self.metrics.command_sent(cqid, task, self)
+        try:
+            self._send(payload, key, request, mTimeout)
+        except Exception:
+            self.pendingRequests.discard(request)
+            if self.metrics is not None:
+                self.metrics.forget(cqid, self)
+            raise
+        return self.getResponse(request, mTimeout)
+
+    def createTemplate(self, command, fields=None):
+        '''
+        Pre-encode a command that is sent over and over with a few changed fields
+        
+        fields maps a name to the path of a numeric value in the command, e.g.
+        {"position": ("motor", "steppers", 0, "position")}; the qid is always a field.
+        Send it with sendTemplate(template, position=1000). This saves the JSON
+        encoding with the standard library backend; with orjson sendMessage costs
+        about the same (see benchmarks/command_templates.py).
+        '''
+        return CommandTemplate(command, fields)
+
+    def sendTemplate(self, template, nResponses: int=1, mTimeout:float=20., blocking:bool=True, **values):
+        '''
+        Send a command created with createTemplate, the given field values are
+        filled into the pre-encoded bytes
+        
+        A new qid is generated unless one is given. Returns the same as sendMessage.
+        '''
+        cqid = values.get("qid")
+        if cqid is None:
+            cqid = values["qid"] = self._generate_identifier()
+        else:
+            self.identifier_counter = cqid
+        command = template.as_dict(**values) if self.coalesceKey is not None or self.codec.isBinary else None
+        key = self._coalesce_key(command) if self.coalesceKey is not None else None
+        if self.codec.isBinary:
+            # the negotiated codec is not JSON, the pre-encoded bytes cannot be used
+            payload = self.codec.encode(command)
+        else:
+            payload = template.render(**values)
+        return self._send_payload(payload, cqid, nResponses, mTimeout, blocking, key, template.command.get("task"))
+
+    def submitMessage(self, data:str, nResponses: int=1, mTimeout:float=20.):
+        '''
+        Pipelined variant of sendMessage: write the command and return immediately
+        
+        Returns the PendingRequest of the command, pass it to getResponse to wait
+        for the result. At most pipelineWindow submitted commands are in flight,
+        if the window is full this call blocks until a response frees a slot.
+        Every submitted request has to be collected with getResponse, otherwise its
+        slot is only freed once the device answers.
+        '''
+        if not self._pipelineSlots.acquire(timeout=mTimeout):
+            raise TimeoutError(f"No free slot in the pipeline window within {mTimeout} seconds.")
+        try:
+            data, cqid = self._prepare_message(data)
+            if self.DEBUG: self._logger.debug(f"Submitting message: {cqid}, message length: {len(data)}")
+            payload = self.codec.encode(data)
+            request = self.pendingRequests.register(cqid, nResponses, payload=payload)
+        except Exception:
+            self._pipelineSlots.release()
+            raise
+        if self.metrics is not None:
+            self.metrics.command_sent(cqid, data.get("task"), self)
+        # the slot is given back as soon as the request is answered, cancelled or timed out
+        request.add_done_callback(lambda request: self._pipelineSlots.release())
+        try:
+            self._send(payload, self._coalesce_key(data), request, mTimeout)
+        except Exception:
+            request.cancel()
+            self.pendingRequests.discard(request)
+            if self.metrics is not None:
+                self.metrics.forget(cqid, self)
+            raise
+        return request
+
+    def getResponse(self, request, mTimeout:float=20.):
+        '''
+        Wait for the responses of a registered request
+        
+        Returns the list of responses, "Wrong Command" if the device did not
+        understand the command or None on timeout/cancellation.
+        '''
+        cqid = request.qid
+        try:
+            # wait for the response, _process_data wakes us up
+            if not request.wait(mTimeout):
+                self._logger.debug(f"Timeout of {mTimeout} seconds reached.")
+                if self.metrics is not None:
+                    self.metrics.timed_out(cqid, self)
+                request.cancel()
+                return None
+        finally:
+            self.pendingRequests.discard(request)
+            if self.metrics is not None:
+                self.metrics.forget(cqid, self)
+            # the caller gets the responses from the request, release them in the store
+            self.responses.pop(cqid)
+        if request.isWrongCommand:
+            self._logger.debug("You have sent the wrong command!")
+            return "Wrong Command"
+        if request.isCancelled:
+            self._logger.debug(f"Waiting for query ID {cqid} was cancelled.")
+            return None
+        return request.responses
+
+    def sendMessages(self, messages, nResponses: int=1, mTimeout:float=20.):
+        '''
+        Send a burst of commands with up to pipelineWindow of them in flight
+        
+        New commands are written while earlier responses are still outstanding,
+        so the burst is not paced by the round trip of every single command.
+        Returns the results in the order of messages, each one as returned by sendMessage.
+        '''
+        inFlight = deque()
+        results = []
+        for message in messages:
+            if len(inFlight) >= self.pipelineWindow:
+                results.append(self.getResponse(inFlight.popleft(), mTimeout))
+            inFlight.append(self.submitMessage(message, nResponses, mTimeout))
+        while inFlight:
+            results.append(self.getResponse(inFlight.popleft(), mTimeout))
+        return results
 
     def get_json(self, path, timeout=1):
         message = {"task":path}
-        message = json.dumps(message)
-        return self.sendMessage(message, nResponses=0, timeout=timeout)
+        return self.sendMessage(message, nResponses=0, mTimeout=timeout)
 
     def post_json(self, path, payload, getReturn=True, nResponses=1, timeout=100):
         """Make an HTTP POST request and return the JSON response"""
@@ -149,7 +149,7 @@ def clear(app, args):
     """
     Clears the received data window.
     """
-    app.receive_window.set_text('')
+    app.receive_window.clear()
     return {'status': None,
             'bytes_to_send': None}
 
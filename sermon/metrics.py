@@ -0,0 +1,182 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+# upper bounds of the round trip histogram buckets in milliseconds, the last bucket is unbounded
+RTT_BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+RATE_WINDOW = 5     # seconds the per-second rates are averaged over
+MAX_TRACKED_QIDS = 1024
+
+
+class Histogram:
+    '''
+    Counts of values in fixed buckets plus count, sum, min and max
+
+    Percentiles are estimated from the buckets (upper bound of the bucket
+    the percentile falls into).
+    '''
+    def __init__(self, buckets=RTT_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count,
+                "mean": self.sum / self.count if self.count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.percentile(.5), "p90": self.percentile(.9), "p99": self.percentile(.99),
+                "buckets": {("le_%g" % bound if i < len(self.buckets) else "inf"): count
+                            for i, (bound, count) in enumerate(zip(self.buckets + (None,), self.counts)) if count}}
+
+
+class RateCounter:
+    '''
+    Running total plus the average per second over the last RATE_WINDOW seconds
+    '''
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.total = 0
+        self.startTime = time.monotonic()
+        self._second = int(self.startTime)
+        self._perSecond = [0] * (window + 1)   # the last window full seconds and the current one
+
+    def add(self, n=1):
+        second = int(time.monotonic())
+        if second != self._second:
+            self._advance(second)
+        self.total += n
+        self._perSecond[second % len(self._perSecond)] += n
+
+    def _advance(self, second):
+        for skipped in range(self._second + 1, min(second, self._second + len(self._perSecond)) + 1):
+            self._perSecond[skipped % len(self._perSecond)] = 0
+        self._second = second
+
+    def rate(self):
+        now = time.monotonic()
+        if int(now) != self._second:
+            self._advance(int(now))
+        covered = min(self.window + now % 1, now - self.startTime)
+        return sum(self._perSecond) / covered if covered > 0 else 0.
+
+    def snapshot(self):
+        return {"total": self.total, "per_second": self.rate()}
+
+
+class MetricsRegistry:
+    '''
+    Link statistics of one client: round trip times per task, bytes and frames
+    per direction, parse errors, timeouts and wrong commands
+
+    The clients only call into the registry when metrics are enabled
+    (serial.metrics is None otherwise), so disabled metrics cost a single
+    attribute check per event. The round trip of a command is the time from
+    handing it to the port until its first response, tracked for up to
+    MAX_TRACKED_QIDS commands at a time. A registry can be shared by several
+    clients, the commands are told apart by (client, qid); a client forgets a
+    command it stopped waiting for (cancelled or timed out), so in_flight only
+    counts the commands that are still waited for.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sent = OrderedDict()  # (client, qid) -> (task, time sent)
+        self.rtt = {}               # task -> Histogram in milliseconds
+        self.bytesSent = RateCounter()
+        self.bytesReceived = RateCounter()
+        self.framesSent = RateCounter()
+        self.framesReceived = RateCounter()
+        self.parseErrors = 0
+        self.timeouts = {}          # task -> number of commands that timed out
+        self.wrongCommands = 0
+        self.startTime = time.monotonic()
+
+    def command_sent(self, qid, task, client=None):
+        with self._lock:
+            self._sent[client, qid] = (task, time.perf_counter())
+            if len(self._sent) > MAX_TRACKED_QIDS:
+                self._sent.popitem(last=False)
+
+    def response_received(self, qid, client=None):
+        if qid < 0:
+            self.wrongCommands += 1
+            qid = -qid
+        with self._lock:
+            sent = self._sent.pop((client, qid), None)
+            if sent is None:
+                return
+            task, sentTime = sent
+            histogram = self.rtt.get(task)
+            if histogram is None:
+                histogram = self.rtt[task] = Histogram()
+            histogram.add((time.perf_counter() - sentTime) * 1e3)
+
+    def timed_out(self, qid, client=None):
+        with self._lock:
+            sent = self._sent.pop((client, qid), None)
+            task = sent[0] if sent is not None else None
+            self.timeouts[task] = self.timeouts.get(task, 0) + 1
+
+    def forget(self, qid, client=None):
+        '''
+        Stop tracking a command nobody waits for any more (e.g. it was cancelled)
+        '''
+        with self._lock:
+            self._sent.pop((client, qid), None)
+
+    def sent(self, nBytes, nFrames=1):
+        self.bytesSent.add(nBytes)
+        self.framesSent.add(nFrames)
+
+    def received(self, nBytes):
+        self.bytesReceived.add(nBytes)
+
+    def frame_received(self):
+        self.framesReceived.add()
+
+    def parse_error(self):
+        self.parseErrors += 1
+
+    def snapshot(self, **gauges):
+        '''
+        Everything as a dictionary, gauges (e.g. queue depths) are added as they are
+        '''
+        with self._lock:
+            rtt = {task: histogram.snapshot() for task, histogram in self.rtt.items()}
+            inFlight = len(self._sent)
+            timeouts = dict(self.timeouts)
+        snapshot = {"uptime_s": time.monotonic() - self.startTime,
+                    "rtt_ms": rtt,
+                    "in_flight": inFlight,
+                    "bytes_sent": self.bytesSent.snapshot(),
+                    "bytes_received": self.bytesReceived.snapshot(),
+                    "frames_sent": self.framesSent.snapshot(),
+                    "frames_received": self.framesReceived.snapshot(),
+                    "parse_errors": self.parseErrors,
+                    "timeouts": timeouts,
+                    "wrong_commands": self.wrongCommands}
+        snapshot.update(gauges)
+        return snapshot
@@ -1,9 +1,11 @@
 import threading
 import serial
 import time
-import json
 import queue
 from collections import deque
+from framing import FrameParser, decode_frame
+from payloadcodec import json_loads
+from selectreader import SelectReader
 
 class RingBuffer(deque):
     def __init__(self, size_max):
@@ -16,8 +18,10 @@ class RingBuffer(deque):
     def get(self):
         return list(self)
 class SimpleSerialComm:
-    def __init__(self, port, baudrate=9600):
+    def __init__(self, port, baudrate=9600, readMode="select"):
         self.serial_port = serial.Serial(port, baudrate=baudrate, timeout=0)
+        self.readMode = readMode # "select" blocks on the port, "poll" checks in_waiting every 50 ms
+        self._selectReader = None
         
         self.data_queue = queue.Queue()
         self.in_waiting = False
@@ -43,6 +47,8 @@ class SimpleSerialComm:
         """Start reading serial port in a separate thread."""
         if not self.alive:
             self.alive = True
+            if self.readMode == "select" and SelectReader.is_supported(self.serial_port):
+                self._selectReader = SelectReader(self.serial_port)
             self.read_thread = threading.Thread(target=self._read_loop)
             self.read_thread.start()
             self.worker_thread = threading.Thread(target=self._process_data)
@@ -53,58 +59,28 @@ class SimpleSerialComm:
         """Stop reading loop and close serial port."""
         if self.alive:
             self.alive = False
+            if self._selectReader is not None:
+                self._selectReader.wakeup()
+            self.data_queue.put(None)
             self.read_thread.join()
         if self.serial_port.is_open:
             self.serial_port.close()
 
 
-    def extract_json_objects(self, s):
-        """
-        Extract JSON objects from a string that starts with '++' and ends with '--',
-        and return the remaining string after the last successful JSON extraction.
-        
-        Parameters:
-        - s (str): The input string containing JSON objects.
-        
-        Returns:
-        - List[dict]: A list of dictionaries parsed from the JSON objects in the string.
-        - str: The remaining part of the string after the last successful JSON object extraction.
-        """
-        parts = s.split('++')
-        dictionaries = []
-        last_position = 0  # Track the position in the original string
-        remainder = ""  # Track the remaining string after the last successful JSON extraction
-        for part in parts:
-            # Attempt to extract the JSON string
-            json_str = part.split('--')[0].strip()
-            if json_str:
-                try:
-                    # Update the position tracker to the end of the current part
-                    last_position += len(part) + 2  # +2 accounts for the '++' delimiter
-                    json_dict = json.loads(json_str)
-                    dictionaries.append(json_dict)
-                except json.JSONDecodeError as e:
-                    try:
-                        #trying to repair the string
-                        import re
-                        match = re.search(r'"qid":(\d+)', json_str)
-                        if match:
-                            qid = int(match.group(1)) 
-                            json_dict = {"qid": qid}
-                            dictionaries.append(json.loads(json.dumps(json_dict)))
-                    except Exception as e:
-                        print(f"Failed to decode JSON: {json_str}. Error: {e}")
-                        last_position = last_position -( len(part) + 2)
-                        #break  # Stop processing further on error
-        
-                        # Extract the remaining string from the last successful position to the end
-                        remainder += s[last_position:]
-    
-        return dictionaries, remainder
-
-
     def _read_loop(self):
         """Read data from serial port and add it to the queue."""
+        if self._selectReader is not None:
+            try:
+                while self.alive:
+                    data = self._selectReader.read()
+                    if data:
+                        self.data_queue.put(data)
+            except OSError as e:
+                print(f"Reading from serial port failed: {e}")
+            finally:
+                self._selectReader.close()
+                self._selectReader = None
+            return
         while self.alive:
             if self.serial_port.in_waiting:
                 #with self.serial_io_lock:
@@ -114,19 +90,18 @@ class SimpleSerialComm:
 
     def _process_data(self):
         """Process data in a separate thread."""
-        accumulatedRemainder = ""
+        framer = FrameParser()
         while self.alive:
             data = self.data_queue.get()
+            if data is None:
+                continue
             try:
-                #print(data.decode('utf-8'), end='', flush=True)
-                data = data.decode('utf-8')
-                data = data.replace('\t', '').replace('\n', '').replace('\r', '') # Remove whitespace characters - better formatting should do better?
-                dictionaries, remainder = self.extract_json_objects(accumulatedRemainder + data)
-                accumulatedRemainder += remainder
-                print(accumulatedRemainder)
-                print(dictionaries)
-                for dictionary in dictionaries:
-                    if "qid" in dictionary:
+                for frame in framer.feed(data):
+                    dictionary = decode_frame(frame)
+                    print(dictionary)
+                    if dictionary is None:
+                        print(f"Failed to decode JSON: {bytes(frame)}")
+                    elif "qid" in dictionary:
                         self.queueFinalizedQueryIDs.append(abs(dictionary["qid"]))
                     else:
                         print(f"Dictionary does not contain 'qid': {dictionary}")
@@ -139,11 +114,13 @@ class SimpleSerialComm:
     def write_data(self, data):
         """Send data to the serial port."""
         #with self.serial_io_lock:
-        self.serial_port.write(data.encode('utf-8'))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.serial_port.write(data)
         self.serial_port.flush() # Ensure data is sent immediately
             
     def send_message(self, data, nResponses=1, mTimeout=20, blocking=True):
-        try:cqid = json.loads(data)["qid"]
+        try:cqid = json_loads(data)["qid"]
         except: blocking = False
         print (f"Sending message: {cqid}, blocking: {blocking}, message length: {len(data)}")
         self.write_data(data)
@@ -0,0 +1,191 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class StdlibJsonBackend:
+    '''
+    JSON through the json module of the standard library, always available
+    '''
+    name = "json"
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        if not isinstance(data, str):
+            # json.loads does not take memoryviews of the receive buffer
+            data = str(data, 'utf-8')
+        return json.loads(data)
+
+
+class OrjsonBackend:
+    '''
+    JSON through orjson, serializes straight to bytes and parses bytes-like
+    objects (also memoryviews) without decoding them to str first
+
+    What orjson refuses to serialize but the json module takes (subclasses of
+    float such as numpy.float64, integers beyond 64 bits) is encoded by the
+    json module instead. Note that orjson writes NaN and infinity as null.
+    '''
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson backend needs the orjson package (pip install orjson)")
+
+    @staticmethod
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except (TypeError, OverflowError):
+            return StdlibJsonBackend.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+JSON_BACKENDS = {backend.name: backend for backend in (OrjsonBackend, StdlibJsonBackend)}
+
+
+def get_json_backend(name=None):
+    '''
+    Create the JSON backend registered under name ("orjson" or "json"),
+    None picks the fastest one that is installed
+    '''
+    if name is None:
+        for backend in JSON_BACKENDS.values():
+            try:
+                return backend()
+            except ImportError:
+                continue
+    try:
+        return JSON_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown JSON backend {name}, choose one of {', '.join(JSON_BACKENDS)}")
+
+
+_jsonBackend = get_json_backend()
+
+
+def set_json_backend(name=None):
+    '''
+    Switch the JSON backend used by json_dumps/json_loads and new JsonCodecs
+    '''
+    global _jsonBackend
+    _jsonBackend = get_json_backend(name)
+    return _jsonBackend
+
+
+def json_backend():
+    return _jsonBackend
+
+
+def json_dumps(obj):
+    '''
+    Serialize obj to UTF-8 encoded JSON bytes
+    '''
+    return _jsonBackend.dumps(obj)
+
+
+def json_loads(data):
+    '''
+    Parse JSON from str, bytes, bytearray or memoryview
+    '''
+    return _jsonBackend.loads(data)
+
+
+class JsonCodec:
+    '''
+    The default payload encoding, understood by every UC2 firmware
+    '''
+    name = "json"
+    isBinary = False
+
+    def __init__(self, backend=None):
+        self.backend = get_json_backend(backend) if backend is not None else _jsonBackend
+
+    def encode(self, obj):
+        return self.backend.dumps(obj)
+
+    def decode(self, payload):
+        return self.backend.loads(payload)
+
+
+class MsgPackCodec:
+    '''
+    MessagePack payloads, needs the msgpack package and binary framing
+    '''
+    name = "msgpack"
+    isBinary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("The msgpack codec needs the msgpack package (pip install msgpack)")
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class CborCodec:
+    '''
+    CBOR payloads, needs the cbor2 package and binary framing
+    '''
+    name = "cbor"
+    isBinary = True
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError("The cbor codec needs the cbor2 package (pip install cbor2)")
+
+    def encode(self, obj):
+        return cbor2.dumps(obj)
+
+    def decode(self, payload):
+        return cbor2.loads(payload)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, MsgPackCodec, CborCodec)}
+
+
+def get_codec(name):
+    '''
+    Create the codec registered under name ("json", "msgpack" or "cbor")
+    '''
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown payload codec {name}, choose one of {', '.join(CODECS)}")
+
+
+def available_codecs():
+    '''
+    Names of the codecs whose library is installed
+    '''
+    names = []
+    for name in CODECS:
+        try:
+            get_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+
+
+class PendingRequest:
+    '''
+    Waiter for the responses of a single query ID (QID)
+
+    The processing loop adds every frame carrying this QID; once nResponses
+    frames have arrived (or the device answered with -QID) the waiter is woken
+    up immediately instead of being polled. payload is the encoded command,
+    kept to replay it after the device reconnected; isWritten is set once it
+    was flushed to the port.
+    '''
+    def __init__(self, qid, nResponses=1, payload=None):
+        self.qid = qid
+        self.nResponses = nResponses
+        self.payload = payload
+        self.isWritten = False
+        self.responses = []
+        self.isWrongCommand = False
+        self.isCancelled = False
+        self._event = threading.Event()
+        self._doneCallbacks = []
+        self._callbackLock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def add_response(self, response):
+        self.responses.append(response)
+        if len(self.responses) >= self.nResponses:
+            self._notify()
+
+    def set_wrong_command(self):
+        self.isWrongCommand = True
+        self._notify()
+
+    def cancel(self):
+        self.isCancelled = True
+        self._notify()
+
+    def add_done_callback(self, callback):
+        '''
+        Call callback(request) once the request is done (or right away if it already is)
+        '''
+        with self._callbackLock:
+            if not self._event.is_set():
+                self._doneCallbacks.append(callback)
+                return
+        callback(self)
+
+    def _notify(self):
+        with self._callbackLock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._doneCallbacks = self._doneCallbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def wait(self, timeout=None):
+        '''
+        Block until the request is done, returns False on timeout
+        '''
+        return self._event.wait(timeout)
+
+
+class AsyncPendingRequest(PendingRequest):
+    '''
+    PendingRequest for the asyncio clients, backed by a future of the event loop
+
+    Notifications from other threads are marshalled into the owning loop.
+    '''
+    def __init__(self, qid, nResponses=1, loop=None, payload=None):
+        super().__init__(qid, nResponses, payload)
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._future = loop.create_future()
+
+    @property
+    def done(self):
+        return self._future.done()
+
+    def _notify(self):
+        try:
+            runningLoop = asyncio.get_running_loop()
+        except RuntimeError:
+            runningLoop = None
+        if runningLoop is self._loop:
+            self._set_result()
+        else:
+            # e.g. breakCurrentCommunication called from a foreign thread
+            self._loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self._future.done():
+            self._future.set_result(True)
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class PendingRequestTable:
+    '''
+    Table of all outstanding QIDs
+
+    sendMessage registers its QID *before* writing the command so that a fast
+    response cannot slip through; the processing loop resolves the matching
+    entry as soon as the frame is parsed.
+    '''
+    def __init__(self, requestFactory=PendingRequest):
+        self._requestFactory = requestFactory
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, qid):
+        return qid in self._pending
+
+    def register(self, qid, nResponses=1, **kwargs):
+        '''
+        Add a waiter for qid
+
+        raises ValueError if a request with this QID is still waiting, its
+        responses could not be told apart
+        '''
+        request = self._requestFactory(qid, nResponses, **kwargs)
+        with self._lock:
+            previous = self._pending.get(qid)
+            if previous is not None and not previous.done:
+                raise ValueError(f"Query ID {qid} is already in flight")
+            self._pending[qid] = request
+        return request
+
+    def discard(self, request):
+        '''
+        Remove a finished or timed out request from the table
+        '''
+        with self._lock:
+            if self._pending.get(request.qid) is request:
+                del self._pending[request.qid]
+
+    def resolve(self, qid, response):
+        '''
+        Hand a received frame to the waiter of its QID
+
+        A negative QID is the device's way to tell us that the command -QID was
+        not understood.
+        returns True if a waiter was found
+        '''
+        with self._lock:
+            if qid < 0:
+                request = self._pending.get(-qid)
+            else:
+                request = self._pending.get(qid)
+        if request is None:
+            return False
+        if qid < 0:
+            request.set_wrong_command()
+        else:
+            request.add_response(response)
+        return True
+
+    def pending(self):
+        '''
+        Snapshot of the outstanding requests in the order of their QIDs
+        '''
+        with self._lock:
+            return sorted(self._pending.values(), key=lambda request: request.qid)
+
+    def cancel_all(self):
+        '''
+        Wake up every waiter, e.g. when the device rebooted
+        '''
+        with self._lock:
+            requests = list(self._pending.values())
+        for request in requests:
+            request.cancel()
+        return len(requests)
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseStore:
+    '''
+    Bounded store of the responses received per query ID (QID)
+
+    Behaves like the former responses dictionary (qid -> list of responses)
+    but never grows beyond capacity entries: the least recently used QID is
+    evicted first and entries that have not been touched for ttl seconds are
+    dropped. Callers release an entry with pop() once they consumed it.
+    '''
+    def __init__(self, capacity=1000, ttl=300.):
+        self.capacity = capacity    # maximum number of QIDs kept
+        self.ttl = ttl              # seconds an untouched entry survives, None to disable
+        self.nHits = 0
+        self.nMisses = 0
+        self.nEvictions = 0
+        self._entries = OrderedDict()   # qid -> [timestamp, responses], oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, qid):
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return qid in self._entries
+
+    def __getitem__(self, qid):
+        responses = self.get(qid)
+        if responses is None:
+            raise KeyError(qid)
+        return responses
+
+    def add(self, qid, response):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(qid)
+            if entry is None:
+                self._entries[qid] = [now, [response]]
+            else:
+                entry[0] = now
+                entry[1].append(response)
+                self._entries.move_to_end(qid)
+            self._evict_expired(now)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.nEvictions += 1
+
+    def get(self, qid, default=None):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(qid)
+            if entry is None:
+                self.nMisses += 1
+                return default
+            self.nHits += 1
+            entry[0] = now
+            self._entries.move_to_end(qid)
+            return entry[1]
+
+    def pop(self, qid, default=None):
+        '''
+        Remove and return the responses of a QID, e.g. once the caller has them
+        '''
+        with self._lock:
+            entry = self._entries.pop(qid, None)
+            if entry is None:
+                self.nMisses += 1
+                return default
+            self.nHits += 1
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self, now):
+        if self.ttl is None:
+            return
+        while self._entries:
+            qid, entry = next(iter(self._entries.items()))
+            if now - entry[0] < self.ttl:
+                break
+            del self._entries[qid]
+            self.nEvictions += 1
+
+    def stats(self):
+        return {"size": len(self._entries), "capacity": self.capacity,
+                "hits": self.nHits, "misses": self.nMisses,
+                "evictions": self.nEvictions}
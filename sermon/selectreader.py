@@ -0,0 +1,104 @@
+import os
+import select
+
+
+class SelectReader:
+    '''
+    Blocking reader on the file descriptor of a serial port
+
+    Instead of polling in_waiting the reading thread sleeps in poll/select
+    until the device sends something. A wakeup pipe is watched alongside the
+    port so that stop_reading can release the thread immediately.
+    Only available on POSIX systems where the port exposes fileno().
+    '''
+    def __init__(self, serial_device, chunkSize=65536):
+        self.fd = serial_device.fileno()
+        self.chunkSize = chunkSize          # maximum number of bytes per read
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        os.set_blocking(self._wakeupRead, False)
+        os.set_blocking(self._wakeupWrite, False)
+        if hasattr(select, "poll"):
+            self._poller = select.poll()
+            self._poller.register(self.fd, select.POLLIN | select.POLLPRI)
+            self._poller.register(self._wakeupRead, select.POLLIN)
+        else:
+            self._poller = None
+
+    @staticmethod
+    def is_supported(serial_device):
+        if os.name != "posix" or not hasattr(serial_device, "fileno"):
+            return False
+        try:
+            return serial_device.fileno() is not None
+        except Exception:
+            return False
+
+    def _wait(self):
+        if self._poller is not None:
+            return [fd for fd, _ in self._poller.poll()]
+        ready, _, _ = select.select([self.fd, self._wakeupRead], [], [])
+        return ready
+
+    def read(self):
+        '''
+        Block until data is available and return everything that is there
+        (up to chunkSize bytes)
+
+        returns None if the reader was woken up by wakeup()
+        raises OSError if the device went away
+        '''
+        while True:
+            ready = self._wait()
+            if self._wakeupRead in ready:
+                try:
+                    os.read(self._wakeupRead, 512)
+                except BlockingIOError:
+                    pass
+                return None
+            if self.fd in ready:
+                try:
+                    data = os.read(self.fd, self.chunkSize)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    # readable but empty means the port was closed/unplugged
+                    raise OSError("device reports readiness to read but returned no data")
+                return data
+
+    def readinto(self, buffer):
+        '''
+        Like read() but the bytes are written straight into buffer (a
+        bytearray or writable memoryview), no bytes object is allocated
+
+        returns the number of bytes read or None if woken up by wakeup()
+        raises OSError if the device went away
+        '''
+        while True:
+            ready = self._wait()
+            if self._wakeupRead in ready:
+                try:
+                    os.read(self._wakeupRead, 512)
+                except BlockingIOError:
+                    pass
+                return None
+            if self.fd in ready:
+                try:
+                    nBytes = os.readv(self.fd, [buffer])
+                except BlockingIOError:
+                    continue
+                if not nBytes:
+                    raise OSError("device reports readiness to read but returned no data")
+                return nBytes
+
+    def wakeup(self):
+        try:
+            os.write(self._wakeupWrite, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        for fd in (self._wakeupRead, self._wakeupWrite):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
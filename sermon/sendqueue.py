@@ -0,0 +1,208 @@
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+COALESCED_TASKS = ("/motor_act", "/ledarr_act", "/laser_act")
+
+
+def command_key(message):
+    '''
+    Coalescing key for the commands that set an absolute state of the device
+
+    /motor_act commands (absolute moves or speed settings) are keyed by the
+    stepper ids they move together with the mode of every stepper, so an
+    absolute move never replaces a speed setting; /ledarr_act is keyed by the
+    LED ids it sets (or the whole array) and /laser_act by the laser id;
+    other tasks are never coalesced.
+    returns a hashable key or None
+    '''
+    task = message.get("task")
+    if task not in COALESCED_TASKS:
+        return None
+    if task == "/motor_act":
+        steppers = message.get("motor", {}).get("steppers", ())
+        if not all(stepper.get("isabs") or stepper.get("isforever") for stepper in steppers):
+            # relative moves add up, none of them may be dropped
+            return None
+        return task, tuple((stepper.get("stepperid"), "forever" if stepper.get("isforever") else "abs")
+                           for stepper in steppers)
+    if task == "/ledarr_act":
+        led = message.get("led", {})
+        return task, led.get("LEDArrMode"), tuple(pixel.get("id") for pixel in led.get("led_array", ()))
+    return task, message.get("LASERid")
+
+
+class SendQueue:
+    '''
+    Bounded queue of commands drained by a dedicated writer thread
+
+    The writer takes everything that is queued (up to maxBatch commands) and
+    hands it to write_batch(payloads) at once, so back-to-back commands cost a
+    single write and flush. put() returns a Future that is resolved once the
+    batch holding the command was flushed; it blocks while maxsize commands
+    are waiting.
+
+    Last write wins per key: a command put with the key of a command that is
+    still waiting replaces it in place (it keeps the position of the older
+    one, so a stream of updates cannot starve the other commands); the future
+    and request of the superseded command are cancelled. Commands without a
+    key are written in order and never replaced.
+
+    A command whose request is already done (its caller timed out or gave up)
+    is not written any more, its future is cancelled. wait_writable(stopEvent)
+    is called before a batch is checked, e.g. to wait for a device that is
+    reconnecting; it returns False if the device did not become writable (the
+    batch fails with a ConnectionError) and has to return once stopEvent is set.
+    '''
+    def __init__(self, write_batch, maxsize=64, maxBatch=32, logger=None, wait_writable=None):
+        self._write_batch = write_batch
+        self._wait_writable = wait_writable
+        self.maxsize = maxsize
+        self.maxBatch = maxBatch
+        self._logger = logger
+        self._pending = OrderedDict()   # key -> (payload, future, request)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._isRunning = False
+        self._stopEvent = threading.Event()     # set by stop(), interrupts wait_writable
+        self.nQueued = 0
+        self.nSent = 0
+        self.nBatches = 0
+        self.nCoalesced = 0
+        self.nSkipped = 0
+        self.nErrors = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        with self._condition:
+            if self._isRunning:
+                return
+            self._isRunning = True
+            self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name="serial-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Write what is still queued and stop the writer thread; commands that
+        cannot be written because the device is not writable are dropped and
+        their requests cancelled
+        '''
+        with self._condition:
+            self._isRunning = False
+            self._stopEvent.set()
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            # a second writer must never run on the same queue, wait until this one is gone
+            self._thread.join()
+        self._thread = None
+        with self._condition:
+            dropped = list(self._pending.values())
+            self._pending.clear()
+            self._condition.notify_all()
+        self._drop(dropped)
+
+    def put(self, payload, key=None, request=None, timeout=None):
+        '''
+        Queue a payload for writing
+
+        returns a concurrent.futures.Future resolved when it was flushed
+        raises queue.Full if no slot got free within timeout
+        '''
+        future = Future()
+        superseded = None
+        with self._condition:
+            if not self._isRunning:
+                raise RuntimeError("The writer thread is not running")
+            if key is None:
+                key = object()
+            previous = self._pending.get(key)
+            if previous is None:
+                if not self._condition.wait_for(lambda: len(self._pending) < self.maxsize or not self._isRunning,
+                                                timeout):
+                    raise queue.Full(f"No slot in the send queue within {timeout} seconds")
+                if not self._isRunning:
+                    raise RuntimeError("The writer thread stopped")
+                # the command with this key may have been written while we waited
+                previous = self._pending.get(key)
+            if previous is not None:
+                self.nCoalesced += 1
+                superseded = previous
+            self._pending[key] = (payload, future, request)  # an existing key keeps its position
+            self.nQueued += 1
+            self._condition.notify_all()
+        if superseded is not None:
+            superseded[1].cancel()
+            if superseded[2] is not None:
+                superseded[2].cancel()
+        return future
+
+    def _take_batch(self):
+        with self._condition:
+            while self._isRunning and not self._pending:
+                self._condition.wait()
+            batch = []
+            while self._pending and len(batch) < self.maxBatch:
+                batch.append(self._pending.popitem(last=False)[1])
+            self._condition.notify_all()    # wake up callers waiting for a free slot
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch and self._wait_writable is not None and not self._wait_writable(self._stopEvent):
+                if self._isRunning:
+                    self._fail(batch, ConnectionError("The device did not become writable"))
+                else:
+                    self._drop(batch)
+                continue
+            batch = [item for item in batch if self._is_wanted(item)]
+            if not batch:
+                if not self._isRunning:
+                    return
+                continue
+            try:
+                self._write_batch([payload for payload, _, _ in batch])
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+            self.nSent += len(batch)
+            self.nBatches += 1
+            for _, future, _ in batch:
+                future.set_result(True)
+
+    def _fail(self, batch, e):
+        self.nErrors += 1
+        if self._logger is not None:
+            self._logger.error("[SendQueue]: "+str(e))
+        for _, future, request in batch:
+            # the futures of a batch that failed to write are running already
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(e)
+            if request is not None:
+                request.cancel()
+
+    @staticmethod
+    def _drop(batch):
+        for _, future, request in batch:
+            future.cancel()
+            if request is not None:
+                request.cancel()
+
+    def _is_wanted(self, item):
+        _, future, request = item
+        if request is not None and request.done:
+            # nobody waits for the response any more, e.g. a relative move must not run late
+            future.cancel()
+            self.nSkipped += 1
+            return False
+        return future.set_running_or_notify_cancel()
+
+    def stats(self):
+        return {"pending": len(self._pending), "queued": self.nQueued,
+                "sent": self.nSent, "batches": self.nBatches,
+                "coalesced": self.nCoalesced, "skipped": self.nSkipped,
+                "errors": self.nErrors}
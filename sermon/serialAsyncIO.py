@@ -1,27 +1,27 @@
 import asyncio
 import serial
-import json
-from collections import deque
 from serial.tools import list_ports
 import logging
 import time
+from framing import FrameParser, decode_frame
+from payloadcodec import json_dumps, json_loads
+from pendingrequests import PendingRequestTable, AsyncPendingRequest
+from serialtransport import SerialTransport, FramerProtocol
+from subscription import AsyncSubscription, SubscriptionHub, DROP_OLDEST
+from metrics import MetricsRegistry
 
 T_SERIAL_WARMUP = .5
 
-class RingBuffer(deque):
-    def __init__(self, size_max):
-        super().__init__(maxlen=size_max)
-
-    def append(self, datum):
-        super().append(datum)
-        return self
-
-    def get(self):
-        return list(self)
-
 class Serial:
     def __init__(self, port, baudrate=115200, timeout=5,
-                 identity="UC2_Feather", parent=None, DEBUG=False):
+                 identity="UC2_Feather", parent=None, DEBUG=False, readMode="select", metrics=False):
+        '''
+        readMode is either "select" (the port is watched by the event loop through a
+        SerialTransport, POSIX only) or "poll" (check in_waiting every 50 ms);
+        "select" falls back to "poll" if the device has no file descriptor (e.g. MockSerial)
+        metrics records round trip times per task, byte and frame rates, parse errors
+        and timeouts (see getMetrics); True or a metrics.MetricsRegistry to share
+        '''
         self.baudrate = baudrate
         self.timeout = timeout
         self.identity = identity
@@ -32,12 +32,18 @@ class Serial:
         self.is_connected = False
         self.resetLastCommand = False
         self.data_queue = asyncio.Queue()
-        self.maxQentries = 100
-        self.queueFinalizedQueryIDs = RingBuffer(self.maxQentries)
         self.identifier_counter = 0
         self.responses = {}
+        self.pendingRequests = PendingRequestTable(AsyncPendingRequest)
+        self.framer = FrameParser()
         self.isReadingLoopRunning = False
         self.isWritingLoopRunning = False
+        self.readMode = readMode
+        self._transport = None      # SerialTransport in "select" mode
+        self._tasks = set()         # background tasks, cancelled on close
+        self._isReadingPaused = False
+        self.subscriptions = SubscriptionHub(self._set_reading_paused)
+        self.metrics = MetricsRegistry() if metrics is True else (metrics or None)
 
         self.callBackList = []
 
@@ -58,6 +64,12 @@ class Serial:
     def close(self):
         self.stop_reading()
         self.closeDevice()
+
+    def _create_task(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
         
     def closeDevice(self):
         if self.serial_port_name is not None:
@@ -142,7 +154,7 @@ class Serial:
         path = "/state_get"
         payload = {"task": path}
         if self.DEBUG: self._logger.debug("[checkFirmware]: " + str(payload))
-        ser.write(json.dumps(payload).encode('utf-8'))
+        ser.write(json_dumps(payload))
         ser.write(b'\n')
         ser.flush()
             
@@ -161,143 +173,198 @@ class Serial:
 
     def breakCurrentCommunication(self):
         self.resetLastCommand = True
+        self.pendingRequests.cancel_all()
         
     async def start_reading(self):
         if self.is_connected:
+            if self.readMode == "select" and SerialTransport.is_supported(self.serial_device):
+                if self._transport is None:
+                    protocol = FramerProtocol(self.framer, self._process_received, self._connection_lost)
+                    self._transport = SerialTransport(asyncio.get_running_loop(), protocol, self.serial_device)
+                return
             if not self.isReadingLoopRunning:
-                asyncio.create_task(self._read_loop())
+                self._create_task(self._read_loop())
             if not self.isWritingLoopRunning:
-                asyncio.create_task(self._process_data())
+                self._create_task(self._process_data())
+
+    def _connection_lost(self, exc):
+        if exc is not None:
+            self._logger.error("[ReadLoop]: " + str(exc))
+            self.is_connected = False
+            self.pendingRequests.cancel_all()
 
     def stop_reading(self):
         self.is_connected = False
+        self.subscriptions.close_all()
+        if self._transport is not None:
+            self._transport.abort()
+            self._transport = None
+        for task in list(self._tasks):
+            task.cancel()
+        self.isReadingLoopRunning = False
+        self.isWritingLoopRunning = False
         if self.serial_device.is_open:
             self.serial_device.close()
 
-    def extract_json_objects(self, s):
-        parts = s.split('++')
-        dictionaries = []
-        last_position = 0
-        #self._logger.debug(f"Extracting JSON objects from: {s}")
-        remainder = ""
-        for part in parts:
-            json_str = part.split('--')[0].strip()
-            if json_str:
-                try:
-                    last_position += len(part) + 2
-                    json_dict = json.loads(json_str)
-                    dictionaries.append(json_dict)
-                except json.JSONDecodeError as e:
-                    try:
-                        import re
-                        match = re.search(r'"qid":(\d+)', json_str)
-                        if match:
-                            qid = int(match.group(1))
-                            json_dict = {"qid": qid}
-                            dictionaries.append(json.loads(json.dumps(json_dict)))
-                    except Exception as e:
-                        self._logger.debug(f"Failed to decode JSON: {json_str}. Error: {e}")
-                        last_position -= len(part) + 2
-                        remainder += s[last_position:]
-    
-        return dictionaries, remainder
-
     async def _read_loop(self):
         self.isReadingLoopRunning = True
         while self.is_connected:
-            if self.serial_device.in_waiting:
+            if not self._isReadingPaused and self.serial_device.in_waiting:
                 data = await asyncio.get_event_loop().run_in_executor(None, self.serial_device.read, self.serial_device.in_waiting)
                 await self.data_queue.put(data)
             await asyncio.sleep(0.05)
         self.isReadingLoopRunning = False
         
     async def _process_data(self):
-        accumulatedRemainder = ""
         self.isWritingLoopRunning = True
         while self.is_connected:
             data = await self.data_queue.get()
-            try:
-                data = data.decode('utf-8')
-                data = data.replace('\t', '').replace('\n', '').replace('\r', '')
-                
-                if "reboot" in data:
-                    self._logger.warning("Device rebooted")
-                    self.resetLastCommand = True
+            self.framer.append(data)
+            self._process_received(len(data))
+        self.isWritingLoopRunning = False
+
+    def _process_received(self, nBytes):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.received(nBytes)
+        try:
+            if self.framer.recent_contains(b"reboot", nBytes):
+                self._logger.warning("Device rebooted")
+                self.resetLastCommand = True
+                self.framer.reset()
+                # the commands in flight will not be answered anymore, do not let their callers wait
+                self.pendingRequests.cancel_all()
+                return
+            
+            for frame in self.framer.parse():
+                dictionary = decode_frame(frame)
+                if dictionary is None:
+                    self._logger.debug(f"Failed to decode JSON: {bytes(frame)}")
+                    if metrics is not None:
+                        metrics.parse_error()
                     continue
-                
-                dictionaries, remainder = self.extract_json_objects(accumulatedRemainder + data)
-                accumulatedRemainder += remainder
-                self._logger.debug(accumulatedRemainder)
-                for dictionary in dictionaries:
+                if metrics is not None:
+                    metrics.frame_received()
                     if "qid" in dictionary:
-                        self.queueFinalizedQueryIDs.append(dictionary["qid"])
-                        if dictionary["qid"] in self.responses:
-                            self.responses[dictionary["qid"]].append(dictionary)
-                        else:
-                            self.responses[dictionary["qid"]] = [dictionary]
-                            
-                        if self.DEBUG: 
-                            self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
-                        
-                        if len(self.callBackList) > 0:
-                            for callback in self.callBackList:
-                                try:
-                                    if callback["pattern"] in dictionary:
-                                        callback["callbackfct"](dictionary)
-                                except Exception as e:
-                                    self._logger.error("[ProcessCommands]: " + str(e))
+                        metrics.response_received(dictionary["qid"], self)
+                if "qid" in dictionary:
+                    if dictionary["qid"] in self.responses:
+                        self.responses[dictionary["qid"]].append(dictionary)
                     else:
-                        self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+                        self.responses[dictionary["qid"]] = [dictionary]
+                        
+                    if self.DEBUG: 
+                        self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
+                    
+                    self.pendingRequests.resolve(dictionary["qid"], dictionary)
+                    
+                    if len(self.callBackList) > 0:
+                        for callback in self.callBackList:
+                            try:
+                                if callback["pattern"] in dictionary:
+                                    callback["callbackfct"](dictionary)
+                            except Exception as e:
+                                self._logger.error("[ProcessCommands]: " + str(e))
+                else:
+                    self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+
+                self.subscriptions.publish(dictionary)
+
+        except Exception as e:
+            self._logger.debug(f"Failed to decode data: {e}")
+            
+    def getMetrics(self):
+        '''
+        Snapshot of the link statistics as a dictionary (round trip histograms per
+        task in ms, byte/frame rates, parse errors, timeouts, queue depths), None if disabled
+        '''
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(data_queue=self.data_queue.qsize(),
+                                     pending_requests=len(self.pendingRequests),
+                                     framing=self.framer.stats())
 
-            except Exception as e:
-                self._logger.debug(f"Failed to decode data: {data}. Error: {e}")
-            await asyncio.sleep(0.05)
-        self.isWritingLoopRunning = False
-                
     def register_callback(self, callback, pattern):
         self.callBackList.append({"callbackfct": callback, "pattern": pattern})
 
-    async def write_data(self, data: str):
+    def subscribe(self, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        '''
+        async for frame in serial.subscribe(pattern): the received frames that have
+        pattern as a top-level key (all frames for None)
+        
+        Every subscriber gets its own queue of up to maxsize frames, overflow is
+        "drop-oldest", "drop-newest" or "block" (pauses reading from the port until
+        the subscriber catches up). Iterating ends when the port is closed.
+        '''
+        subscription = AsyncSubscription(self.subscriptions, asyncio.get_running_loop(), pattern, maxsize, overflow)
+        return self.subscriptions.add(subscription)
+
+    def _set_reading_paused(self, isPaused):
+        '''
+        Back pressure of "block" subscriptions: hold back reading from the port
+        '''
+        self._isReadingPaused = isPaused
+        if self._transport is not None:
+            if isPaused:
+                self._transport.pause_reading()
+            else:
+                self._transport.resume_reading()
+
+    async def write_data(self, data):
         if self.DEBUG: self._logger.debug(f"Writing data: {data}")
-        await asyncio.get_event_loop().run_in_executor(None, self.serial_device.write, data.encode('utf-8'))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+        if self._transport is not None:
+            # non-blocking write on the event loop, wait until the port took all of it
+            self._transport.write(data)
+            await self._transport.drain()
+            return
+        await asyncio.get_event_loop().run_in_executor(None, self.serial_device.write, data)
         await asyncio.get_event_loop().run_in_executor(None, self.serial_device.flush)
 
     async def sendMessage(self, data: str, nResponses: int = 1, mTimeout: float = 20.0, blocking: bool = True):
         if type(data) == str:
-            data = json.loads(data)
+            data = json_loads(data)
         try:
             cqid = data["qid"]
             self.identifier_counter = cqid
         except:
             cqid = self._generate_identifier()
+            data = dict(data, qid=cqid)    # the device echoes the qid, the caller's dictionary is left alone
         if self.DEBUG: self._logger.debug(f"Sending message: {cqid}, blocking: {blocking}, message length: {len(data)}")
-        await self.write_data(json.dumps(data))
-        cTime = time.time()
-        
+
         if nResponses == 0 or mTimeout <= 0 or not blocking:
-            blocking = False
+            await self.write_data(json_dumps(data))
             await asyncio.sleep(0.1)
             return cqid
-        
-        while blocking:
-            try:
-                if time.time() - cTime > mTimeout:
-                    self._logger.debug(f"Timeout of {mTimeout} seconds reached for QID: {cqid}.")
-                    break
-                qids = self.queueFinalizedQueryIDs.get()
-                if cqid in qids and qids.count(cqid) >= nResponses:
-                    await asyncio.sleep(0.15) # let the serial settle for a bit
-                    return self.responses[cqid]
-                if -cqid in qids:
-                    self._logger.debug("You have sent the wrong command!")
-                    return "Wrong Command"
-            except queue.Empty:
-                pass
-            await asyncio.sleep(0.05)
+
+        # register the QID before writing so that a fast response cannot be missed
+        request = self.pendingRequests.register(cqid, nResponses, loop=asyncio.get_running_loop())
+        if self.metrics is not None:
+            self.metrics.command_sent(cqid, data.get("task"), self)
+        try:
+            await self.write_data(json_dumps(data))
+            if not await request.wait(mTimeout):
+                self._logger.debug(f"Timeout of {mTimeout} seconds reached for QID: {cqid}.")
+                if self.metrics is not None:
+                    self.metrics.timed_out(cqid, self)
+                return None
+        finally:
+            self.pendingRequests.discard(request)
+            if self.metrics is not None:
+                self.metrics.forget(cqid, self)
+        if request.isWrongCommand:
+            self._logger.debug("You have sent the wrong command!")
+            return "Wrong Command"
+        if request.isCancelled:
+            self._logger.debug(f"Waiting for query ID {cqid} was cancelled.")
+            return None
+        return request.responses
 
     async def get_json(self, path, timeout=1):
         message = {"task": path}
-        message = json.dumps(message)
         return await self.sendMessage(message, nResponses=0, mTimeout=timeout)
 
     async def post_json(self, path, payload, getReturn=True, nResponses=1, timeout=100):
@@ -1,31 +1,34 @@
 import asyncio
 import inspect
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from collections import deque
 from serial.tools import list_ports
 import logging
 import time
+from framing import FrameParser, decode_frame
+from payloadcodec import json_dumps, json_loads
+from pendingrequests import PendingRequestTable, AsyncPendingRequest
+from serialtransport import SerialTransport, FramerProtocol
+from subscription import AsyncSubscription, SubscriptionHub, DROP_OLDEST
+from metrics import MetricsRegistry
+from ioruntime import acquire_runtime
 from asynciohelper import *
 import serial
-import json
 from asynciohelper import convert_async_to_sync
 
 T_SERIAL_WARMUP = .5
-class RingBuffer(deque):
-    def __init__(self, size_max):
-        super().__init__(maxlen=size_max)
 
-    def append(self, datum):
-        super().append(datum)
-        return self
-
-    def get(self):
-        return list(self)
-    
 
 class Serial:
-    def __init__(self, port, baudrate=115200, timeout=5, identity="UC2_Feather", parent=None, DEBUG=False):
+    def __init__(self, port, baudrate=115200, timeout=5, identity="UC2_Feather", parent=None, DEBUG=False,
+                 readMode="select", metrics=False):
+        '''
+        All instances share one event loop thread and one bounded executor (see
+        ioruntime), the reference on it is given back by close().
+        readMode is either "select" (the port is watched by the shared loop through a
+        SerialTransport, POSIX only) or "poll" (check in_waiting every 50 ms)
+        metrics records round trip times per task, byte and frame rates, parse errors
+        and timeouts (see getMetrics); True or a metrics.MetricsRegistry to share
+        '''
         self.baudrate = baudrate
         self.timeout = timeout
         self.identity = identity
@@ -35,12 +38,19 @@ class Serial:
         self.serial_device = None
         self.is_connected = False
         self.resetLastCommand = False
-        self.maxQentries = 100
-        self.queueFinalizedQueryIDs = RingBuffer(self.maxQentries)
         self.identifier_counter = 0
         self.responses = {}
+        self.pendingRequests = PendingRequestTable(AsyncPendingRequest)
+        self.framer = FrameParser()
         self.isReadingLoopRunning = False
         self.isWritingLoopRunning = False
+        self.readMode = readMode
+        self.data_queue = None      # created on the loop by start_reading in "poll" mode
+        self._transport = None      # SerialTransport in "select" mode
+        self._tasks = set()         # background tasks, cancelled on close
+        self._isReadingPaused = False
+        self.subscriptions = SubscriptionHub(self._set_reading_paused)
+        self.metrics = MetricsRegistry() if metrics is True else (metrics or None)
 
         self.callBackList = []
 
@@ -51,32 +61,32 @@ class Serial:
         else:
             self._logger = self._parent.logger
 
-        # Ensure the event loop is running
+        # Ensure the shared event loop is running
+        self.runtime = None
         self.loop = None
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.executor = None
         self._ensure_event_loop()
-        
-        # Asyncio queue should be created after the event loop is ensured
-        self.data_queue = asyncio.Queue(loop=self.loop)
-
-        # Convert async methods to sync
-        self.open_sync = convert_async_to_sync(self.open, self.loop, self.executor)
-        self.send_message_sync = convert_async_to_sync(self.sendMessage, self.loop, self.executor)
 
     def _ensure_event_loop(self):
-        if not self.loop or not self.loop.is_running():
-            self.loop = asyncio.new_event_loop()
-            self.loop_thread = threading.Thread(target=self._run_event_loop, daemon=True)
-            self.loop_thread.start()
+        if self.runtime is None or not self.runtime.is_running:
+            self.runtime = acquire_runtime()
+            self.loop = self.runtime.loop
+            self.executor = self.runtime.executor
+
+            # Convert async methods to sync
+            self.open_sync = convert_async_to_sync(self.open, self.loop, self.executor)
+            self.send_message_sync = convert_async_to_sync(self.sendMessage, self.loop, self.executor)
 
-    def _run_event_loop(self):
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_forever()
+    def _create_task(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
 
     async def open(self, port=None, baudrate=None):
         if baudrate is None:
             baudrate = self.baudrate
-        self.serial_device = await asyncio.get_event_loop().run_in_executor(None, self.openDevice, port, baudrate)
+        self.serial_device = await asyncio.get_running_loop().run_in_executor(self.executor, self.openDevice, port, baudrate)
         self.is_connected = True
         await self.start_reading()
 
@@ -93,8 +103,18 @@ class Serial:
         future.result()  # Wait for the coroutine to start
 
     def close(self):
-        self.stop_reading()
+        if self.runtime is not None and self.runtime.is_running and not self.runtime.in_loop_thread():
+            # the transport and the tasks belong to the shared loop
+            self.runtime.run(self._stop_reading_async())
+        else:
+            self.stop_reading()
         self.closeDevice()
+        if self.runtime is not None:
+            self.runtime.release()
+            self.runtime = None
+
+    async def _stop_reading_async(self):
+        self.stop_reading()
         
     def closeDevice(self):
         if self.serial_port_name is not None:
@@ -179,7 +199,7 @@ class Serial:
         path = "/state_get"
         payload = {"task": path}
         if self.DEBUG: self._logger.debug("[checkFirmware]: " + str(payload))
-        ser.write(json.dumps(payload).encode('utf-8'))
+        ser.write(json_dumps(payload))
         ser.write(b'\n')
         ser.flush()
             
@@ -198,143 +218,206 @@ class Serial:
 
     def breakCurrentCommunication(self):
         self.resetLastCommand = True
+        self.pendingRequests.cancel_all()
 
     async def start_reading(self):
         if self.is_connected:
+            if self.readMode == "select" and SerialTransport.is_supported(self.serial_device):
+                if self._transport is None:
+                    protocol = FramerProtocol(self.framer, self._process_received, self._connection_lost)
+                    self._transport = SerialTransport(self.loop, protocol, self.serial_device)
+                return
+            if self.data_queue is None:
+                self.data_queue = asyncio.Queue()
             if not self.isReadingLoopRunning:
-                asyncio.run_coroutine_threadsafe(self._read_loop(), self.loop)
+                self._create_task(self._read_loop())
             if not self.isWritingLoopRunning:
-                asyncio.run_coroutine_threadsafe(self._process_data(), self.loop)
+                self._create_task(self._process_data())
+
+    def _connection_lost(self, exc):
+        if exc is not None:
+            self._logger.error("[ReadLoop]: " + str(exc))
+            self.is_connected = False
+            self.pendingRequests.cancel_all()
 
     def stop_reading(self):
         self.is_connected = False
-        if self.serial_device.is_open:
+        self.subscriptions.close_all()
+        if self._transport is not None:
+            self._transport.abort()
+            self._transport = None
+        for task in list(self._tasks):
+            task.cancel()
+        self.isReadingLoopRunning = False
+        self.isWritingLoopRunning = False
+        if self.serial_device is not None and self.serial_device.is_open:
             self.serial_device.close()
 
-    def extract_json_objects(self, s):
-        parts = s.split('++')
-        dictionaries = []
-        last_position = 0
-        remainder = ""
-        for part in parts:
-            json_str = part.split('--')[0].strip()
-            if json_str:
-                try:
-                    last_position += len(part) + 2
-                    json_dict = json.loads(json_str)
-                    dictionaries.append(json_dict)
-                except json.JSONDecodeError as e:
-                    try:
-                        import re
-                        match = re.search(r'"qid":(\d+)', json_str)
-                        if match:
-                            qid = int(match.group(1))
-                            json_dict = {"qid": qid}
-                            dictionaries.append(json.loads(json.dumps(json_dict)))
-                    except Exception as e:
-                        self._logger.debug(f"Failed to decode JSON: {json_str}. Error: {e}")
-                        last_position -= len(part) + 2
-                        remainder += s[last_position:]
-    
-        return dictionaries, remainder
-
     async def _read_loop(self):
         self.isReadingLoopRunning = True
         while self.is_connected:
-            if self.serial_device.in_waiting > 0:
-                data = await asyncio.get_event_loop().run_in_executor(None, self.serial_device.read, self.serial_device.in_waiting)
+            if not self._isReadingPaused and self.serial_device.in_waiting > 0:
+                data = await asyncio.get_running_loop().run_in_executor(self.executor, self.serial_device.read, self.serial_device.in_waiting)
                 if data:
                     await self.data_queue.put(data)
             await asyncio.sleep(0.05)
         self.isReadingLoopRunning = False
 
     async def _process_data(self):
-        accumulatedRemainder = ""
         self.isWritingLoopRunning = True
         while self.is_connected:
             data = await self.data_queue.get()
-            try:
-                data = data.decode('utf-8')
-                data = data.replace('\t', '').replace('\n', '').replace('\r', '')
-                
-                if "reboot" in data:
-                    self._logger.warning("Device rebooted")
-                    self.resetLastCommand = True
+            self.framer.append(data)
+            self._process_received(len(data))
+        self.isWritingLoopRunning = False
+
+    def _process_received(self, nBytes):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.received(nBytes)
+        try:
+            if self.framer.recent_contains(b"reboot", nBytes):
+                self._logger.warning("Device rebooted")
+                self.resetLastCommand = True
+                self.framer.reset()
+                # the commands in flight will not be answered anymore, do not let their callers wait
+                self.pendingRequests.cancel_all()
+                return
+            
+            for frame in self.framer.parse():
+                dictionary = decode_frame(frame)
+                if dictionary is None:
+                    self._logger.debug(f"Failed to decode JSON: {bytes(frame)}")
+                    if metrics is not None:
+                        metrics.parse_error()
                     continue
-                
-                dictionaries, remainder = self.extract_json_objects(accumulatedRemainder + data)
-                accumulatedRemainder += remainder
-                self._logger.debug(accumulatedRemainder)
-                for dictionary in dictionaries:
+                if metrics is not None:
+                    metrics.frame_received()
                     if "qid" in dictionary:
-                        self.queueFinalizedQueryIDs.append(dictionary["qid"])
-                        if dictionary["qid"] in self.responses:
-                            self.responses[dictionary["qid"]].append(dictionary)
-                        else:
-                            self.responses[dictionary["qid"]] = [dictionary]
-                            
-                        if self.DEBUG: 
-                            self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
-                        
-                        if len(self.callBackList) > 0:
-                            for callback in self.callBackList:
-                                try:
-                                    if callback["pattern"] in dictionary:
-                                        callback["callbackfct"](dictionary)
-                                except Exception as e:
-                                    self._logger.error("[ProcessCommands]: " + str(e))
+                        metrics.response_received(dictionary["qid"], self)
+                if "qid" in dictionary:
+                    if dictionary["qid"] in self.responses:
+                        self.responses[dictionary["qid"]].append(dictionary)
                     else:
-                        self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+                        self.responses[dictionary["qid"]] = [dictionary]
+                        
+                    if self.DEBUG: 
+                        self._logger.debug(f"Received response for query ID: {dictionary['qid'], dictionary}")
+                    
+                    self.pendingRequests.resolve(dictionary["qid"], dictionary)
+                    
+                    if len(self.callBackList) > 0:
+                        for callback in self.callBackList:
+                            try:
+                                if callback["pattern"] in dictionary:
+                                    callback["callbackfct"](dictionary)
+                            except Exception as e:
+                                self._logger.error("[ProcessCommands]: " + str(e))
+                else:
+                    self._logger.debug(f"Dictionary does not contain 'qid': {dictionary}")
+
+                self.subscriptions.publish(dictionary)
 
-            except Exception as e:
-                self._logger.debug(f"Failed to decode data: {data}. Error: {e}")
-            await asyncio.sleep(0.05)
-        self.isWritingLoopRunning = False
+        except Exception as e:
+            self._logger.debug(f"Failed to decode data: {e}")
+
+    def getMetrics(self):
+        '''
+        Snapshot of the link statistics as a dictionary (round trip histograms per
+        task in ms, byte/frame rates, parse errors, timeouts, queue depths), None if disabled
+        '''
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(data_queue=self.data_queue.qsize() if self.data_queue is not None else 0,
+                                     pending_requests=len(self.pendingRequests),
+                                     framing=self.framer.stats())
 
     def register_callback(self, callback, pattern):
         self.callBackList.append({"callbackfct": callback, "pattern": pattern})
 
-    async def write_data(self, data: str):
+    def subscribe(self, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        '''
+        async for frame in serial.subscribe(pattern): the received frames that have
+        pattern as a top-level key (all frames for None)
+        
+        Every subscriber gets its own queue of up to maxsize frames, overflow is
+        "drop-oldest", "drop-newest" or "block" (pauses reading from the port until
+        the subscriber catches up). Iterating ends when the port is closed.
+        '''
+        subscription = AsyncSubscription(self.subscriptions, self.loop, pattern, maxsize, overflow)
+        return self.subscriptions.add(subscription)
+
+    def _set_reading_paused(self, isPaused):
+        '''
+        Back pressure of "block" subscriptions: hold back reading from the port
+        '''
+        if self.runtime is not None and not self.runtime.in_loop_thread():
+            # e.g. a subscription closed from a synchronous caller, the transport belongs to the loop
+            self.loop.call_soon_threadsafe(self._set_reading_paused, isPaused)
+            return
+        self._isReadingPaused = isPaused
+        if self._transport is not None:
+            if isPaused:
+                self._transport.pause_reading()
+            else:
+                self._transport.resume_reading()
+
+    async def write_data(self, data):
         if self.DEBUG: self._logger.debug(f"Writing data: {data}")
-        await asyncio.get_event_loop().run_in_executor(None, self.serial_device.write, data.encode('utf-8'))
-        await asyncio.get_event_loop().run_in_executor(None, self.serial_device.flush)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+        if self._transport is not None:
+            # non-blocking write on the shared loop, wait until the port took all of it
+            self._transport.write(data)
+            await self._transport.drain()
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.serial_device.write, data)
+        await loop.run_in_executor(self.executor, self.serial_device.flush)
 
     async def sendMessage(self, data: str, nResponses: int = 1, mTimeout: float = 20.0, blocking: bool = True):
         if type(data) == str:
-            data = json.loads(data)
+            data = json_loads(data)
         try:
             cqid = data["qid"]
             self.identifier_counter = cqid
         except:
             cqid = self._generate_identifier()
+            data = dict(data, qid=cqid)    # the device echoes the qid, the caller's dictionary is left alone
         if self.DEBUG: self._logger.debug(f"Sending message: {cqid}, blocking: {blocking}, message length: {len(data)}")
-        await self.write_data(json.dumps(data))
-        cTime = time.time()
 
         if nResponses == 0 or mTimeout <= 0 or not blocking:
-            blocking = False
+            await self.write_data(json_dumps(data))
             await asyncio.sleep(0.1)
             return cqid
 
-        while blocking:
-            try:
-                if time.time() - cTime > mTimeout:
-                    self._logger.debug(f"Timeout of {mTimeout} seconds reached for QID: {cqid}.")
-                    break
-                qids = self.queueFinalizedQueryIDs.get()
-                if cqid in qids and qids.count(cqid) >= nResponses:
-                    await asyncio.sleep(0.15)  # let the serial settle for a bit
-                    return self.responses[cqid]
-                if -cqid in qids:
-                    self._logger.debug("You have sent the wrong command!")
-                    return "Wrong Command"
-            except queue.Empty:
-                pass
-            await asyncio.sleep(0.05)
+        # register the QID before writing so that a fast response cannot be missed
+        request = self.pendingRequests.register(cqid, nResponses, loop=asyncio.get_running_loop())
+        if self.metrics is not None:
+            self.metrics.command_sent(cqid, data.get("task"), self)
+        try:
+            await self.write_data(json_dumps(data))
+            if not await request.wait(mTimeout):
+                self._logger.debug(f"Timeout of {mTimeout} seconds reached for QID: {cqid}.")
+                if self.metrics is not None:
+                    self.metrics.timed_out(cqid, self)
+                return None
+        finally:
+            self.pendingRequests.discard(request)
+            if self.metrics is not None:
+                self.metrics.forget(cqid, self)
+        if request.isWrongCommand:
+            self._logger.debug("You have sent the wrong command!")
+            return "Wrong Command"
+        if request.isCancelled:
+            self._logger.debug(f"Waiting for query ID {cqid} was cancelled.")
+            return None
+        return request.responses
 
     async def get_json(self, path, timeout=1):
         message = {"task": path}
-        message = json.dumps(message)
         return await self.sendMessage(message, nResponses=0, mTimeout=timeout)
 
     async def post_json(self, path, payload, getReturn=True, nResponses=1, timeout=100):
@@ -0,0 +1,208 @@
+import asyncio
+import os
+
+MAX_READ_SIZE = 65536
+
+
+class SerialTransport(asyncio.Transport):
+    '''
+    asyncio transport on the file descriptor of an opened serial port
+
+    The port is switched to non-blocking mode and watched with
+    loop.add_reader/add_writer, so reading and writing happen on the event
+    loop itself without any executor thread. With an asyncio.BufferedProtocol
+    the bytes are read straight into the buffer the protocol hands out.
+    Only available on POSIX systems where the port exposes fileno().
+    '''
+    def __init__(self, loop, protocol, serial_device):
+        super().__init__(extra={"serial": serial_device})
+        self._loop = loop
+        self._protocol = protocol
+        self.serial_device = serial_device
+        self._fd = serial_device.fileno()
+        os.set_blocking(self._fd, False)
+        self._isBufferedProtocol = isinstance(protocol, asyncio.BufferedProtocol)
+        self._writeBuffer = bytearray()
+        self._drainWaiters = []
+        self._isClosing = False
+        self._isReading = False
+        self._isConnectionLost = False
+        self._loop.call_soon(self._protocol.connection_made, self)
+        self._loop.call_soon(self.resume_reading)
+
+    @staticmethod
+    def is_supported(serial_device):
+        if os.name != "posix" or not hasattr(serial_device, "fileno"):
+            return False
+        try:
+            return serial_device.fileno() is not None
+        except Exception:
+            return False
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_protocol(self, protocol):
+        self._protocol = protocol
+        self._isBufferedProtocol = isinstance(protocol, asyncio.BufferedProtocol)
+
+    def is_closing(self):
+        return self._isClosing
+
+    def is_reading(self):
+        return self._isReading
+
+    def pause_reading(self):
+        if self._isReading:
+            self._loop.remove_reader(self._fd)
+            self._isReading = False
+
+    def resume_reading(self):
+        if not self._isReading and not self._isClosing:
+            self._loop.add_reader(self._fd, self._read_ready)
+            self._isReading = True
+
+    def _read_ready(self):
+        try:
+            if self._isBufferedProtocol:
+                nBytes = os.readv(self._fd, [self._protocol.get_buffer(-1)])
+                data = None
+            else:
+                data = os.read(self._fd, MAX_READ_SIZE)
+                nBytes = len(data)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._fatal_error(e)
+            return
+        if not nBytes:
+            # readable but empty means the port was closed/unplugged
+            self._fatal_error(OSError("device reports readiness to read but returned no data"))
+            return
+        if data is None:
+            self._protocol.buffer_updated(nBytes)
+        else:
+            self._protocol.data_received(data)
+
+    def get_write_buffer_size(self):
+        return len(self._writeBuffer)
+
+    def write(self, data):
+        if self._isClosing:
+            raise RuntimeError("Cannot write to a closing transport")
+        if not data:
+            return
+        if not self._writeBuffer:
+            # try to get rid of it right away, buffer what the port does not take
+            try:
+                nBytes = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                nBytes = 0
+            except OSError as e:
+                self._fatal_error(e)
+                return
+            if nBytes == len(data):
+                return
+            data = memoryview(data)[nBytes:]
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._writeBuffer += data
+
+    def _write_ready(self):
+        try:
+            nBytes = os.write(self._fd, self._writeBuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._fatal_error(e)
+            return
+        del self._writeBuffer[:nBytes]
+        if self._writeBuffer:
+            return
+        self._loop.remove_writer(self._fd)
+        self._wake_drain_waiters()
+        if self._isClosing:
+            self._call_connection_lost(None)
+
+    async def drain(self):
+        '''
+        Wait until the port took everything written so far
+        '''
+        if not self._writeBuffer:
+            return
+        if self._isConnectionLost:
+            raise ConnectionResetError("Connection lost")
+        waiter = self._loop.create_future()
+        self._drainWaiters.append(waiter)
+        await waiter
+
+    def _wake_drain_waiters(self, exc=None):
+        waiters, self._drainWaiters = self._drainWaiters, []
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+    def can_write_eof(self):
+        return False
+
+    def close(self):
+        '''
+        Stop reading, write what is buffered and call connection_lost;
+        the serial device itself stays open
+        '''
+        if self._isClosing:
+            return
+        self._isClosing = True
+        self.pause_reading()
+        if not self._writeBuffer:
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self._force_close(None)
+
+    def _fatal_error(self, exc):
+        self._force_close(exc)
+
+    def _force_close(self, exc):
+        if self._isConnectionLost:
+            return
+        if self._writeBuffer:
+            self._writeBuffer.clear()
+            self._loop.remove_writer(self._fd)
+        self._isClosing = True
+        self.pause_reading()
+        self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc):
+        if self._isConnectionLost:
+            return
+        self._isConnectionLost = True
+        self._wake_drain_waiters(exc if exc is not None else ConnectionResetError("Connection lost"))
+        self._protocol.connection_lost(exc)
+
+
+class FramerProtocol(asyncio.BufferedProtocol):
+    '''
+    Lets a SerialTransport read straight into the buffer of a FrameParser
+
+    on_received(nBytes) is called after every read to parse the new bytes,
+    on_connection_lost(exc) once the transport is gone.
+    '''
+    def __init__(self, framer, on_received, on_connection_lost=None):
+        self.framer = framer
+        self._on_received = on_received
+        self._on_connection_lost = on_connection_lost
+
+    def get_buffer(self, sizehint):
+        return self.framer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.framer.buffer_updated(nbytes)
+        self._on_received(nbytes)
+
+    def connection_lost(self, exc):
+        if self._on_connection_lost is not None:
+            self._on_connection_lost(exc)
@@ -19,6 +19,7 @@ import threading
 import re
 import time
 import argparse
+from collections import deque, OrderedDict
 
 import serial
 import urwid
@@ -40,6 +41,10 @@ stopbits_values = {'1': serial.STOPBITS_ONE,
                    '1.5': serial.STOPBITS_ONE_POINT_FIVE,
                    '2': serial.STOPBITS_TWO}
 
+DEFAULT_SCROLLBACK = 10000  # received lines kept in the receive window
+MAX_LINE_LENGTH = 4096      # longer lines (e.g. output without newlines) are wrapped onto new lines
+WIDGET_CACHE_SIZE = 512     # laid out lines kept around for redrawing
+
 
 class ConsoleEdit(urwid.Edit):
     def __init__(self, callback, *args, **kwargs):
@@ -120,17 +125,144 @@ class ScrollingTextOverlay(urwid.Overlay):
         return super(ScrollingTextOverlay, self).keypress(size, key)
 
 
+class ScrollbackWalker(urwid.ListWalker):
+    """
+    The received text as a bounded list of lines for a ListBox.
+
+    Only the last ``max_lines`` lines are kept, older ones are dropped as new
+    ones arrive. Positions are line numbers counted from the start of the
+    session, so they stay valid while lines are dropped. The Text widgets are
+    only created for the lines the ListBox asks for (the visible ones) and a
+    few of them are cached, appending and redrawing cost the same however long
+    the session runs. The focus follows new lines unless the user scrolled up.
+    Lines longer than ``max_line_length`` are continued on a new line, so
+    output that never ends a line cannot grow a single line without bound.
+    """
+    def __init__(self, max_lines=DEFAULT_SCROLLBACK, max_line_length=MAX_LINE_LENGTH):
+        """
+        Parameters
+        ----------
+        max_lines : int
+            The number of lines to keep.
+        max_line_length : int
+            The number of characters after which a line is wrapped.
+        """
+        self.lines = deque(maxlen=max_lines)
+        self.max_line_length = max_line_length
+        self.first = 0          # line number of lines[0]
+        self.focus = None
+        self._is_line_open = False  # the last line has not received its newline yet
+        self._widgets = OrderedDict()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, position):
+        if position is None or not self.first <= position < self.first + len(self.lines):
+            raise IndexError(position)
+        widget = self._widgets.get(position)
+        if widget is None:
+            widget = self._widgets[position] = urwid.Text(self.lines[position - self.first])
+            if len(self._widgets) > WIDGET_CACHE_SIZE:
+                self._widgets.popitem(last=False)
+        return widget
+
+    def next_position(self, position):
+        if position + 1 >= self.first + len(self.lines):
+            raise IndexError(position + 1)
+        return position + 1
+
+    def prev_position(self, position):
+        if position - 1 < self.first:
+            raise IndexError(position - 1)
+        return position - 1
+
+    def get_focus(self):
+        try:
+            return self[self.focus], self.focus
+        except IndexError:
+            return None, None
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        try:
+            position = self.next_position(position)
+            return self[position], position
+        except IndexError:
+            return None, None
+
+    def get_prev(self, position):
+        try:
+            position = self.prev_position(position)
+            return self[position], position
+        except IndexError:
+            return None, None
+
+    @property
+    def last_position(self):
+        return self.first + len(self.lines) - 1 if self.lines else None
+
+    def append(self, text):
+        """
+        Add received text, lines are completed across calls.
+
+        Parameters
+        ----------
+        text : str
+            The decoded text, "\\r\\n" and "\\n" end a line.
+        """
+        if not text:
+            return
+        follow = self.focus is None or self.focus == self.last_position
+        new_lines = text.replace('\r\n', '\n').split('\n')
+        if self._is_line_open:
+            # the first piece continues the open line, which is taken out and added again
+            self._widgets.pop(self.last_position, None)
+            new_lines[0] = self.lines.pop() + new_lines[0]
+        self._is_line_open = new_lines[-1] != ''
+        if not self._is_line_open:
+            new_lines.pop()
+        for i, line in enumerate(new_lines):
+            body = line.rstrip('\r')
+            # a "\r" waiting for its "\n" stays with the open line, the others are dropped
+            tail = line[len(body):] if i == len(new_lines) - 1 and self._is_line_open else ''
+            starts = range(0, max(len(body), 1), self.max_line_length)
+            for start in starts:
+                chunk = body[start:start + self.max_line_length]
+                self._append_line(chunk + tail if start == starts[-1] else chunk)
+        if follow or (self.focus is not None and self.focus < self.first):
+            self.focus = self.last_position
+        self._modified()
+
+    def _append_line(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self._widgets.pop(self.first, None)
+            self.first += 1
+        self.lines.append(line)
+
+    def clear(self):
+        self.first += len(self.lines)
+        self.lines.clear()
+        self._widgets.clear()
+        self._is_line_open = False
+        self.focus = None
+        self._modified()
+
+
 class Sermon(object):
     """
     The main serial monitor class. Starts a read thread that polls the serial
     device and prints results to top window. Sends commands to serial device
     after they have been executed in the curses textpad.
     """
-    def __init__(self, device, baudrate=500000, byte_size=8, parity=None, stopbits=1, xonxoff=None, rtscts=None, dsrdtr=None):
-        # Receive display widgets
-        self.receive_window = urwid.Text('')
-        body = urwid.ListBox([self.receive_window, urwid.Text('')])
-        body.set_focus(1)
+    def __init__(self, device, baudrate=500000, byte_size=8, parity=None, stopbits=1, xonxoff=None, rtscts=None, dsrdtr=None,
+                 scrollback=DEFAULT_SCROLLBACK):
+        # Receive display widgets, the last `scrollback` received lines
+        self.receive_window = ScrollbackWalker(scrollback)
+        body = urwid.ListBox(self.receive_window)
 
         # Draw main frame with status header and footer for commands.
         self.conection_msg = urwid.Text('', 'left')
@@ -190,8 +322,7 @@ class Sermon(object):
         self.loop.widget = ScrollingTextOverlay(content, self.frame)
 
     def received_data(self, data):
-        self.receive_window.set_text(self.receive_window.text +
-                                     data.decode('latin1'))
+        self.receive_window.append(data.decode('latin1'))
         if self.logging:
             try:
                 with open(self.logfile, 'a') as f:
@@ -272,8 +403,15 @@ def main():
     device = "/dev/cu.SLAB_USBtoUART"
     baudrate = 500000
 
+    parser = argparse.ArgumentParser(description='Serial device monitor and transmitter.')
+    parser.add_argument('device', nargs='?', default=device,
+                        help='serial port of the device')
+    parser.add_argument('-b', '--baudrate', type=int, default=baudrate)
+    parser.add_argument('--scrollback', type=int, default=DEFAULT_SCROLLBACK,
+                        help='number of received lines kept in the receive window')
+    args = parser.parse_args()
 
-    app = Sermon(device, baudrate)
+    app = Sermon(args.device, args.baudrate, scrollback=args.scrollback)
     #app.start()
     def toggleLED():
         while 1:
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+from collections import deque
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class _BaseSubscription:
+    '''
+    Bounded queue of the received frames that match a pattern
+
+    pattern is a top-level key the frames must have (None for all frames),
+    overflow decides what happens when maxsize frames are waiting:
+    "drop-oldest" discards the oldest waiting frame, "drop-newest" the frame
+    that just came in, "block" holds back the reading of the port until the
+    subscriber caught up (this stalls every other consumer of the port too).
+    '''
+    def __init__(self, hub, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, choose one of {', '.join(OVERFLOW_POLICIES)}")
+        if maxsize < 1:
+            raise ValueError("A subscription needs room for at least one frame")
+        self.pattern = pattern
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.nReceived = 0
+        self.nDropped = 0
+        self.isClosed = False
+        self._hub = hub
+        self._frames = deque()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def matches(self, dictionary):
+        return self.pattern is None or self.pattern in dictionary
+
+    @property
+    def isBlocking(self):
+        '''
+        True while the subscription asks the reader to hold back
+        '''
+        return False
+
+    def close(self):
+        '''
+        Stop receiving frames, iterating ends once the waiting frames are consumed
+        '''
+        self._hub.remove(self)
+        self._close()
+
+    def stats(self):
+        return {"pattern": self.pattern, "overflow": self.overflow,
+                "queued": len(self._frames), "maxsize": self.maxsize,
+                "received": self.nReceived, "dropped": self.nDropped}
+
+
+class Subscription(_BaseSubscription):
+    '''
+    Subscription for threaded clients, iterate over it to get the frames
+
+        with serial.subscribe("motor") as frames:
+            for frame in frames:
+                ...
+
+    With the "block" policy put() waits on the parsing thread until the
+    subscriber took a frame.
+    '''
+    def __init__(self, hub, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        super().__init__(hub, pattern, maxsize, overflow)
+        self._condition = threading.Condition()
+
+    def put(self, frame):
+        with self._condition:
+            if self.isClosed:
+                return
+            if len(self._frames) >= self.maxsize:
+                if self.overflow == DROP_NEWEST:
+                    self.nDropped += 1
+                    return
+                if self.overflow == DROP_OLDEST:
+                    self._frames.popleft()
+                    self.nDropped += 1
+                else:
+                    self._condition.wait_for(lambda: len(self._frames) < self.maxsize or self.isClosed)
+                    if self.isClosed:
+                        return
+            self._frames.append(frame)
+            self.nReceived += 1
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        '''
+        Wait for the next frame, returns None on timeout or once closed and empty
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self._frames or self.isClosed, timeout)
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self._condition.notify_all()
+            return frame
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frame = self.get()
+        if frame is None:
+            raise StopIteration
+        return frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _close(self):
+        with self._condition:
+            self.isClosed = True
+            self._condition.notify_all()
+
+
+class AsyncSubscription(_BaseSubscription):
+    '''
+    Subscription for the asyncio clients, frames are put on the loop thread
+
+        async for frame in serial.subscribe("motor"):
+            ...
+
+    With the "block" policy the frames are kept and the hub pauses reading
+    from the port until the subscriber caught up, the loop itself never blocks.
+    '''
+    def __init__(self, hub, loop, pattern=None, maxsize=100, overflow=DROP_OLDEST):
+        super().__init__(hub, pattern, maxsize, overflow)
+        self._loop = loop
+        self._waiter = None
+
+    @property
+    def isBlocking(self):
+        return self.overflow == BLOCK and len(self._frames) >= self.maxsize
+
+    def put(self, frame):
+        if self.isClosed:
+            return
+        if len(self._frames) >= self.maxsize:
+            if self.overflow == DROP_NEWEST:
+                self.nDropped += 1
+                return
+            if self.overflow == DROP_OLDEST:
+                self._frames.popleft()
+                self.nDropped += 1
+        self._frames.append(frame)
+        self.nReceived += 1
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self):
+        '''
+        Wait for the next frame, returns None once closed and empty
+        '''
+        while not self._frames:
+            if self.isClosed:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        wasBlocking = self.isBlocking
+        frame = self._frames.popleft()
+        if wasBlocking:
+            self._hub.update_blocked()
+        return frame
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _close(self):
+        self.isClosed = True
+        try:
+            isLoopThread = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            isLoopThread = False
+        if isLoopThread:
+            self._wake()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+
+class SubscriptionHub:
+    '''
+    Hands every decoded frame to the subscriptions whose pattern it matches
+
+    onBlocked(isBlocked) is called when an asynchronous subscription with the
+    "block" policy fills up or catches up again, the client pauses or resumes
+    reading from the port accordingly.
+    '''
+    def __init__(self, onBlocked=None):
+        self._subscriptions = ()    # copy on write, publish() reads it without the lock
+        self._lock = threading.Lock()
+        self._onBlocked = onBlocked
+        self.isBlocked = False
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def add(self, subscription):
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def remove(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        if subscription.isBlocking:
+            self.update_blocked()
+
+    def publish(self, dictionary):
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        for subscription in subscriptions:
+            if subscription.matches(dictionary):
+                subscription.put(dictionary)
+        self.update_blocked()
+
+    def update_blocked(self):
+        isBlocked = any(subscription.isBlocking for subscription in self._subscriptions)
+        if isBlocked != self.isBlocked:
+            self.isBlocked = isBlocked
+            if self._onBlocked is not None:
+                self._onBlocked(isBlocked)
+
+    def close_all(self):
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, ()
+        for subscription in subscriptions:
+            subscription._close()
+        self.update_blocked()
+
+    def stats(self):
+        return [subscription.stats() for subscription in self._subscriptions]
@@ -0,0 +1,557 @@
+import argparse
+import heapq
+import json
+import os
+import pty
+import random
+import re
+import selectors
+import sys
+import time
+import tty
+
+BOOT_BANNER = (b"ets Jun  8 2016 00:22:57\r\n"
+               b"rst:0x1 (POWERON_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)\r\n"
+               b"on port 80\n{'setup':'done'}\n")
+REBOOT_NOTICE = b"reboot\n"
+T_ANNOUNCE = .2     # seconds between two boot banners while the host has not talked to the board yet
+T_BOOT = .5         # seconds a reboot takes until the boot banner is printed
+WIRE_CHUNK = .001   # seconds of wire time per chunk written when the baud rate is emulated
+T_PRINT = .005      # seconds between two prints of one response
+RESPONSE_FAULTS = ("drop", "corrupt", "split")     # change the next printed response
+EVENT_FAULTS = ("reboot", "stall", "debug")         # happen at a point in time
+
+_STRUCTURE = re.compile(rb'[{}"\\]')
+_OPEN, _CLOSE, _QUOTE, _BACKSLASH = b"{}\"\\"
+
+
+def text_frame(document):
+    '''
+    A response as the firmware prints it: pretty printed JSON between "++" and "--"
+    '''
+    return b"++\n" + json.dumps(document, indent="\t").encode("utf-8") + b"\n--\n"
+
+
+class FirmwareEmulator:
+    '''
+    The command handling of a UC2 board, without any I/O
+
+    receive(data) takes the bytes the host wrote (JSON commands, split
+    anywhere) and returns the frames the board prints in response. Every
+    response echoes the qid of its command, commands with an unknown task
+    are answered with -qid. A response is a list of prints: commands
+    without a qid (the handshake of checkFirmware) get the "++" line printed
+    on its own before the rest of the frame, like the firmware that prints
+    the frame line by line. {"task": "/state_act", "restart": 1} sets
+    isRebootRequested, the owner of the emulator prints REBOOT_NOTICE and
+    the boot banner.
+    '''
+    def __init__(self, identity="UC2_Feather", nLeds=64, nSteppers=4, maxCommandSize=1 << 20):
+        self.identity = identity
+        self.maxCommandSize = maxCommandSize
+        self.steppers = {i: {"stepperid": i, "position": 0, "speed": 0, "isDone": 1} for i in range(nSteppers)}
+        self.leds = [{"id": i, "r": 0, "g": 0, "b": 0} for i in range(nLeds)]
+        self.lasers = {}
+        self.isRebootRequested = False
+        self.nCommands = 0
+        self.nUnknown = 0
+        self.nInvalid = 0
+        self._buffer = bytearray()
+        self._scanned = 0           # bytes of the buffer that were scanned already
+        self._depth = 0             # nesting of the command being received, 0 between commands
+        self._isInString = False
+        self._escapedIndex = -1     # index of the character following a backslash in a string
+        self._tasks = {"/state_get": self._state_get, "/state_act": self._state_act,
+                       "/motor_act": self._motor_act, "/motor_get": self._motor_get,
+                       "/ledarr_act": self._ledarr_act, "/ledarr_get": self._ledarr_get,
+                       "/laser_act": self._laser_act, "/laser_get": self._laser_get,
+                       "/home_act": self._home_act}
+
+    def reset(self):
+        '''
+        Forget a partly received command, e.g. after a reboot
+        '''
+        self._buffer.clear()
+        self._scanned = 0
+        self._depth = 0
+        self._isInString = False
+        self._escapedIndex = -1
+        self.isRebootRequested = False
+
+    def receive(self, data):
+        '''
+        Feed bytes written by the host, returns the responses (lists of prints)
+        '''
+        return [response for response in map(self.handle, self._split_commands(data)) if response]
+
+    def _split_commands(self, data):
+        '''
+        Cut complete top-level JSON objects out of the received bytes, anything
+        between two objects (newlines, garbage) is dropped
+        '''
+        buffer = self._buffer
+        buffer += data
+        commands = []
+        start = 0
+        for match in _STRUCTURE.finditer(buffer, self._scanned):
+            index = match.start()
+            char = buffer[index]
+            if self._isInString:
+                if index == self._escapedIndex:
+                    continue
+                if char == _BACKSLASH:
+                    self._escapedIndex = index + 1
+                elif char == _QUOTE:
+                    self._isInString = False
+            elif char == _OPEN:
+                if self._depth == 0:
+                    start = index
+                self._depth += 1
+            elif self._depth == 0:
+                continue    # a quote or closing brace outside of a command
+            elif char == _QUOTE:
+                self._isInString = True
+            elif char == _CLOSE:
+                self._depth -= 1
+                if self._depth == 0:
+                    commands.append(bytes(buffer[start:index + 1]))
+        if self._depth == 0:
+            buffer.clear()
+        else:
+            del buffer[:start]
+            self._escapedIndex -= start
+            if len(buffer) > self.maxCommandSize:
+                self.nInvalid += 1
+                self.reset()
+        self._scanned = len(buffer)
+        return commands
+
+    def handle(self, command):
+        '''
+        Answer one command (bytes or dict), returns the list of prints of the response
+        '''
+        if not isinstance(command, dict):
+            try:
+                command = json.loads(command)
+            except ValueError:
+                self.nInvalid += 1
+                return []
+            if not isinstance(command, dict):
+                self.nInvalid += 1
+                return []
+        self.nCommands += 1
+        qid = command.get("qid")
+        handler = self._tasks.get(command.get("task"))
+        if handler is None:
+            self.nUnknown += 1
+            return [text_frame({"qid": -qid if isinstance(qid, int) else -1})]
+        response = handler(command)
+        if qid is None:
+            return [b"++\n", text_frame(response)[3:]]
+        response["qid"] = qid
+        return [text_frame(response)]
+
+    def _state_get(self, command):
+        return {"identifier_name": self.identity, "identifier_id": "V2.0",
+                "identifier_date": "Mar 10 2024 13:43:21", "identifier_author": "BD",
+                "IDENTIFIER_NAME": "uc2-esp", "configIsSet": 0, "pindef": "UC2_3"}
+
+    def _state_act(self, command):
+        if command.get("restart"):
+            self.isRebootRequested = True
+        return {"success": 1}
+
+    def _motor_act(self, command):
+        for stepper in command.get("motor", {}).get("steppers", ()):
+            state = self.steppers.setdefault(stepper.get("stepperid"), {"stepperid": stepper.get("stepperid"),
+                                                                        "position": 0, "speed": 0, "isDone": 1})
+            if stepper.get("isstop"):
+                continue
+            if stepper.get("isforever"):
+                state["speed"] = stepper.get("speed", 0)
+            elif stepper.get("isabs"):
+                state["position"] = stepper.get("position", 0)
+            else:
+                state["position"] += stepper.get("position", 0)
+        return {"success": 1}
+
+    def _motor_get(self, command):
+        return {"motor": {"steppers": list(self.steppers.values())}}
+
+    def _ledarr_act(self, command):
+        led = command.get("led", {})
+        for pixel in led.get("led_array", ()):
+            index = pixel.get("id")
+            if isinstance(index, int) and 0 <= index < len(self.leds):
+                self.leds[index].update(r=pixel.get("r", 0), g=pixel.get("g", 0), b=pixel.get("b", 0))
+        return {"success": 1}
+
+    def _ledarr_get(self, command):
+        return {"led": {"ledArrNum": len(self.leds), "led_array": self.leds}}
+
+    def _laser_act(self, command):
+        self.lasers[command.get("LASERid")] = command.get("LASERval", 0)
+        return {"success": 1}
+
+    def _laser_get(self, command):
+        return {"laser": [{"LASERid": laserId, "LASERval": value} for laserId, value in self.lasers.items()]}
+
+    def _home_act(self, command):
+        for stepper in command.get("home", {}).get("steppers", ()):
+            if stepper.get("stepperid") in self.steppers:
+                self.steppers[stepper.get("stepperid")]["position"] = 0
+        return {"success": 1}
+
+
+class FaultInjector:
+    '''
+    Faults for the output of a PtyDevice, scripted and/or at random
+
+    The response faults hit a printed response: "drop" loses a few bytes,
+    "corrupt" changes one byte, "split" prints it in two parts with a pause in
+    between, cut inside a "++"/"--" delimiter if there is one. The event faults
+    happen at a point in time: "reboot", "stall" (nothing is printed for a
+    while, then everything at once) and "debug" (a burst of unsolicited log
+    lines). probabilities maps a response fault to the chance it hits a
+    response, rates maps an event fault to its mean number per second. script
+    is a list of (seconds since start, fault, argument or None), a scripted
+    response fault hits the next response after that time. stallTime and
+    debugLines are the defaults of the events.
+    '''
+    def __init__(self, probabilities=None, rates=None, script=(), stallTime=1., debugLines=50, seed=None):
+        self.probabilities = dict(probabilities or {})
+        self.rates = {fault: rate for fault, rate in (rates or {}).items() if rate > 0}
+        self.stallTime = stallTime
+        self.debugLines = debugLines
+        self.counts = {fault: 0 for fault in RESPONSE_FAULTS + EVENT_FAULTS}
+        self._random = random.Random(seed)
+        self._startTime = time.monotonic()
+        self._script = sorted((self._startTime + offset, fault, argument) for offset, fault, argument in script)
+        self._armed = []    # scripted response faults waiting for the next response
+        self._nextRandom = {fault: self._startTime + self._random.expovariate(rate) for fault, rate in self.rates.items()}
+        for fault in self.probabilities:
+            if fault not in RESPONSE_FAULTS:
+                raise ValueError(f"{fault} is no response fault, choose one of {', '.join(RESPONSE_FAULTS)}")
+        for fault in self.rates:
+            if fault not in EVENT_FAULTS:
+                raise ValueError(f"{fault} is no event fault, choose one of {', '.join(EVENT_FAULTS)}")
+        for _, fault, _ in self._script:
+            if fault not in RESPONSE_FAULTS + EVENT_FAULTS:
+                raise ValueError(f"Unknown fault {fault}, choose one of {', '.join(RESPONSE_FAULTS + EVENT_FAULTS)}")
+
+    @staticmethod
+    def parse_script(lines):
+        '''
+        Read a fault script, one "<seconds> <fault> [argument]" per line, "#" starts a comment
+        '''
+        script = []
+        for line in lines:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) not in (2, 3):
+                raise ValueError(f"Fault script line \"{line.strip()}\" is not \"<seconds> <fault> [argument]\"")
+            script.append((float(fields[0]), fields[1], float(fields[2]) if len(fields) == 3 else None))
+        return script
+
+    def next_time(self):
+        '''
+        Monotonic time of the next event, None if there is none
+        '''
+        times = list(self._nextRandom.values())
+        if self._script:
+            times.append(self._script[0][0])
+        return min(times) if times else None
+
+    def due_events(self, now):
+        '''
+        The (fault, argument) events whose time has come, scripted response faults are armed
+        '''
+        events = []
+        while self._script and self._script[0][0] <= now:
+            _, fault, argument = self._script.pop(0)
+            if fault in RESPONSE_FAULTS:
+                self._armed.append(fault)
+            else:
+                events.append((fault, argument))
+        for fault, due in self._nextRandom.items():
+            if due <= now:
+                self._nextRandom[fault] = now + self._random.expovariate(self.rates[fault])
+                events.append((fault, None))
+        for fault, _ in events:
+            self.counts[fault] += 1
+        return events
+
+    def mangle(self, prints):
+        '''
+        Apply the armed and the randomly drawn response faults to the prints of one response
+        '''
+        faults = self._armed
+        self._armed = []
+        faults += [fault for fault in RESPONSE_FAULTS
+                   if self.probabilities.get(fault, 0) > self._random.random()]
+        if not faults or not prints:
+            return prints
+        prints = list(prints)
+        for fault in faults:
+            self.counts[fault] += 1
+            index = self._random.randrange(len(prints))
+            data = prints[index]
+            if not data:
+                continue
+            if fault == "drop":
+                position = self._random.randrange(len(data))
+                prints[index] = data[:position] + data[position + self._random.randint(1, 3):]
+            elif fault == "corrupt":
+                position = self._random.randrange(len(data))
+                prints[index] = data[:position] + bytes([data[position] ^ self._random.randint(1, 255)]) + data[position + 1:]
+            elif fault == "split":
+                delimiters = [match.start() + 1 for match in re.finditer(rb"\+\+|--", data)]
+                position = self._random.choice(delimiters) if delimiters else self._random.randint(1, max(1, len(data) - 1))
+                prints[index:index + 1] = [data[:position], data[position:]]
+        return prints
+
+    def debug_burst(self, nLines=None):
+        '''
+        Unsolicited log output of the firmware
+        '''
+        nLines = self.debugLines if nLines is None else int(nLines)
+        uptime = int((time.monotonic() - self._startTime) * 1e3)
+        return b"".join(b"[%8d][D][main.cpp:%d] loop(): free heap %d, stepper %d at %d\n"
+                        % (uptime + i, 120 + i % 40, 180000 - self._random.randrange(4096), i % 4,
+                           self._random.randrange(-100000, 100000)) for i in range(nLines))
+
+    def stats(self):
+        return dict(self.counts)
+
+
+class PtyDevice:
+    '''
+    A pseudo terminal that behaves like a UC2 board
+
+    Clients open port like any serial port, the emulator sits on the master
+    side. Until the host writes something the boot banner is repeated, like
+    a real board that is reset when its port is opened. latency delays every
+    response, baudrate (None: as fast as possible) emulates the wire time of
+    the printed bytes (10 bits per byte), faults is a FaultInjector. After a
+    reboot the banner is repeated again until the host talks, so that a client
+    reopening the port finds the board. Drive it with serve().
+    '''
+    def __init__(self, emulator=None, baudrate=None, latency=0., announce=True, faults=None):
+        self.emulator = emulator if emulator is not None else FirmwareEmulator()
+        self.faults = faults
+        self.bytesPerSecond = baudrate / 10 if baudrate else None
+        self.latency = latency
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.isAnnouncing = announce
+        self.nBytesReceived = 0
+        self.nBytesSent = 0
+        self._outgoing = []         # heap of (due time, sequence, bytes)
+        self._sequence = 0
+        self._wireFree = 0.         # time everything scheduled so far is printed
+        self._nextAnnounce = 0.
+        self._bootTime = None       # time a reboot is finished
+        self._stallTime = 0.        # nothing is printed before this time
+
+    def fileno(self):
+        return self.master
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def send(self, data, delay=0.):
+        '''
+        Schedule bytes to be printed after delay seconds (plus their wire time),
+        never before the bytes scheduled earlier
+        '''
+        start = max(time.monotonic() + delay, self._wireFree)
+        if self.bytesPerSecond is None:
+            self._schedule(start, data)
+            self._wireFree = start
+            return
+        chunk = max(1, int(self.bytesPerSecond * WIRE_CHUNK))
+        for offset in range(0, len(data), chunk):
+            part = data[offset:offset + chunk]
+            start += len(part) / self.bytesPerSecond
+            self._schedule(start, part)
+        self._wireFree = start
+
+    def _schedule(self, due, data):
+        self._sequence += 1
+        heapq.heappush(self._outgoing, (due, self._sequence, data))
+
+    def reboot(self, bootTime=T_BOOT):
+        '''
+        Print REBOOT_NOTICE, ignore the host until the boot banner is printed bootTime seconds later
+        '''
+        self._outgoing.clear()
+        self._wireFree = 0.
+        self.emulator.reset()
+        self.send(REBOOT_NOTICE)
+        self._bootTime = time.monotonic() + bootTime
+        self.isAnnouncing = True
+        self._nextAnnounce = self._bootTime
+
+    def stall(self, seconds):
+        '''
+        Print nothing for the given seconds, what is due in between is printed afterwards at once
+        '''
+        self._stallTime = max(self._stallTime, time.monotonic() + seconds)
+
+    def read_ready(self):
+        try:
+            data = os.read(self.master, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return  # EIO while no client has the port open
+        if not data:
+            return
+        self.nBytesReceived += len(data)
+        if self._bootTime is not None:
+            if time.monotonic() < self._bootTime:
+                return  # still booting, the bytes are lost
+            self._bootTime = None
+        self.isAnnouncing = False
+        self.handle_received(data)
+
+    def handle_received(self, data):
+        for response in self.emulator.receive(data):
+            if self.faults is not None:
+                response = self.faults.mangle(response)
+            for i, printed in enumerate(response):
+                self.send(printed, self.latency + i * T_PRINT)
+        if self.emulator.isRebootRequested:
+            self.reboot()
+
+    def timeout(self, now):
+        '''
+        Seconds until the next scheduled output, None if there is none
+        '''
+        due = []
+        if self._outgoing:
+            due.append(max(self._outgoing[0][0], self._stallTime))
+        if self.isAnnouncing:
+            due.append(max(self._nextAnnounce, self._stallTime))
+        if self.faults is not None and self.faults.next_time() is not None:
+            due.append(self.faults.next_time())
+        return max(0., min(due) - now) if due else None
+
+    def write_due(self, now):
+        if self.faults is not None:
+            for fault, argument in self.faults.due_events(now):
+                if fault == "reboot":
+                    self.reboot(T_BOOT if argument is None else argument)
+                elif fault == "stall":
+                    self.stall(self.faults.stallTime if argument is None else argument)
+                elif fault == "debug":
+                    self.send(self.faults.debug_burst(argument))
+        if now < self._stallTime:
+            return
+        if self.isAnnouncing and now >= self._nextAnnounce:
+            self._nextAnnounce = now + T_ANNOUNCE
+            self.send(BOOT_BANNER)
+        while self._outgoing and self._outgoing[0][0] <= now:
+            data = self._outgoing[0][2]
+            try:
+                nBytes = os.write(self.master, data)
+            except (BlockingIOError, InterruptedError):
+                return  # the host does not read, try again later
+            except OSError:
+                heapq.heappop(self._outgoing)
+                continue
+            self.nBytesSent += nBytes
+            if nBytes < len(data):
+                self._outgoing[0] = (self._outgoing[0][0], self._outgoing[0][1], data[nBytes:])
+                return
+            heapq.heappop(self._outgoing)
+
+
+def serve(devices, stopEvent=None):
+    '''
+    Run the given PtyDevices from one selector loop until stopEvent is set (forever if None)
+    '''
+    selector = selectors.DefaultSelector()
+    for device in devices:
+        selector.register(device.fileno(), selectors.EVENT_READ, device)
+    try:
+        while stopEvent is None or not stopEvent.is_set():
+            now = time.monotonic()
+            timeouts = [t for t in (device.timeout(now) for device in devices) if t is not None]
+            timeout = min(timeouts + [.1])
+            for key, _ in selector.select(timeout):
+                key.data.read_ready()
+            now = time.monotonic()
+            for device in devices:
+                device.write_due(now)
+    finally:
+        selector.close()
+
+
+def main():
+    '''
+    Command line emulator: serve UC2 boards on pseudo terminals until Ctrl-C
+    '''
+    parser = argparse.ArgumentParser(description="Emulate UC2 boards on pseudo terminals, with fault injection",
+                                     epilog="Connect any client to the printed port, e.g. sermon or mSerial.Serial(port).")
+    parser.add_argument("--devices", type=int, default=1, help="number of boards")
+    parser.add_argument("--baudrate", type=int, default=115200, help="emulated wire speed, 0 for none")
+    parser.add_argument("--latency", type=float, default=0., help="seconds until a command is answered")
+    parser.add_argument("--link", metavar="PATH", help="symlink to the port (PATH0, PATH1, ... for several boards)")
+    parser.add_argument("--drop", type=float, default=0., help="chance of a response to lose bytes")
+    parser.add_argument("--corrupt", type=float, default=0., help="chance of a response to get a corrupted byte")
+    parser.add_argument("--split", type=float, default=0., help="chance of a response to be split inside a delimiter")
+    parser.add_argument("--reboots", type=float, default=0., help="spontaneous reboots per second")
+    parser.add_argument("--stalls", type=float, default=0., help="stalls per second")
+    parser.add_argument("--stall-time", type=float, default=1., help="seconds a stall lasts")
+    parser.add_argument("--debug", type=float, default=0., help="bursts of debug output per second")
+    parser.add_argument("--debug-lines", type=int, default=50, help="lines of a debug burst")
+    parser.add_argument("--script", metavar="FILE", help="scripted faults, one \"<seconds> <fault> [argument]\" per line")
+    parser.add_argument("--seed", type=int, help="seed of the random faults")
+    args = parser.parse_args()
+
+    script = ()
+    if args.script:
+        with open(args.script) as file:
+            script = FaultInjector.parse_script(file)
+    devices = []
+    links = []
+    for i in range(args.devices):
+        faults = FaultInjector({"drop": args.drop, "corrupt": args.corrupt, "split": args.split},
+                               {"reboot": args.reboots, "stall": args.stalls, "debug": args.debug},
+                               script, args.stall_time, args.debug_lines,
+                               None if args.seed is None else args.seed + i)
+        device = PtyDevice(baudrate=args.baudrate or None, latency=args.latency, faults=faults)
+        devices.append(device)
+        if args.link:
+            link = args.link if args.devices == 1 else f"{args.link}{i}"
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(device.port, link)
+            links.append(link)
+        print(f"UC2 board {i} on {device.port}" + (f" ({links[-1]})" if links else ""), flush=True)
+    try:
+        serve(devices)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for link in links:
+            os.unlink(link)
+        stats = [{"port": device.port, "commands": device.emulator.nCommands,
+                  "unknown": device.emulator.nUnknown, "invalid": device.emulator.nInvalid,
+                  "bytes_received": device.nBytesReceived, "bytes_sent": device.nBytesSent,
+                  "faults": device.faults.stats()} for device in devices]
+        print(json.dumps(stats, indent=2), file=sys.stderr)
+        for device in devices:
+            device.close()
+
+
+if __name__ == "__main__":
+    main()
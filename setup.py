@@ -20,6 +20,7 @@ setup(
     license='GPL3',
     keywords='serial monitor console arduino',
     install_requires=['pyserial', 'urwid'],
+    extras_require={'msgpack': ['msgpack'], 'cbor': ['cbor2'], 'fastjson': ['orjson']},
     classifiers=[
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Programming Language :: Python :: 2',
@@ -30,7 +31,7 @@ setup(
         'Topic :: Terminals :: Serial'
     ],
     entry_points={
-        'console_scripts': ['sermon=sermon.sermon:main']
+        'console_scripts': ['sermon=sermon.sermon:main', 'sermon-emulator=sermon.uc2emulator:main']
         },
     version=version,
     description='Serial device monitor and transmitter.',
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the sermon directory for the flat imports of its modules, the package in front of it so that
+# "import sermon" is not shadowed by sermon/sermon.py
+sys.path.insert(0, os.path.join(ROOT, "sermon"))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from commandtemplate import CommandTemplate
+
+MOTOR_ACT = {"task": "/motor_act", "note": "100%",
+             "motor": {"steppers": [{"stepperid": 1, "position": 1000, "speed": 5000}]}}
+FIELDS = {"position": ("motor", "steppers", 0, "position"), "speed": ("motor", "steppers", 0, "speed")}
+
+
+def test_render_matches_the_command_with_the_values_filled_in():
+    template = CommandTemplate(MOTOR_ACT, FIELDS)
+    for values in ({"qid": 7, "position": -20}, {"qid": 8, "speed": 1.5}, {"qid": 9, "position": True}):
+        assert json.loads(template.render(**values)) == template.as_dict(**values)
+    assert json.loads(template.render(qid=10))["motor"]["steppers"][0]["position"] == 1000
+
+
+def test_as_dict_leaves_the_template_alone():
+    template = CommandTemplate(MOTOR_ACT, FIELDS)
+    command = template.as_dict(qid=1, position=5)
+    assert command["motor"]["steppers"][0] == {"stepperid": 1, "position": 5, "speed": 5000}
+    assert template.command["motor"]["steppers"][0]["position"] == 1000
+    assert MOTOR_ACT["motor"]["steppers"][0]["position"] == 1000
+
+
+def test_unknown_fields_and_values_are_rejected():
+    template = CommandTemplate(MOTOR_ACT, FIELDS)
+    with pytest.raises(KeyError):
+        template.render(qid=1, speeed=5)
+    with pytest.raises(TypeError):
+        template.render(qid=1, position="far")
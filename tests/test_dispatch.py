@@ -0,0 +1,28 @@
+import pytest
+
+from dispatch import CallbackDispatcher, InlineExecutor
+
+
+class ShutDownExecutor(InlineExecutor):
+    '''
+    Refuses work like a ThreadPoolExecutor after shutdown() until it is reopened
+    '''
+    def __init__(self):
+        self.isShutDown = True
+
+    def submit(self, fn, *args, **kwargs):
+        if self.isShutDown:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        super().submit(fn, *args, **kwargs)
+
+
+def test_lane_is_scheduled_again_after_the_executor_refused_it():
+    received = []
+    executor = ShutDownExecutor()
+    dispatcher = CallbackDispatcher(executor)
+    dispatcher.register(received.append, "state")
+    with pytest.raises(RuntimeError):
+        dispatcher.dispatch({"state": 1})
+    executor.isShutDown = False
+    dispatcher.dispatch({"state": 2})
+    assert received == [{"state": 1}, {"state": 2}]
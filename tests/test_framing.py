@@ -0,0 +1,43 @@
+from framing import FrameParser, decode_frame, encode_binary_frame
+
+TEXT_FRAME = b'++\n{"qid": 1}\n--\n'
+
+
+def test_sync_bytes_in_text_output_are_ignored_without_binary_framing():
+    framer = FrameParser()
+    frames = framer.feed(b"debug \xa5\x5a\xff\xff output\n" + TEXT_FRAME)
+    assert [bytes(frame) for frame in frames] == [b'\n{"qid": 1}\n']
+
+
+def test_implausible_length_resynchronises_on_the_next_text_frame():
+    framer = FrameParser(acceptBinary=True)
+    frames = framer.feed(b"debug \xa5\x5a\xff\xff output\n" + TEXT_FRAME)
+    assert [bytes(frame) for frame in frames] == [b'\n{"qid": 1}\n']
+    assert framer.nCrcErrors == 1
+
+
+def test_stray_sync_with_plausible_length_fails_the_crc_and_resynchronises():
+    framer = FrameParser(acceptBinary=True)
+    frames = framer.feed(b"\xa5\x5a\x04\x00" + TEXT_FRAME)
+    assert [bytes(frame) for frame in frames] == [b'\n{"qid": 1}\n']
+
+
+def test_binary_frames_split_across_reads():
+    framer = FrameParser(acceptBinary=True)
+    data = encode_binary_frame(b'{"qid": 2}') + TEXT_FRAME
+    frames = []
+    for i in range(len(data)):
+        frames += [bytes(frame) for frame in framer.feed(data[i:i + 1])]
+    assert frames == [b'{"qid": 2}', b'\n{"qid": 1}\n']
+
+
+def test_frame_without_end_marker_does_not_swallow_the_next_frame():
+    data = b'++{"qid":1,"state":"x"\n++\n{"qid":2,"a":1}\n--\n'
+    expected = [b'{"qid":1,"state":"x"\n', b'\n{"qid":2,"a":1}\n']
+    assert [bytes(frame) for frame in FrameParser().feed(data)] == expected
+    framer = FrameParser()
+    frames = []
+    for i in range(len(data)):
+        frames += [bytes(frame) for frame in framer.feed(data[i:i + 1])]
+    assert frames == expected
+    assert [decode_frame(frame)["qid"] for frame in frames] == [1, 2]
@@ -0,0 +1,22 @@
+from metrics import MetricsRegistry
+
+
+def test_clients_sharing_a_registry_do_not_mix_up_their_qids():
+    metrics = MetricsRegistry()
+    metrics.command_sent(1, "/motor_act", "a")
+    metrics.command_sent(1, "/state_get", "b")
+    metrics.response_received(1, "b")
+    snapshot = metrics.snapshot()
+    assert list(snapshot["rtt_ms"]) == ["/state_get"]
+    assert snapshot["in_flight"] == 1
+
+
+def test_forgotten_commands_are_not_in_flight():
+    metrics = MetricsRegistry()
+    metrics.command_sent(1, "/motor_act", "a")
+    metrics.command_sent(2, "/motor_act", "a")
+    metrics.forget(1, "a")
+    metrics.timed_out(2, "a")
+    snapshot = metrics.snapshot()
+    assert snapshot["in_flight"] == 0
+    assert snapshot["timeouts"] == {"/motor_act": 1}
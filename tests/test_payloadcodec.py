@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+from payloadcodec import JSON_BACKENDS, get_json_backend
+
+
+class Position(float):
+    '''
+    Stands in for numpy.float64, a subclass of float
+    '''
+
+
+@pytest.mark.parametrize("name", list(JSON_BACKENDS))
+def test_payloads_the_json_module_takes_are_encoded_by_every_backend(name):
+    try:
+        backend = get_json_backend(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    command = {"task": "/motor_act", "position": Position(1.5), "steps": 2 ** 70, "id": 1}
+    assert json.loads(backend.dumps(command)) == {"task": "/motor_act", "position": 1.5, "steps": 2 ** 70, "id": 1}
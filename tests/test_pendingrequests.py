@@ -0,0 +1,20 @@
+import pytest
+
+from pendingrequests import PendingRequestTable
+
+
+def test_qid_in_flight_is_not_overwritten():
+    table = PendingRequestTable()
+    request = table.register(1)
+    with pytest.raises(ValueError):
+        table.register(1)
+    assert table.resolve(1, {"qid": 1})
+    assert request.responses == [{"qid": 1}]
+
+
+def test_qid_of_a_finished_request_can_be_reused():
+    table = PendingRequestTable()
+    table.register(1).cancel()
+    request = table.register(1)
+    assert table.resolve(1, {"qid": 1})
+    assert request.done
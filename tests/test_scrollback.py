@@ -0,0 +1,39 @@
+import urwid
+
+from sermon.sermon import ScrollbackWalker
+
+
+def test_chunks_without_newline_continue_the_open_line():
+    walker = ScrollbackWalker(5)
+    walker.append('abc')
+    walker.append('def')
+    walker.append('')
+    assert list(walker.lines) == ['abcdef']
+    walker.append('\r')
+    walker.append('\nnext')
+    assert list(walker.lines) == ['abcdef', 'next']
+    assert walker.focus == walker.last_position
+
+
+def test_scrollback_is_bounded():
+    walker = ScrollbackWalker(3)
+    for i in range(10):
+        walker.append('line %d\n' % i)
+    assert list(walker.lines) == ['line 7', 'line 8', 'line 9']
+    assert walker.first == 7
+    widget, position = walker.get_focus()
+    assert position == 9 and widget.text == 'line 9'
+
+
+def test_endless_line_is_wrapped():
+    walker = ScrollbackWalker(100, max_line_length=4)
+    for _ in range(5):
+        walker.append('xyz')
+    assert list(walker.lines) == ['xyzx', 'yzxy', 'zxyz', 'xyz']
+
+
+def test_renders_in_a_listbox():
+    walker = ScrollbackWalker(10)
+    walker.append('one\ntwo\nthr')
+    canvas = urwid.ListBox(walker).render((10, 3))
+    assert [row.rstrip() for row in canvas.text] == [b'one', b'two', b'thr']
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from pendingrequests import PendingRequest
+from sendqueue import SendQueue, command_key
+
+
+def test_command_given_up_while_queued_is_not_written():
+    written = []
+    writable = threading.Event()
+    sendQueue = SendQueue(written.extend, wait_writable=lambda stopEvent: writable.wait())
+    sendQueue.start()
+    try:
+        request = PendingRequest(1, payload=b"move")
+        future = sendQueue.put(b"move", request=request)
+        later = sendQueue.put(b"state")
+        request.cancel()    # the caller timed out while the device was reconnecting
+        writable.set()
+        assert later.result(1)
+        assert future.cancelled()
+        assert written == [b"state"]
+        assert sendQueue.stats()["skipped"] == 1
+    finally:
+        sendQueue.stop()
+
+
+def motor_act(stepper, **mode):
+    return {"task": "/motor_act", "motor": {"steppers": [dict(stepperid=stepper, position=100, speed=500, **mode)]}}
+
+
+def test_absolute_move_and_speed_setting_of_a_stepper_do_not_replace_each_other():
+    absolute = command_key(motor_act(1, isabs=1))
+    assert absolute == command_key(motor_act(1, isabs=1))
+    assert absolute != command_key(motor_act(1, isforever=1))
+    assert command_key(motor_act(1, isabs=0)) is None
+
+    written = []
+    isWaiting = threading.Event()
+    writable = threading.Event()
+
+    def wait_writable(stopEvent):
+        isWaiting.set()
+        return writable.wait()
+
+    sendQueue = SendQueue(written.extend, wait_writable=wait_writable)
+    sendQueue.start()
+    try:
+        sendQueue.put(b"state")
+        assert isWaiting.wait(1)    # the writer holds the first batch, the next commands queue up
+        moved = sendQueue.put(b"move", key=absolute)
+        sendQueue.put(b"speed", key=command_key(motor_act(1, isforever=1)))
+        last = sendQueue.put(b"move again", key=absolute)
+        writable.set()
+        assert last.result(1)
+        assert moved.cancelled()
+        assert written == [b"state", b"move again", b"speed"]
+    finally:
+        sendQueue.stop()
+
+
+def test_stop_interrupts_a_writer_waiting_for_the_device():
+    written = []
+    isWaiting = threading.Event()
+
+    def wait_writable(stopEvent):
+        isWaiting.set()
+        stopEvent.wait()    # the device never comes back
+        return False
+
+    sendQueue = SendQueue(written.extend, wait_writable=wait_writable)
+    sendQueue.start()
+    request = PendingRequest(1)
+    future = sendQueue.put(b"move", request=request)
+    assert isWaiting.wait(1)
+    thread = sendQueue._thread
+    sendQueue.stop()
+    assert not thread.is_alive()
+    assert future.cancelled() and request.isCancelled
+    assert written == []
+    with pytest.raises(RuntimeError):
+        sendQueue.put(b"state")